@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Allocations and time per globe azimuth/altitude call.
+
+Compares globe.Star against the scalar code path before the change: an Angle with an instance __dict__,
+an intermediate Angle for the local hour angle and the latitude/declination trig computed on every call.
+
+Allocations are counted with tracemalloc. Every Angle created during the calls is kept alive until the snapshot,
+so intermediate Angles that are freed at the end of a call are counted too. Floats reused from the interpreter's
+free list are not seen by tracemalloc, so counts are a little below the true number, for both paths alike.
+
+Usage: python -m benchmarks.angle
+"""
+
+import math
+import timeit
+import tracemalloc
+
+import globe
+
+from util.angle import Angle, Degree
+
+
+class DictAngle:
+    'Angle before the change: one __dict__ per instance.'
+
+    def __init__(self, rad):
+        self.__rad = float(rad)
+
+    def rad(self):
+        return self.__rad
+
+    def __float__(self):
+        return self.__rad
+
+
+class BaselineStar:
+    'globe.Star azimuth/altitude before the change'
+
+    angleClass = DictAngle
+
+    def __init__(self, ra, dec):
+        self.ra = ra
+        self.dec = dec
+
+    def azimuth(self, location, gmst):
+        lha = self.local_hour_angle(location, gmst).rad()
+
+        return self.angleClass(globe.azimuth_from_terms(math.sin(lha), math.cos(lha), math.sin(location.lat), math.cos(location.lat), math.tan(self.dec)))
+
+    def altitude(self, location, gmst):
+        lha = self.local_hour_angle(location, gmst).rad()
+
+        return self.angleClass(globe.altitude_from_terms(math.cos(lha), math.sin(location.lat), math.cos(location.lat), math.sin(self.dec), math.cos(self.dec)))
+
+    def local_hour_angle(self, location, gmst):
+        return self.angleClass(gmst.rad() + location.lon.rad() - self.ra.rad())
+
+
+def recording(angleClass, kept):
+    'Subclass of angleClass that keeps every instance in kept'
+    def __init__(self, rad):
+        angleClass.__init__(self, rad)
+        kept.append(self)
+
+    return type(angleClass.__name__, (angleClass,), {'__slots__': (), '__init__': __init__})
+
+
+def paths():
+    'name, star class, module attribute holding the Angle class it allocates, Angle class for inputs'
+    return (("before", BaselineStar, (BaselineStar, 'angleClass'), DictAngle),
+            ("globe", globe.Star, (globe, 'Angle'), Angle))
+
+
+def setup(starClass, angleClass):
+    star_ra, star_dec, lat, lon, sidereal = [angleClass(Degree(v).rad()) for v in (101.3, -16.7, -31.9, 115.9, 40.0)]
+    return starClass(star_ra, star_dec), globe.Location(lat, lon), sidereal
+
+
+def allocations(starClass, target, angleClass, method, count=10000):
+    """
+    Memory blocks allocated per call of star.method, including intermediate Angles.
+
+    :return: tuple of blocks per call, bytes per call
+    """
+    star, location, sidereal = setup(starClass, angleClass)
+    call = getattr(star, method)
+    kept = []
+    results = [None]*count
+    original = getattr(*target)
+    setattr(target[0], target[1], recording(original, kept))
+    try:
+        call(location, sidereal) # warm up caches of the model
+        del kept[:]
+
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        for i in range(count):
+            results[i] = call(location, sidereal)
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+    finally:
+        setattr(target[0], target[1], original)
+
+    differences = after.compare_to(before, 'filename')
+    blocks = sum(d.count_diff for d in differences)
+    size = sum(d.size_diff for d in differences)
+    return blocks / float(count), size / float(count)
+
+
+def evaluation_time(starClass, angleClass, number=20000):
+    'Seconds per azimuth plus altitude call'
+    star, location, sidereal = setup(starClass, angleClass)
+
+    def evaluate():
+        star.azimuth(location, sidereal)
+        star.altitude(location, sidereal)
+
+    return min(timeit.repeat(evaluate, number=number, repeat=7)) / number
+
+
+def run():
+    results = []
+    for name, starClass, target, angleClass in paths():
+        for method in ("azimuth", "altitude"):
+            blocks, size = allocations(starClass, target, angleClass, method)
+            results.append((name, method, blocks, size))
+
+    print("path\tcall\tallocations/call\tbytes/call")
+    for name, method, blocks, size in results:
+        print(name+"\t"+method+"\t"+str(round(blocks, 2))+"\t"+str(round(size, 1)))
+
+    print("")
+    print("path\tus/azimuth+altitude")
+    for name, starClass, target, angleClass in paths():
+        print(name+"\t"+str(round(evaluation_time(starClass, angleClass)*1e6, 3)))
+
+    return results
+
+
+if __name__ == "__main__":
+    run()
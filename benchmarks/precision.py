@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Accuracy and speed of the float32 fast path of globe.positions and flat.trace, against the float64 reference.
+
+The error is measured on a grid over the whole sky (every hour angle and declination, including both celestial poles) and all
+latitudes, with extra rows close to the poles, where the flat model has its centre (north) and its rim (south).
+Altitude error is in radians. Azimuth error is measured along the sky (multiplied by the cosine of altitude),
+since azimuth itself is undefined at the zenith and at the poles. Shell distance error is relative.
+
+Inputs are rounded to float32 as well, so the error includes the rounding of the angles themselves. It grows with the
+size of the angles, so keep them within 0 to 2 pi (or -pi to pi) when using float32.
+
+Usage: python -m benchmarks.precision
+
+Exits with status 1 if an error is larger than its bound in BOUNDS.
+"""
+
+import sys
+import math
+import time
+
+import numpy as np
+
+import flat
+import globe
+import compare
+
+# documented worst case errors of float32 against float64
+BOUNDS = {
+    "altitude": 1e-6, # radians, about 0.2 arc seconds
+    "azimuth": 2e-6, # radians along the sky. Local sidereal time (gmst + lon) is rounded to float32 too.
+    "distance": 1e-6, # relative
+}
+
+NEAR_POLES = (90.0, 89.9, 89.99, 89.999, 89.9999, 89.99999) # degrees
+
+
+def sky_grid(ra_step=1.0, dec_step=1.0, lat_step=1.0, times=6):
+    """
+    ra, dec, lat, lon and gmst arrays in radians covering the whole sky and all latitudes.
+
+    :return: tuple of 1D arrays. lon and gmst are paired (one observer longitude per time).
+    """
+    near = np.array(NEAR_POLES)
+    ra = np.radians(np.arange(0.0, 360.0, ra_step))
+    dec = np.radians(np.unique(np.concatenate((np.arange(-90.0, 90.0 + dec_step/2, dec_step), near, -near))))
+    lat = np.radians(np.unique(np.concatenate((np.arange(-90.0, 90.0 + lat_step/2, lat_step), near, -near))))
+    lon = np.linspace(-math.pi, math.pi, times, endpoint=False) + 0.05
+    gmst = np.linspace(0.0, math.pi*2.0, times, endpoint=False) + 0.1
+    return ra, dec, lat, lon, gmst
+
+
+def angle_errors(reference, fast):
+    'Maximum altitude and azimuth (along the sky) error of az/alt tuples'
+    azimuth, altitude = reference
+    altitude_error = np.abs(fast[1] - altitude)
+    azimuth_error = np.abs(np.mod(fast[0] - azimuth + math.pi, math.pi*2.0) - math.pi)*np.cos(altitude)
+    return altitude_error.max(), azimuth_error.max()
+
+
+def measure(**grid_options):
+    """
+    Worst case float32 errors of both models, one latitude at a time so memory use stays small.
+
+    :return: dict of model name: dict of error name: array of maximum error per latitude, and the latitudes in radians
+    """
+    ra, dec, lats, lon, gmst = sky_grid(**grid_options)
+    ra, dec = ra[:, None, None], dec[None, :, None]
+    lon, gmst = lon[None, None, :], gmst[None, None, :]
+    radius = compare.DEFAULT_CELESTIAL_SHELL_RADIUS
+
+    results = dict((model.__name__, dict((name, np.zeros(len(lats))) for name in ("altitude", "azimuth"))) for model in (globe, flat))
+    results["flat"]["distance"] = np.zeros(len(lats))
+    results["flat"]["valid_mismatches"] = 0
+
+    for i, lat in enumerate(lats):
+        errors = angle_errors(globe.positions(ra, dec, lat, lon, gmst), globe.positions(ra, dec, lat, lon, gmst, dtype=np.float32))
+        results["globe"]["altitude"][i], results["globe"]["azimuth"][i] = errors
+
+        reference = flat.trace(ra, dec, lat, lon, gmst, radius)
+        fast = flat.trace(ra, dec, lat, lon, gmst, radius, dtype=np.float32)
+        errors = angle_errors((reference.azimuth, reference.altitude), (fast.azimuth, fast.altitude))
+        results["flat"]["altitude"][i], results["flat"]["azimuth"][i] = errors
+
+        valid = reference.valid & fast.valid
+        results["flat"]["distance"][i] = (np.abs(fast.distance - reference.distance)[valid] / reference.distance[valid]).max(initial=0.0)
+        results["flat"]["valid_mismatches"] += np.count_nonzero(reference.valid != fast.valid)
+
+    return results, lats
+
+
+def speedup(count=10**6, seed=1):
+    'Microseconds per az/alt evaluation of each model in float64 and float32'
+    state = np.random.RandomState(seed)
+    inputs = [state.uniform(low, high, count) for low, high in ((0, math.pi*2), (-math.pi/2, math.pi/2), (-math.pi/2, math.pi/2), (-math.pi, math.pi), (0, math.pi*2))]
+    times = {}
+    for model in (globe, flat):
+        for dtype in (np.float64, np.float32):
+            args = [a.astype(dtype) for a in inputs]
+            best = None
+            for repeat in range(3):
+                start = time.perf_counter()
+                model.positions(*args, dtype=dtype)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            times[(model.__name__, np.dtype(dtype).name)] = best * 1e6 / count
+    return times
+
+
+def run():
+    results, lat = measure()
+    south = lat < math.radians(-89.0)
+    north = lat > math.radians(89.0)
+    bands = (("all", np.ones(len(lat), dtype=bool)), ("north pole", north), ("south pole/rim", south), ("elsewhere", ~(north | south)))
+
+    missed = []
+    print("model\terror\t" + "\t".join(name for name, band in bands) + "\tbound")
+    for model, errors in sorted(results.items()):
+        for name, bound in sorted(BOUNDS.items()):
+            if name not in errors:
+                continue
+            values = errors[name]
+            print(model+"\t"+name+"\t" + "\t".join("%.2e" % values[band].max() for label, band in bands) + "\t%.0e" % bound)
+            if values.max() > bound:
+                missed.append(model+" "+name)
+
+    if results["flat"]["valid_mismatches"]:
+        missed.append("flat shell intercept validity")
+        print("flat shell intercepts valid in one precision only: "+str(results["flat"]["valid_mismatches"]))
+
+    print("")
+    print("model\tdtype\tus/evaluation")
+    for (model, dtype), seconds in sorted(speedup().items()):
+        print(model+"\t"+dtype+"\t"+str(round(seconds, 4)))
+
+    for name in missed:
+        print("BOUND MISSED: "+name)
+    return not missed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run() else 1)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark suite for both models, catalog loading and compare.py startup.
+
+Usage:
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --baseline results.json
+
+Results are saved as JSON. With --baseline, every result is compared with the stored one and results that are worse by more
+than the tolerance are reported as regressions (exit status 1).
+"""
+
+import os
+import sys
+import json
+import time
+import math
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import numpy as np
+
+import flat
+import globe
+import compare
+
+from util.angle import Angle, HourAngle, Latlon
+from util.location import StarLocation
+from util.catalog import load_catalog
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# cold start targets in seconds, checked on every run. Startup must not depend on catalog size,
+# since catalogs are only opened on first use.
+TARGETS = {
+    "import_models_seconds": 0.3,
+    "compare_startup_seconds": 0.5,
+}
+
+
+class Result:
+    'One measurement. higher_is_better tells the direction of a regression.'
+
+    def __init__(self, value, unit, higher_is_better):
+        self.value = value
+        self.unit = unit
+        self.higher_is_better = higher_is_better
+
+    def to_dict(self):
+        return {"value": self.value, "unit": self.unit, "higher_is_better": self.higher_is_better}
+
+
+def best_time(function, repeat=3):
+    'Shortest wall clock time of several calls'
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def random_inputs(stars, locations, times, seed=1):
+    'Star, location and GMST angles in radians'
+    state = np.random.RandomState(seed)
+    ra = state.uniform(0, math.pi*2.0, stars)
+    dec = np.arcsin(state.uniform(-1, 1, stars))
+    lat = np.arcsin(state.uniform(-1, 1, locations))
+    lon = state.uniform(-math.pi, math.pi, locations)
+    gmst = state.uniform(0, math.pi*2.0, times)
+    return ra, dec, lat, lon, gmst
+
+
+def bench_scalar(stars, locations, times):
+    'az/alt evaluations per second of globe.Star and flat.Star, and flat shell intercepts per second'
+    ra, dec, lat, lon, gmst = random_inputs(stars, locations, times)
+    globe_stars = [globe.Star(Angle(r), Angle(d)) for r, d in zip(ra, dec)]
+    flat_stars = [flat.Star(Angle(r), Angle(d)) for r, d in zip(ra, dec)]
+    globe_locations = [globe.Location(Angle(a), Angle(o)) for a, o in zip(lat, lon)]
+    flat_locations = [flat.Location(Angle(a), Angle(o)) for a, o in zip(lat, lon)]
+    gmsts = [Angle(g) for g in gmst]
+    count = stars*locations*times
+
+    def run_globe():
+        for g in gmsts:
+            for location in globe_locations:
+                for star in globe_stars:
+                    star.azimuth(location, g)
+                    star.altitude(location, g)
+
+    def run_flat():
+        for g in gmsts:
+            for location in flat_locations:
+                for star in flat_stars:
+                    star.azimuth(location, g)
+                    star.altitude(location, g)
+
+    def run_shell():
+        for g in gmsts:
+            for location in flat_locations:
+                for star in flat_stars:
+                    star.shell_intercept(location, g, compare.DEFAULT_CELESTIAL_SHELL_RADIUS)
+
+    return {
+        "globe_star_evals_per_second": Result(count / best_time(run_globe), "evals/s", True),
+        "flat_star_evals_per_second": Result(count / best_time(run_flat), "evals/s", True),
+        "flat_shell_intercepts_per_second": Result(count / best_time(run_shell), "intercepts/s", True),
+    }
+
+
+def bench_batch(stars, locations, times):
+    'az/alt evaluations per second of the vectorized globe.positions and flat.trace'
+    ra, dec, lat, lon, gmst = random_inputs(stars, locations, times)
+    ra, dec = ra[:, None, None], dec[:, None, None]
+    lat, lon = lat[None, :, None], lon[None, :, None]
+    gmst = gmst[None, None, :]
+    count = stars*locations*times
+
+    return {
+        "globe_positions_evals_per_second": Result(count / best_time(lambda: globe.positions(ra, dec, lat, lon, gmst)), "evals/s", True),
+        "flat_positions_evals_per_second": Result(count / best_time(lambda: flat.positions(ra, dec, lat, lon, gmst)), "evals/s", True),
+        "flat_trace_shell_per_second": Result(count / best_time(lambda: flat.trace(ra, dec, lat, lon, gmst, compare.DEFAULT_CELESTIAL_SHELL_RADIUS)), "evals/s", True),
+    }
+
+
+def write_catalog(filename, size, seed=1):
+    'Random star catalog CSV in the 7 column format'
+    generator = random.Random(seed)
+    with open(filename, 'w') as f:
+        f.write("# benchmark catalog\n")
+        for i in range(size):
+            f.write("star_%d, %d,%d,%.2f, %d,%d,%.1f\n" % (i, generator.randint(0, 23), generator.randint(0, 59), generator.uniform(0, 60),
+                    generator.randint(-89, 89), generator.randint(0, 59), generator.uniform(0, 60)))
+
+
+def bench_catalogs(sizes):
+    'CSV parse time of get_location_data and compile/open times of the compiled catalog'
+    results = {}
+    directory = tempfile.mkdtemp()
+    try:
+        for size in sizes:
+            source = os.path.join(directory, "stars_%d.csv" % size)
+            write_catalog(source, size)
+
+            parse = best_time(lambda: compare.get_location_data(source, HourAngle, Latlon, StarLocation))
+
+            start = time.perf_counter()
+            load_catalog(source, HourAngle, Latlon, StarLocation)
+            compile = time.perf_counter() - start
+            load = best_time(lambda: load_catalog(source, HourAngle, Latlon, StarLocation))
+
+            results["get_location_data_seconds_%d" % size] = Result(parse, "s", False)
+            results["catalog_compile_seconds_%d" % size] = Result(compile, "s", False)
+            results["catalog_load_seconds_%d" % size] = Result(load, "s", False)
+    finally:
+        shutil.rmtree(directory)
+
+    return results
+
+
+def bench_startup():
+    """
+    Wall clock time to import flat and globe as a library, to start compare.py and quit at the first prompt,
+    and to run one non-interactive comparison
+    """
+    def imports():
+        subprocess.run([sys.executable, "-c", "import flat, globe"], cwd=ROOT, check=True)
+
+    def interactive():
+        subprocess.run([sys.executable, "compare.py"], input=b"quit\n", cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+
+    def batch():
+        subprocess.run([sys.executable, "compare.py", "run", "--gmst", "0"], cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+
+    return {
+        "import_models_seconds": Result(best_time(imports), "s", False),
+        "compare_startup_seconds": Result(best_time(interactive), "s", False),
+        "compare_run_seconds": Result(best_time(batch), "s", False),
+    }
+
+
+def run(stars, locations, times, sizes, batch_scale):
+    results = {}
+    results.update(bench_scalar(stars, locations, times))
+    results.update(bench_batch(stars*batch_scale, locations*batch_scale, times))
+    results.update(bench_catalogs(sizes))
+    results.update(bench_startup())
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    'Names of results that are worse than the baseline by more than the tolerance (a fraction)'
+    worse = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        old = baseline[name]["value"]
+        if result.higher_is_better:
+            regressed = result.value < old*(1.0 - tolerance)
+        else:
+            regressed = result.value > old*(1.0 + tolerance)
+        if regressed:
+            worse.append(name)
+    return worse
+
+
+def missed_targets(results, targets=TARGETS):
+    'Names of results that are slower than their cold start target'
+    return [name for name, target in sorted(targets.items()) if name in results and results[name].value > target]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite", description="Benchmark both models, catalog loading and compare.py startup.")
+    parser.add_argument("--stars", type=int, default=25)
+    parser.add_argument("--locations", type=int, default=10)
+    parser.add_argument("--times", type=int, default=10)
+    parser.add_argument("--batch-scale", type=int, default=20, help="batch benchmarks use this many times more stars and locations")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000], help="catalog sizes")
+    parser.add_argument("--output", help="save results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline as a fraction (default: 0.2)")
+    args = parser.parse_args(argv)
+
+    os.chdir(ROOT)
+    results = run(args.stars, args.locations, args.times, args.sizes, args.batch_scale)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    for name, result in sorted(results.items()):
+        line = name+"\t"+("%.6g" % result.value)+" "+result.unit
+        if name in baseline:
+            line += "\t(baseline "+("%.6g" % baseline[name]["value"])+")"
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                "meta": {
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "platform": platform.platform(),
+                    "parameters": {"stars": args.stars, "locations": args.locations, "times": args.times, "batch_scale": args.batch_scale, "sizes": args.sizes},
+                },
+                "results": dict((name, result.to_dict()) for name, result in results.items()),
+            }, f, indent=2, sort_keys=True)
+
+    worse = regressions(results, baseline, args.tolerance)
+    for name in worse:
+        print("REGRESSION: "+name)
+
+    missed = missed_targets(results)
+    for name in missed:
+        print("TARGET MISSED: "+name+" (target "+("%g" % TARGETS[name])+" s)")
+
+    return 1 if worse or missed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
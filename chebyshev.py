@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Piecewise Chebyshev approximations of az/alt trajectories, for fast evaluation at arbitrary times.
+
+fit() samples each (star, location) pair with the exact model over a time window, fits a Chebyshev series of fixed degree
+to every segment and checks it against the model between the nodes. Segments that miss the tolerance are halved and fitted
+again, so segments are short only where the trajectory is hard to follow (near the zenith, where azimuth turns quickly).
+Evaluating a series afterwards takes one lookup and a few multiply-adds per query, with no trig calls.
+
+Azimuth is unwrapped before fitting, so crossing 0/360 degrees is a smooth curve, and wrapped again when evaluated.
+Azimuth error is measured along the sky (multiplied by the cosine of altitude), since azimuth itself is undefined at the zenith.
+"""
+
+import math
+from datetime import datetime
+
+import numpy as np
+
+from util.gmst import gmst, RADIANS_PER_SECOND
+
+DEFAULT_DEGREE = 8
+DEFAULT_SEGMENT = 3600.0 # seconds
+DEFAULT_TOLERANCE = 1e-8 # radians
+MAX_DEPTH = 10 # number of times a segment can be halved
+CHUNK_SIZE = 1 << 18 # samples per array pass
+
+
+class Trajectories:
+    """
+    Fitted Chebyshev series for a set of pairs over a time window. Segments are sorted by pair and start time.
+
+    :ivar coefficients: array of shape (segments, 2, degree+1) with azimuth and altitude series
+    :ivar pair: pair index of each segment
+    :ivar start: start of each segment in units of the shortest possible segment
+    :ivar depth: number of times each segment was halved
+    :ivar max_error: largest error found for each pair, in radians
+    """
+
+    def __init__(self, start_gmst, duration, segment, max_depth, pairs, pair, start, depth, coefficients, max_error):
+        self.start_gmst = start_gmst
+        self.duration = duration
+        self.segment = segment
+        self.max_depth = max_depth
+        self.pairs = pairs
+        self.pair = pair
+        self.start = start
+        self.depth = depth
+        self.coefficients = coefficients
+        self.max_error = max_error
+
+        self.unit = segment / 2**max_depth
+        self.count = int(math.ceil(duration/segment))
+        self.span = self.count * 2**max_depth
+        self.keys = pair*(self.span + 1) + start
+
+        # index of the first segment of each initial segment
+        self.first = np.searchsorted(pair*self.count + (start >> max_depth), np.arange(pairs*self.count + 1))
+        self.columns = np.ascontiguousarray(np.transpose(coefficients, (2, 1, 0))) # (degree+1, 2, segments) for evaluation
+
+        # maps time to the -1 to 1 range of each segment
+        t0, t1 = _bounds(start, depth, self.unit, max_depth, duration)
+        self.origin = t0
+        self.scale = 2.0/(t1 - t0)
+
+    @property
+    def degree(self):
+        return self.coefficients.shape[2] - 1
+
+    def positions(self, pair, time):
+        """
+        Azimuth and altitude of pairs at times within the window. Arguments are broadcast against each other.
+
+        :param pair: pair index
+        :param time: seconds since the start of the window
+
+        :return: tuple of azimuth and altitude arrays in radians
+        """
+        pair, time = np.broadcast_arrays(np.asarray(pair, dtype=np.int64), np.asarray(time, dtype=np.float64))
+        if np.any(time < 0) or np.any(time > self.duration):
+            raise ValueError("Time outside of fitted window")
+
+        # most initial segments were never halved and are found directly. Only the others need a search.
+        units = np.minimum(np.floor(time/self.unit).astype(np.int64), self.span - 1)
+        top = pair*self.count + (units >> self.max_depth)
+        i = self.first[top]
+        split = self.first[top + 1] - i > 1
+        if np.any(split):
+            i[split] = np.searchsorted(self.keys, pair[split]*(self.span + 1) + units[split], 'right') - 1
+
+        x = (time - self.origin[i])*self.scale[i] - 1.0
+
+        # Clenshaw recurrence for azimuth and altitude together, gathering one coefficient at a time
+        x2 = 2.0*x
+        b1 = np.zeros((2,) + x.shape)
+        b2 = np.zeros_like(b1)
+        for j in range(self.degree, 0, -1):
+            b1, b2 = self.columns[j].take(i, axis=1) + x2*b1 - b2, b1
+        azimuth, altitude = self.columns[0].take(i, axis=1) + x*b1 - b2
+
+        return np.mod(azimuth, math.pi*2.0), altitude
+
+    def save(self, filename):
+        'Saves the coefficients and segment table in numpy .npz format'
+        np.savez(filename, start_gmst=self.start_gmst, duration=self.duration, segment=self.segment, max_depth=self.max_depth,
+                pairs=self.pairs, pair=self.pair, start=self.start, depth=self.depth, coefficients=self.coefficients, max_error=self.max_error)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            return cls(float(data['start_gmst']), float(data['duration']), float(data['segment']), int(data['max_depth']), int(data['pairs']),
+                    data['pair'], data['start'], data['depth'], data['coefficients'], data['max_error'])
+
+
+def fit(model, ra, dec, lat, lon, start, duration, tolerance=DEFAULT_TOLERANCE, degree=DEFAULT_DEGREE, segment=DEFAULT_SEGMENT, max_depth=MAX_DEPTH):
+    """
+    Fits az/alt trajectories of (star, location) pairs. Star and location arrays are broadcast against each other
+    and flattened, so pair i has the i-th value of each.
+
+    :param model: globe or flat module
+    :param ra: Right Ascension in radians
+    :param dec: Declination in radians
+    :param lat: latitude of location in radians
+    :param lon: longitude of location in radians
+    :param start: datetime (UTC) or GMST in radians at the start of the window
+    :param duration: length of the window in seconds
+    :param tolerance: maximum error in radians. Segments are halved until they meet it, at most max_depth times.
+        Check max_error of the result for pairs that could not meet it.
+    :param degree: degree of the Chebyshev series
+    :param segment: initial segment length in seconds
+
+    :return: Trajectories
+    """
+    ra, dec, lat, lon = [np.ravel(a) for a in np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in (ra, dec, lat, lon)])]
+    start_gmst = gmst(start).rad() if isinstance(start, datetime) else float(start)
+    if duration <= 0:
+        raise ValueError("Duration must be positive")
+
+    pairs = len(ra)
+    count = int(math.ceil(duration/segment))
+    unit = segment / 2**max_depth
+
+    nodes = np.cos(math.pi*(np.arange(degree + 1) + 0.5)/(degree + 1))
+    basis = np.cos(np.outer(np.arange(degree + 1), math.pi*(np.arange(degree + 1) + 0.5)/(degree + 1))) * 2.0/(degree + 1)
+    basis[0] *= 0.5
+    checks = np.cos(math.pi*np.arange(2*degree + 3)/(2*degree + 2)) # between and beyond the nodes, including both ends
+
+    def exact(rows, t):
+        return model.positions(ra[rows], dec[rows], lat[rows], lon[rows], start_gmst + t*RADIANS_PER_SECOND)
+
+    # queue of segments to fit
+    pair = np.repeat(np.arange(pairs), count)
+    begin = np.tile(np.arange(count, dtype=np.int64) * 2**max_depth, pairs)
+    depth = np.zeros(len(pair), dtype=np.int8)
+
+    accepted = []
+    while len(pair):
+        size = max(1, CHUNK_SIZE // len(checks))
+        next_pair, next_begin, next_depth = [], [], []
+
+        for offset in range(0, len(pair), size):
+            p, b, d = pair[offset:offset + size], begin[offset:offset + size], depth[offset:offset + size]
+            t0, t1 = _bounds(b, d, unit, max_depth, duration)
+
+            def times(x):
+                return t0[:, None] + (x[None, :] + 1.0)*0.5*(t1 - t0)[:, None]
+
+            azimuth, altitude = exact(p[:, None], times(nodes))
+            coefficients = np.stack((np.unwrap(azimuth, axis=1).dot(basis.T), altitude.dot(basis.T)), axis=1)
+
+            azimuth, altitude = exact(p[:, None], times(checks))
+            error = np.maximum(np.abs(_clenshaw(coefficients[:, None, 1, :], checks[None, :]) - altitude),
+                    np.abs(_wrap(_clenshaw(coefficients[:, None, 0, :], checks[None, :]) - azimuth))*np.cos(altitude)).max(axis=1)
+
+            done = (error <= tolerance) | (d >= max_depth)
+            accepted.append((p[done], b[done], d[done], coefficients[done], error[done]))
+
+            # halve the others. The second half of a segment cut short by the end of the window may be empty.
+            p, b, d = p[~done], b[~done], d[~done] + 1
+            half = b + (2**max_depth >> d.astype(np.int64))
+            inside = half*unit < duration
+            next_pair += [p, p[inside]]
+            next_begin += [b, half[inside]]
+            next_depth += [d, d[inside]]
+
+        pair, begin, depth = np.concatenate(next_pair), np.concatenate(next_begin), np.concatenate(next_depth).astype(np.int8)
+
+    pair, begin, depth, coefficients, error = [np.concatenate(a) for a in zip(*accepted)]
+    order = np.lexsort((begin, pair))
+
+    max_error = np.zeros(pairs)
+    np.maximum.at(max_error, pair, error)
+
+    return Trajectories(start_gmst, float(duration), float(segment), max_depth, pairs,
+            pair[order], begin[order], depth[order], coefficients[order], max_error)
+
+
+def _bounds(begin, depth, unit, max_depth, duration):
+    'Start and end of segments in seconds'
+    t0 = begin*unit
+    t1 = np.minimum((begin + (2**max_depth >> depth.astype(np.int64)))*unit, duration)
+    return t0, t1
+
+
+def _clenshaw(coefficients, x):
+    'Evaluates Chebyshev series with coefficients along the last axis at x'
+    b1 = np.zeros(np.broadcast(coefficients[..., 0], x).shape)
+    b2 = np.zeros_like(b1)
+    for j in range(coefficients.shape[-1] - 1, 0, -1):
+        b1, b2 = coefficients[..., j] + 2.0*x*b1 - b2, b1
+    return coefficients[..., 0] + x*b1 - b2
+
+
+def _wrap(angle):
+    'Angle difference in the range -pi to pi'
+    return np.mod(angle + math.pi, math.pi*2.0) - math.pi
+
+
+
+"""
+For testing only
+"""
+if __name__ == "__main__":
+
+    def test():
+        import os
+        import shutil
+        import tempfile
+        from util.angle import Angle
+        import flat
+        import globe
+
+        state = np.random.RandomState(7)
+        ra = state.uniform(0, math.pi*2.0, 60)
+        dec = np.arcsin(state.uniform(-1, 1, 60))
+        lat = np.arcsin(state.uniform(-1, 1, 60))
+        lon = state.uniform(-math.pi, math.pi, 60)
+        duration = 86400.0*1.5
+
+        directory = tempfile.mkdtemp()
+        try:
+            for model in (globe, flat):
+                trajectories = fit(model, ra, dec, lat, lon, 1.0, duration, tolerance=1e-8)
+                assert trajectories.pairs == 60 and np.all(np.diff(trajectories.keys) > 0)
+                assert np.all(trajectories.max_error <= 1e-8)
+
+                # random queries against the exact batch model
+                pair = state.randint(0, 60, 5000)
+                time = state.uniform(0, duration, 5000)
+                azimuth, altitude = trajectories.positions(pair, time)
+                exact_azimuth, exact_altitude = model.positions(ra[pair], dec[pair], lat[pair], lon[pair], 1.0 + time*RADIANS_PER_SECOND)
+                assert np.max(np.abs(altitude - exact_altitude)) < 1e-7
+                assert np.max(np.abs(_wrap(azimuth - exact_azimuth))*np.cos(exact_altitude)) < 1e-7
+
+                # and against the Star methods
+                for i in range(5):
+                    location = model.Location(Angle(lat[pair[i]]), Angle(lon[pair[i]]))
+                    star = model.Star(Angle(ra[pair[i]]), Angle(dec[pair[i]]))
+                    sidereal = Angle(1.0 + time[i]*RADIANS_PER_SECOND)
+                    assert abs(star.altitude(location, sidereal).rad() - altitude[i]) < 1e-7
+
+                filename = os.path.join(directory, model.__name__+".npz")
+                trajectories.save(filename)
+                loaded = Trajectories.load(filename)
+                assert np.array_equal(loaded.positions(pair, time)[1], altitude)
+        finally:
+            shutil.rmtree(directory)
+
+        try:
+            trajectories.positions(0, duration + 1)
+            assert False
+        except ValueError:
+            pass
+
+    test()
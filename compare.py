@@ -3,18 +3,44 @@
 
 import flat
 import globe
+import sweep
+import watch
+import riseset
+import navigation
+import separation
 
 from util.angle import Angle, Degree, Latlon, HourAngle
 from util.vector3 import Vector3
 from util.location import SphereLocation, StarLocation
-from util.gmst import utc, gmst
-
-import csv
+from util.gmst import utc, gmst, gmst_array, datetime64
+from util.catalog import load_catalog, read_location_rows, columns
+from util.precession import columns_at
+from util.skyindex import SkyIndex
+from util.records import FORMATS, record_writer, open_output
+from util.cache import LRUCache
+from util.store import ResultStore
+from util import profiler
+from util.profiler import stage
+
+import sys
 import cmd
-from datetime import datetime
+import shutil
+import argparse
+from datetime import datetime, timedelta
+
+import numpy as np
+
+STAR_CATALOG = 'data/stars.csv'
+LOCATION_CATALOG = 'data/locations.csv'
+DEFAULT_CELESTIAL_SHELL_RADIUS = flat.DEFAULT_CELESTIAL_SHELL_RADIUS
+MINIMUM_CELESTIAL_SHELL_RADIUS = 40008000 # meters. The shell must be outside of the flat earth.
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+RESULT_CACHE_SIZE = 100000 # (star, location, GMST) results kept by the interactive shell
+
 
-DEFAULT_GMST = gmst(datetime.now(utc))
-DEFAULT_CELESTIAL_SHELL_RADIUS = 400080000 # meters (default is ten times bigger than earth radius)
+def default_gmst():
+    'GMST Angle of the current time. Replaces the DEFAULT_GMST constant, which went stale after import. Deprecated.'
+    return gmst(datetime.now(utc))
 
 
 class App(cmd.Cmd):
@@ -26,47 +52,173 @@ class App(cmd.Cmd):
 
     prompt = "> "
 
-    def __init__(self):
+    def __init__(self, star_file=STAR_CATALOG, location_file=LOCATION_CATALOG):
         cmd.Cmd.__init__(self)
 
-        self.stars = get_location_data('data/stars.csv', HourAngle, Latlon, StarLocation)
-        self.locations = get_location_data('data/locations.csv', Latlon, Latlon, SphereLocation)
-
-        self.selected_stars = self.stars
-        self.selected_locations = self.locations
-        self.gmst = DEFAULT_GMST
+        # catalogs are opened on first use (go, list, tab completion...), so the prompt appears at once for any catalog size
+        self.star_file = star_file
+        self.location_file = location_file
+        self._stars = None
+        self._locations = None
+
+        self.sky_index = None
+        self.star_cache = {}
+        self.location_cache = {}
+        self.results = LRUCache(RESULT_CACHE_SIZE)
+        self._selected_stars = None # None selects the whole catalog
+        self._selected_locations = None
+        self._gmst = None # None is the current time, set on first use
         self.verbose = False
         self.celestial_shell_radius = DEFAULT_CELESTIAL_SHELL_RADIUS
 
+    @property
+    def stars(self):
+        'Star catalog. Compiled catalogs are memory-mapped and rebuilt when the CSV file changes.'
+        if self._stars is None:
+            self._stars = load_catalog(self.star_file, HourAngle, Latlon, StarLocation)
+        return self._stars
+
+    @property
+    def locations(self):
+        'Location catalog'
+        if self._locations is None:
+            self._locations = load_catalog(self.location_file, Latlon, Latlon, SphereLocation)
+        return self._locations
+
+    @property
+    def selected_stars(self):
+        return self.stars if self._selected_stars is None else self._selected_stars
+
+    @selected_stars.setter
+    def selected_stars(self, stars):
+        self._selected_stars = stars
+
+    @property
+    def selected_locations(self):
+        return self.locations if self._selected_locations is None else self._selected_locations
+
+    @selected_locations.setter
+    def selected_locations(self, locations):
+        self._selected_locations = locations
+
+    @property
+    def gmst(self):
+        'GMST Angle. Defaults to the GMST of the first time it is used.'
+        if self._gmst is None:
+            self._gmst = default_gmst()
+        return self._gmst
+
+    @gmst.setter
+    def gmst(self, angle):
+        self._gmst = angle
+
     def do_go(self, arg):
-        'Run the comparison of selected stars and locations.'
+        'Run the comparison of selected stars and locations. GMST has no date, so star positions are J2000.'
 
-        print("GMST: "+self.gmst.hour()+"\n")
+        lines = ["GMST: "+self.gmst.hour()+"\n"]
 
-        for name, location in self.selected_locations.items():
-            print(name+":")
-            flat_location = flat.Location(location.lat, location.lon)
+        for location_name in self.selected_locations.keys():
+            lines.append(location_name+":")
+            globe_location, flat_location = self.location_models(location_name)
             if self.verbose:
-                print("Lat/Lon: "+location.lat.lat()+"/"+location.lon.lon())
-                print("Location Vector: "+str(flat_location.vector(self.gmst)))
-            for name, star in self.selected_stars.items():
-                globe_star = globe.Star(star.ra, star.dec)
-                flat_star = flat.Star(star.ra, star.dec)
-                print("\t"+name+":")
+                lines.append("Lat/Lon: "+globe_location.lat.lat()+"/"+globe_location.lon.lon())
+                lines.append("Location Vector: "+str(flat_location.vector(self.gmst)))
+            for name in self.selected_stars.keys():
+                globe_azimuth, globe_altitude, flat_azimuth, flat_altitude = self.pair_result(name, location_name)
+                lines.append("\t"+name+":")
                 if self.verbose:
-                    print("\tRA/Dec: "+globe_star.ra.hour()+"/"+globe_star.dec.deg_min_sec())
-                    print("\tLocal Hour Angle: "+globe_star.local_hour_angle(location, self.gmst).hour())
-                    print("\tLocal Sidereal Time: "+globe_star.local_sidereal_time(location, self.gmst).hour())
-                print("\t\tglobe: Az/Alt: "+globe_star.azimuth(location, self.gmst).deg_min_sec()+"/"+globe_star.altitude(location, self.gmst).deg_min_sec())
-                print("\t\tflat:  Az/Alt: "+flat_star.azimuth(flat_location, self.gmst).deg_min_sec()+"/"+flat_star.altitude(flat_location, self.gmst).deg_min_sec())
+                    globe_star, flat_star = self.star_models(name)
+                    lines.append("\tRA/Dec: "+globe_star.ra.hour()+"/"+globe_star.dec.deg_min_sec())
+                    lines.append("\tLocal Hour Angle: "+globe_star.local_hour_angle(globe_location, self.gmst).hour())
+                    lines.append("\tLocal Sidereal Time: "+globe_star.local_sidereal_time(globe_location, self.gmst).hour())
+                lines.append("\t\tglobe: Az/Alt: "+globe_azimuth+"/"+globe_altitude)
+                lines.append("\t\tflat:  Az/Alt: "+flat_azimuth+"/"+flat_altitude)
                 if self.verbose:
-                    print("\t\t\tBase Ray Direction:  "+str(flat_star.base_ray_direction()))
-                    print("\t\t\tLocal Ray Direction: "+str(flat_star.local_ray_direction(location, self.gmst)))
-                    print("\t\t\tCelestial Shell Intercept: "+str(flat_star.shell_intercept(flat_location, self.gmst, self.celestial_shell_radius)))
-                    print("\t\t\tCelestial Shell Radius: "+str(flat_star.shell_intercept(flat_location, self.gmst, self.celestial_shell_radius).length()))
-                    print("\t\t\tDistance: "+str(flat_star.distance(flat_location, self.gmst, self.celestial_shell_radius)))
+                    with stage("shell intercept"):
+                        shell_intercept = flat_star.shell_intercept(flat_location, self.gmst, self.celestial_shell_radius)
+                    lines.append("\t\t\tBase Ray Direction:  "+str(flat_star.base_ray_direction()))
+                    lines.append("\t\t\tLocal Ray Direction: "+str(flat_star.local_ray_direction(flat_location, self.gmst)))
+                    lines.append("\t\t\tCelestial Shell Intercept: "+str(shell_intercept))
+                    lines.append("\t\t\tCelestial Shell Radius: "+str(shell_intercept.length()))
+                    lines.append("\t\t\tDistance: "+str(flat_location.distance(shell_intercept, self.gmst)))
+
+            lines.append("\n")
+
+        # one write instead of one print per line
+        with stage("output"):
+            print("\n".join(lines))
+
+    def star_models(self, name):
+        """
+        globe.Star and flat.Star for a catalog star. Built once and kept across runs, 
+        so per-star terms (declination trig, base ray direction) are only computed once.
+        """
+        if name not in self.star_cache:
+            with stage("star construction"):
+                star = self.stars[name]
+                self.star_cache[name] = (globe.Star(star.ra, star.dec), flat.Star(star.ra, star.dec))
+        return self.star_cache[name]
+
+    def location_models(self, name):
+        """
+        globe.Location and flat.Location for a catalog location. Built once and kept across runs, 
+        so per-location terms (latitude trig, local rotation for the current GMST) are only computed once.
+        """
+        if name not in self.location_cache:
+            with stage("location construction"):
+                location = self.locations[name]
+                self.location_cache[name] = (globe.Location(location.lat, location.lon), flat.Location(location.lat, location.lon))
+        return self.location_cache[name]
 
-            print("\n")
+    def pair_result(self, star_name, location_name):
+        """
+        Formatted globe and flat azimuth/altitude of a star from a location at the current GMST.
+        Results are kept in an LRU cache, so running go again without changes does no calculation.
+
+        :return: tuple of globe azimuth, globe altitude, flat azimuth, flat altitude strings
+        """
+        key = (star_name, location_name, self.gmst.rad())
+        result = self.results.get(key)
+
+        if result is None:
+            globe_star, flat_star = self.star_models(star_name)
+            globe_location, flat_location = self.location_models(location_name)
+
+            with stage("globe az/alt"):
+                globe_azimuth = globe_star.azimuth(globe_location, self.gmst)
+                globe_altitude = globe_star.altitude(globe_location, self.gmst)
+
+            # the ray direction is shared by flat azimuth and altitude
+            with stage("flat ray direction"):
+                direction = flat_star.local_ray_direction(flat_location, self.gmst)
+
+            with stage("flat az/alt"):
+                flat_azimuth = Angle(flat.azimuth_from_direction(direction, self.gmst.rad() + flat_location.lon.rad()))
+                flat_altitude = Angle(flat.altitude_from_direction(direction))
+
+            with stage("formatting"):
+                result = tuple(angle.deg_min_sec() for angle in (globe_azimuth, globe_altitude, flat_azimuth, flat_altitude))
+
+            self.results[key] = result
+
+        return result
+
+    def do_visible(self, arg):
+        'List all stars above the given altitude in degrees (default 0) from the selected locations, with J2000 star positions. Example: visible 30'
+        try:
+            altitude = Degree(arg or 0).rad()
+        except ValueError:
+            print("Invalid altitude entered. Please enter altitude in degrees.")
+            return
+
+        if self.sky_index is None:
+            self.sky_index = SkyIndex(self.stars.ra, self.stars.dec)
+
+        for name, location in self.selected_locations.items():
+            print(name+":")
+            for model in (globe, flat):
+                rows = self.sky_index.above(model, location.lat.rad(), location.lon.rad(), self.gmst.rad(), altitude)
+                print("\t"+model.__name__+": "+", ".join(self.stars.names[i] for i in rows))
 
     def do_star(self, arg):
         'Select stars for output. Example: star nu_oct sirius polaris'
@@ -107,7 +259,7 @@ class App(cmd.Cmd):
         if arg:
             try:
                 arg = float(arg)
-                if arg < 40008000:
+                if arg < MINIMUM_CELESTIAL_SHELL_RADIUS:
                     raise ValueError("Celestial Shell Radius must be greater than 40,008,000 meters")
             except (TypeError, ValueError):
                 print("Invalid radius entered. Radius must be greater than 40,008,000 meters")
@@ -146,6 +298,168 @@ class App(cmd.Cmd):
         print("GMST: "+self.gmst.hour())
 
 
+    def do_sweep(self, arg):
+        """
+        Show how the selected stars move over a range of time in UTC timezone. Step is in seconds.
+        Star positions are precessed to the date, once per year of the range.
+
+        Format: sweep start end step
+        Time format: year-month-dayThours:minutes:seconds or 'now'
+
+        Example: sweep 2016-05-05T00:00:00 2016-05-06T00:00:00 3600
+        Example: sweep now 2030-01-01T00:00:00 86400
+        """
+        try:
+            start, end, step = arg.split()
+            start, end = parse_time(start), parse_time(end)
+            step = timedelta(seconds=float(step))
+            records = sweep.sweep(self.selected_stars, self.selected_locations, start, end, step)
+        except ValueError:
+            print("Invalid sweep entered. Please enter in format: start end step")
+            return
+
+        for record in records:
+            print(record.time.strftime(TIME_FORMAT)+"\t"+record.location+"\t"+record.star+
+                    "\tglobe: Az/Alt: "+Angle(record.globe_azimuth).deg_min_sec()+"/"+Angle(record.globe_altitude).deg_min_sec()+
+                    "\tflat: Az/Alt: "+Angle(record.flat_azimuth).deg_min_sec()+"/"+Angle(record.flat_altitude).deg_min_sec())
+
+    def do_watch(self, arg):
+        """
+        Live table of globe and flat az/alt of the selected stars and locations, following the current UTC time.
+        Optional frame rate (default 10 per second) and number of seconds to run. Press Ctrl-C to return to the prompt.
+        Star positions are precessed to the current date.
+
+        Format: watch rate seconds
+        Example: watch
+        Example: watch 2 60
+        """
+        try:
+            args = tuple(map(float, arg.split()))
+            rate = args[0] if args else watch.DEFAULT_RATE
+            duration = args[1] if len(args) > 1 else None
+            if rate <= 0:
+                raise ValueError("Frame rate must be positive")
+        except ValueError:
+            print("Invalid watch entered. Please enter in format: rate seconds")
+            return
+
+        star_names, ra, dec = columns_at(self.selected_stars, datetime.now(utc))
+        location_names, lat, lon = columns(self.selected_locations)
+        tracker = watch.Tracker(ra, dec, lat, lon)
+
+        # only as many rows as fit in the terminal, so the table can be redrawn in place
+        pairs = [(location, star) for location in location_names for star in star_names]
+        rows = max(1, shutil.get_terminal_size().lines - 4)
+        hidden = len(pairs) - rows
+        pairs = pairs[:rows]
+        width = max(len(name) for pair in pairs for name in pair) if pairs else 0
+
+        lines = 0
+        try:
+            for elapsed, sidereal in watch.frames(gmst(datetime.now(utc)).rad(), rate, duration):
+                values = [np.degrees(v).ravel().tolist() for v in tracker.positions(sidereal)]
+                table = ["UTC: "+datetime.now(utc).strftime(TIME_FORMAT)+"  GMST: "+Angle(sidereal).hour()]
+                for i, (location, star) in enumerate(pairs):
+                    table.append(location.ljust(width)+"  "+star.ljust(width)+
+                            "  globe: Az/Alt: %8.3f/%7.3f  flat: Az/Alt: %8.3f/%7.3f" % tuple(v[i] for v in values))
+                if hidden > 0:
+                    table.append("... "+str(hidden)+" more")
+
+                # move the cursor back to the top of the previous frame and overwrite it
+                sys.stdout.write(("\x1b[%dF" % lines if lines else "")+"".join(line+"\x1b[K\n" for line in table))
+                sys.stdout.flush()
+                lines = len(table)
+        except KeyboardInterrupt:
+            print("")
+
+    def do_riseset(self, arg):
+        """
+        Rise, set and culmination (upper/lower transit) times of the selected stars from the selected locations
+        between two UTC times, in both models. Optional horizon altitude in degrees (default 0).
+        Star positions are precessed to the start time.
+
+        Format: riseset start end altitude
+        Time format: year-month-dayThours:minutes:seconds or 'now'
+
+        Example: riseset 2016-05-05T00:00:00 2016-05-06T00:00:00
+        Example: riseset now 2016-05-08T00:00:00 -0.5
+        """
+        try:
+            args = arg.split()
+            if len(args) not in (2, 3):
+                raise ValueError("Expected start, end and optional altitude")
+            start, end = parse_time(args[0]), parse_time(args[1])
+            altitude = Degree(args[2]).rad() if len(args) == 3 else 0.0
+            if end < start:
+                raise ValueError("End of range is before start")
+        except ValueError:
+            print("Invalid rise/set range entered. Please enter in format: start end altitude")
+            return
+
+        star_names, ra, dec = columns_at(self.selected_stars, start)
+        for location_name, location in self.selected_locations.items():
+            print(location_name+":")
+            for model in (globe, flat):
+                status, events = riseset.events(model, ra, dec, location.lat.rad(), location.lon.rad(), start, end, altitude)
+                print("\t"+model.__name__+":")
+                for code in (riseset.CIRCUMPOLAR, riseset.NEVER_RISES):
+                    names = [name for name, s in zip(star_names, status) if s == code]
+                    if names:
+                        print("\t\t"+riseset.STATUS_NAMES[code]+": "+", ".join(names))
+                for time, star, kind, azimuth, altitude_ in zip(riseset.times(start, events), events.star, events.kind, events.azimuth, events.altitude):
+                    print("\t\t"+str(time)[:19]+"\t"+star_names[star]+"\t"+riseset.KIND_NAMES[kind]+
+                            "\tAz/Alt: "+Angle(azimuth).deg_min_sec()+"/"+Angle(altitude_).deg_min_sec())
+
+    def do_locate(self, arg):
+        """
+        Estimate the observer location from measured azimuth/altitude (in degrees) of two or more stars at the current GMST,
+        in both models. The RMS residual shows how well each model explains the sightings. Star positions are J2000.
+
+        Format: locate star azimuth altitude star azimuth altitude ...
+        Example: locate nu_oct 183.44 19.65 beta_oct 184.7 24.3
+        """
+        try:
+            args = arg.split()
+            if len(args) < 6 or len(args) % 3:
+                raise ValueError("Expected star, azimuth and altitude of at least two stars")
+            names = args[0::3]
+            stars = [self.stars[name] for name in names]
+            azimuth = [Degree(a).rad() for a in args[1::3]]
+            altitude = [Degree(a).rad() for a in args[2::3]]
+        except (ValueError, KeyError):
+            print("Invalid sightings entered. Please enter in format: star azimuth altitude star azimuth altitude ...")
+            return
+
+        ra = [star.ra.rad() for star in stars]
+        dec = [star.dec.rad() for star in stars]
+        for model in (globe, flat):
+            fix = navigation.solve(model, ra, dec, azimuth, altitude, self.gmst.rad())
+            print(model.__name__+": Lat/Lon: "+Angle(fix.lat[0]).lat()+"/"+Angle(fix.lon[0]).lon()+
+                    "\tRMS residual: "+Angle(fix.rms[0]).deg_min_sec()+("" if fix.converged[0] else "\t(not converged)"))
+
+    def do_separation(self, arg):
+        """
+        Star pairs whose apparent angular separation differs most between the flat and globe models,
+        for each selected location at the current GMST, with J2000 star positions. Optional number of pairs (default 10).
+
+        Example: separation 5
+        """
+        try:
+            k = int(arg or 10)
+            if k < 1:
+                raise ValueError("Number of pairs must be positive")
+        except ValueError:
+            print("Invalid number of pairs entered. Please enter a positive number.")
+            return
+
+        star_names, ra, dec = columns(self.selected_stars)
+        for name, location in self.selected_locations.items():
+            print(name+":")
+            pairs = separation.most_distorted(ra, dec, location.lat.rad(), location.lon.rad(), self.gmst.rad(), k)
+            for first, second, globe_angle, flat_angle, difference in zip(*pairs):
+                print("\t"+star_names[first]+" - "+star_names[second]+"\tglobe: "+Angle(globe_angle).deg_min_sec()+
+                        "\tflat: "+Angle(flat_angle).deg_min_sec()+"\tdifference: "+Angle(difference).deg_min_sec())
+
     def do_gmst(self, arg):
         """
         Set Greenwich Mean Sidereal Time. Optionally, use the date command to automatically set GMST.
@@ -189,6 +503,47 @@ class App(cmd.Cmd):
             self.list_stars()
             self.list_locations()
 
+    def do_profile(self, arg):
+        """
+        Show time spent in each stage (location construction, globe az/alt, flat ray direction, formatting, output...)
+        after every command. While on, a cProfile profile of all commands is also recorded and can be saved in pstats format.
+
+        Example: profile on
+        Example: profile off
+        Example: profile dump go.pstats
+        """
+        args = arg.split()
+        if args == ["on"]:
+            profiler.enable(cprofile=True)
+        elif args == ["off"]:
+            profiler.disable()
+        elif len(args) == 2 and args[0] == "dump":
+            if profiler.active is None:
+                print("Profiling is off. Type <profile on> first.")
+            else:
+                try:
+                    profiler.active.dump(args[1])
+                    print("Saved profile: "+args[1])
+                except (ValueError, IOError, OSError) as e:
+                    print("Could not save profile: "+str(e))
+        elif args:
+            print("Invalid profile command. Please enter: profile on/off or profile dump filename")
+
+        print("Profile: "+("on" if profiler.active else "off"))
+
+    def precmd(self, line):
+        if profiler.active is not None and not line.startswith("profile"):
+            profiler.active.cprofile.enable()
+        return line
+
+    def postcmd(self, stop, line):
+        if profiler.active is not None and not line.startswith("profile"):
+            profiler.active.cprofile.disable()
+            if profiler.active.timings:
+                print(profiler.active.report())
+                profiler.active.reset()
+        return stop
+
     def default(self, line):
         print("Invalid command: "+line)
         self.do_help("")
@@ -212,26 +567,169 @@ def get_location_data(filename, angleClass1=Latlon, angleClass2=Latlon, location
 
     data = {}
 
-    with open(filename, 'r') as f:
-        reader = csv.reader(f, delimiter=',', quotechar='"')
-        i = 0
-        for row in reader:
-            if len(row) == 0 or row[0][:1] == '#':
-                continue
-            if len(row) == 3:
-                data[row[0].strip()] = locationClass(Degree(row[1]), Degree(row[2]))
-            elif len(row) == 7:
-                args = tuple(map(float, row[1:]))
-                data[row[0].strip()] = locationClass(
-                        angleClass1(*args[0:3]), 
-                        angleClass2(*args[3:6])
-                )
-            else:
-                continue
+    for name, angle1, angle2 in read_location_rows(filename, angleClass1, angleClass2):
+        data[name] = locationClass(angle1, angle2)
 
     return data
 
 
-if __name__ == '__main__':
-    App().cmdloop()
+def parse_time(text):
+    'Parses a UTC time in TIME_FORMAT, or "now"'
+    if text == "now":
+        return datetime.now(utc)
+    return datetime.strptime(text, TIME_FORMAT).replace(tzinfo=utc)
+
+
+def run(argv):
+    """
+    Non-interactive comparison. Writes one record per time, location and star as they are computed.
+
+    Example: python compare.py run --stars nu_oct beta_oct --locations perth --time 2016-05-05T00:00:00 --end 2016-05-06T00:00:00 --step 600 --format csv
+    """
+    parser = argparse.ArgumentParser(prog="compare.py run", description="Compare location of stars in flat model with globe model and write machine readable records. Angles are in radians.")
+    parser.add_argument("--stars", nargs="+", help="star names (default: all)")
+    parser.add_argument("--locations", nargs="+", help="location names (default: all)")
+    parser.add_argument("--time", default="now", help="UTC time as "+TIME_FORMAT.replace("%", "%%")+" or 'now' (default: now)")
+    parser.add_argument("--end", help="last UTC time of a time range (inclusive)")
+    parser.add_argument("--step", type=float, default=3600, help="seconds between times of a time range (default: 3600)")
+    parser.add_argument("--gmst", type=float, help="GMST in hours. Overrides --time.")
+    parser.add_argument("--radius", type=float, default=DEFAULT_CELESTIAL_SHELL_RADIUS, help="radius of the celestial shell in meters")
+    parser.add_argument("--shell", action="store_true", help="include celestial shell intercept and distance")
+    parser.add_argument("--formatted", action="store_true", help="include angles formatted as degrees, minutes, seconds")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--output", default="-", help="output filename (default: stdout)")
+    parser.add_argument("--store", help="append records to a chunked result store in this directory instead of writing them as text")
+    parser.add_argument("--j2000", action="store_true", help="use catalog star positions as they are, without precession and proper motion to the date")
+    args = parser.parse_args(argv)
+    if args.radius < MINIMUM_CELESTIAL_SHELL_RADIUS:
+        parser.error("radius must be at least 40,008,000 meters")
+
+    stars = load_catalog(STAR_CATALOG, HourAngle, Latlon, StarLocation)
+    locations = load_catalog(LOCATION_CATALOG, Latlon, Latlon, SphereLocation)
+    for name in args.stars or []:
+        if name not in stars:
+            parser.error("unknown star: "+name)
+    for name in args.locations or []:
+        if name not in locations:
+            parser.error("unknown location: "+name)
+
+    selected_stars = dict((name, stars[name]) for name in args.stars) if args.stars else stars
+    star_names = list(selected_stars.keys())
+    location_names, lat, lon = columns(dict((name, locations[name]) for name in args.locations) if args.locations else locations)
+
+    if args.gmst is not None:
+        blocks = [([None], np.array([args.gmst/12.0*np.pi]))]
+    else:
+        try:
+            start = parse_time(args.time)
+            end = parse_time(args.end) if args.end else start
+        except ValueError:
+            parser.error("times must be in format "+TIME_FORMAT.replace("%", "%%")+" or 'now'")
+        if args.step <= 0:
+            parser.error("step must be positive")
+        if end < start:
+            parser.error("--end must not be earlier than --time")
+        blocks = time_blocks(start, end, timedelta(seconds=args.step), max(1, 65536 // (len(star_names)*len(location_names) or 1)))
+
+    fields = ["time", "gmst", "star", "location", "globe_azimuth", "globe_altitude", "flat_azimuth", "flat_altitude"]
+    if args.shell:
+        fields += ["intercept_x", "intercept_y", "intercept_z", "distance"]
+    angle_fields = fields[4:8]
+    if args.formatted:
+        fields += [field+"_dms" for field in angle_fields]
+
+    # every location and star pair, in output order
+    pairs = [(location, star) for location in location_names for star in star_names]
+    lat = np.repeat(lat, len(star_names))
+    lon = np.repeat(lon, len(star_names))
+    blocks = star_blocks(blocks, selected_stars, len(location_names), args.j2000)
+
+    if args.store:
+        try:
+            store_results(args.store, blocks, star_names, location_names, lat, lon, args.radius if args.shell else None)
+        except ValueError as e:
+            parser.error(str(e))
+        return
+
+    stream = open_output(args.output)
+    writer = record_writer(args.format, stream, fields)
+    try:
+        for times, gmsts, ra, dec in blocks:
+            # times x pairs in one pass
+            sidereal = gmsts[:, None]
+            globe_azimuth, globe_altitude = globe.positions(ra, dec, lat, lon, sidereal)
+            trace = flat.trace(ra, dec, lat, lon, sidereal, args.radius if args.shell else None)
+
+            values = [globe_azimuth, globe_altitude, trace.azimuth, trace.altitude]
+            if args.shell:
+                values += list(trace.intercept) + [trace.distance]
+            values = np.stack(values, axis=-1).tolist()
+
+            for time, sidereal, rows in zip(times, gmsts.tolist(), values):
+                time = time.strftime(TIME_FORMAT) if time else None
+                for (location, star), row in zip(pairs, rows):
+                    record = dict(zip(fields, [time, sidereal, star, location] + row))
+                    if args.formatted:
+                        for field in angle_fields:
+                            record[field+"_dms"] = Angle(record[field]).deg_min_sec().strip()
+                    writer.write(record)
+        writer.close()
+    finally:
+        if args.output != "-":
+            stream.close()
+
+
+def store_results(directory, blocks, star_names, location_names, lat, lon, shell_radius=None):
+    """
+    Appends the results of every (location, star) pair at every time block to a ResultStore, creating it if needed.
+    blocks are (times, gmsts, ra, dec) as from star_blocks(). ra/dec/lat/lon have one value per pair, locations in the outer loop.
+    """
+    with ResultStore(directory, star_names, location_names) as store:
+        # ids of an existing store refer to the names it was created with
+        if not set(star_names) <= set(store.stars) or not set(location_names) <= set(store.locations):
+            raise ValueError("Result store "+directory+" was created for other stars or locations")
+
+        star = np.tile(store.star_ids(star_names), len(location_names))
+        location = np.repeat(store.location_ids(location_names), len(star_names))
+        for times, gmsts, ra, dec in blocks:
+            sidereal = gmsts[:, None]
+            globe_azimuth, globe_altitude = globe.positions(ra, dec, lat, lon, sidereal)
+            trace = flat.trace(ra, dec, lat, lon, sidereal, shell_radius)
+
+            columns = dict(star=star[None, :], location=location[None, :], gmst=sidereal, globe_azimuth=globe_azimuth, globe_altitude=globe_altitude,
+                    flat_azimuth=trace.azimuth, flat_altitude=trace.altitude)
+            if times[0] is not None:
+                columns['time'] = np.array([datetime64(time) for time in times])[:, None]
+            if shell_radius is not None:
+                columns.update(intercept_x=trace.intercept[0], intercept_y=trace.intercept[1], intercept_z=trace.intercept[2], distance=trace.distance)
+            store.append(**columns)
+
+
+def star_blocks(blocks, stars, locations, j2000=False):
+    """
+    Adds the Right Ascension and Declination of every (location, star) pair to (datetimes, GMST array) blocks, with the stars
+    precessed to the first time of the block (see util.precession.columns_at). Blocks without times (GMST only) and j2000
+    use the catalog positions as they are.
+
+    :param locations: number of locations. Pairs have locations in the outer loop.
+    :return: generator of (datetimes, GMST array, ra array, dec array)
+    """
+    for times, gmsts in blocks:
+        names, ra, dec = columns(stars) if times[0] is None or j2000 else columns_at(stars, times[0])
+        yield times, gmsts, np.tile(ra, locations), np.tile(dec, locations)
+
+
+def time_blocks(start, end, step, size=1024):
+    'Yields (datetimes, GMST array) for blocks of time steps from start to end (inclusive)'
+    steps = int((end - start).total_seconds() // step.total_seconds()) + 1
+    for first in range(0, steps, size):
+        count = min(size, steps - first)
+        times = [start + step*(first + i) for i in range(count)]
+        yield times, gmst_array(datetime64(start) + (first + np.arange(count))*np.timedelta64(step, 'us'))
+
 
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "run":
+        run(sys.argv[2:])
+    else:
+        App().cmdloop()
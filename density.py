@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Density map of celestial shell intercepts: where on the shell the light of each star appears to come from,
+over a grid of observers and a range of times, in the flat model.
+
+Intercepts are reduced to a fixed resolution histogram of shell latitude/longitude (the direction of the intercept from
+the centre of the disk, in the same sidereal frame as flat.Location.vector) as they are produced, so memory use does not
+depend on the number of samples. Chunks of work run in parallel with residuals.run_chunks and their maps are merged.
+
+The spread of each star is the angular radius of its intercept cloud: the angle whose chord is the RMS chord distance of
+the intercept directions from their mean direction (close to the RMS angular distance for small clouds). The mean squared
+chord to the mean direction is 2 - 2R, where R is the length of the mean of the unit vectors, so the spread only needs
+the running sum of unit vectors.
+"""
+
+import math
+import csv
+
+import numpy as np
+
+import flat
+
+from util.precession import columns_at
+from residuals import grid, sidereal_times, run_chunks
+
+DEFAULT_BINS = (180, 360) # latitude, longitude
+
+
+class DensityMap:
+    """
+    Histogram of intercept directions and running per star sums.
+
+    :ivar histogram: int64 array of shape bins, rows from -90 to 90 degrees shell latitude, columns from -180 to 180 degrees shell longitude
+    :ivar count: number of valid intercepts of each star
+    :ivar total: sum of intercept unit vectors of each star, shape (stars, 3)
+    :ivar invalid: number of samples without an intercept (shell radius inside the observer)
+    """
+
+    def __init__(self, names, bins=DEFAULT_BINS):
+        self.names = list(names)
+        self.bins = tuple(bins)
+        self.histogram = np.zeros(self.bins, dtype=np.int64)
+        self.count = np.zeros(len(self.names), dtype=np.int64)
+        self.total = np.zeros((len(self.names), 3))
+        self.invalid = 0
+
+    def add(self, x, y, z, valid):
+        """
+        :param x, y, z: intercept components, arrays with one row per star
+        :param valid: mask of samples that have an intercept
+        """
+        x, y, z, valid = [np.asarray(a).reshape(len(self.names), -1) for a in np.broadcast_arrays(x, y, z, valid)]
+        length = np.sqrt(x*x + y*y + z*z)
+        with np.errstate(invalid='ignore'):
+            u = np.where(valid, x/length, 0.0)
+            v = np.where(valid, y/length, 0.0)
+            w = np.where(valid, z/length, 0.0)
+
+        self.count += valid.sum(axis=1)
+        self.total += np.stack((u.sum(axis=1), v.sum(axis=1), w.sum(axis=1)), axis=1)
+        self.invalid += int(valid.size - valid.sum())
+
+        lat_bins, lon_bins = self.bins
+        row = np.clip(((np.arcsin(np.clip(w[valid], -1.0, 1.0)) + math.pi/2.0)/math.pi*lat_bins).astype(np.int64), 0, lat_bins - 1)
+        column = np.clip(((np.arctan2(v[valid], u[valid]) + math.pi)/(math.pi*2.0)*lon_bins).astype(np.int64), 0, lon_bins - 1)
+        self.histogram += np.bincount(row*lon_bins + column, minlength=lat_bins*lon_bins).reshape(self.bins)
+
+    def merge(self, other):
+        self.histogram += other.histogram
+        self.count += other.count
+        self.total += other.total
+        self.invalid += other.invalid
+        return self
+
+    def mean_direction(self):
+        'Unit vector of the mean intercept direction of each star (NaN for stars without intercepts)'
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.total / np.sqrt((self.total**2).sum(axis=1))[:, None]
+
+    def spread(self):
+        'Angular radius of the intercept cloud of each star in radians (see module docstring)'
+        with np.errstate(invalid='ignore', divide='ignore'):
+            resultant = np.sqrt((self.total**2).sum(axis=1)) / self.count
+        chord = np.sqrt(np.clip(2.0 - 2.0*resultant, 0.0, 4.0))
+        return 2.0*np.arcsin(chord/2.0)
+
+    def save(self, histogram_filename, summary_filename):
+        """
+        Saves the histogram as a numpy .npy array, and the per star summary as CSV:
+        name, intercepts, mean shell latitude and longitude and spread in degrees.
+        """
+        np.save(histogram_filename, self.histogram)
+
+        mean = self.mean_direction()
+        spread = self.spread()
+        with open(summary_filename, 'w') as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(["star", "intercepts", "mean_latitude", "mean_longitude", "spread"])
+            for i, name in enumerate(self.names):
+                u, v, w = mean[i]
+                writer.writerow([name, self.count[i], math.degrees(math.asin(max(-1.0, min(1.0, w)))) if self.count[i] else "",
+                        math.degrees(math.atan2(v, u)) if self.count[i] else "", math.degrees(spread[i]) if self.count[i] else ""])
+
+
+def intercept_density(stars, start, end, step, shell_radius=flat.DEFAULT_CELESTIAL_SHELL_RADIUS, lat_step=math.radians(1.0), lon_step=math.radians(1.0),
+        bins=DEFAULT_BINS, workers=None, chunk_rows=4, chunk_times=64):
+    """
+    Streams the shell intercepts of every star over a lat/lon grid of observers and a time range into a DensityMap.
+    Star positions are precessed to the first time of each chunk (see util.precession.columns_at).
+
+    :param stars: Catalog or dict of name: StarLocation
+    :param start: datetime of first time step
+    :param end: datetime of last time step (inclusive)
+    :param step: timedelta between time steps
+    :param shell_radius: radius of the celestial shell in meters
+    :param lat_step: latitude resolution of the observer grid in radians
+    :param lon_step: longitude resolution of the observer grid in radians
+    :param bins: histogram resolution as (latitude bins, longitude bins)
+    :param workers: number of worker processes. Defaults to the number of CPUs. 1 runs in this process.
+    :param chunk_rows: latitude rows per chunk
+    :param chunk_times: time steps per chunk
+
+    :return: DensityMap
+    """
+    names = columns_at(stars, start)[0]
+    lats, lons = grid(lat_step, lon_step)
+    gmsts = sidereal_times(start, end, step)
+
+    chunks = ((names,) + columns_at(stars, start + step*j)[1:] + (lats[i:i+chunk_rows], lons, gmsts[j:j+chunk_times], shell_radius, bins)
+            for i in range(0, len(lats), chunk_rows) for j in range(0, len(gmsts), chunk_times))
+
+    result = DensityMap(names, bins)
+    for density in run_chunks(density_chunk, chunks, workers):
+        result.merge(density)
+
+    return result
+
+
+def density_chunk(names, ra, dec, lats, lons, gmsts, shell_radius, bins):
+    """
+    DensityMap of every star over the given latitude rows, longitudes and GMST values (radians).
+    Unit of work for intercept_density().
+    """
+    density = DensityMap(names, bins)
+
+    # stars x latitudes x longitudes
+    ra = np.asarray(ra)[:, None, None]
+    dec = np.asarray(dec)[:, None, None]
+    lat = np.asarray(lats)[None, :, None]
+    lon = np.asarray(lons)[None, None, :]
+
+    for sidereal in gmsts:
+        x, y, z, valid = flat.shell_intercepts(ra, dec, lat, lon, sidereal, shell_radius)
+        density.add(x, y, z, valid)
+
+    return density
+
+
+
+"""
+For testing only
+"""
+if __name__ == "__main__":
+
+    def test():
+        import os
+        import shutil
+        import tempfile
+        from datetime import datetime, timedelta
+        from util.gmst import utc
+        from util.angle import Angle
+        from util.location import StarLocation
+
+        names = ["a", "b", "c"]
+        ra = np.array([0.3, 2.0, 4.0])
+        dec = np.array([-1.2, 0.1, 1.5])
+        start = datetime(2016, 5, 5, tzinfo=utc)
+        end = start + timedelta(hours=6)
+        step = timedelta(hours=1)
+        stars = dict((name, StarLocation(Angle(r), Angle(d))) for name, r, d in zip(names, ra, dec))
+
+        density = intercept_density(stars, start, end, step, lat_step=math.radians(20), lon_step=math.radians(30), bins=(18, 36), workers=1, chunk_rows=2, chunk_times=3)
+        samples = 9*12*7
+        assert np.array_equal(density.count, [samples]*3) and density.invalid == 0
+        assert density.histogram.sum() == 3*samples
+
+        # same result in parallel
+        parallel = intercept_density(stars, start, end, step, lat_step=math.radians(20), lon_step=math.radians(30), bins=(18, 36), workers=2, chunk_rows=2, chunk_times=3)
+        assert np.array_equal(parallel.histogram, density.histogram) and np.allclose(parallel.total, density.total)
+
+        # merging returns the map, like residuals.Statistics.merge
+        twice = DensityMap(names, (18, 36)).merge(density).merge(parallel)
+        assert np.array_equal(twice.histogram, 2*density.histogram) and twice.invalid == 0
+
+        # spread against the direct calculation
+        ra, dec = columns_at(stars, start)[1:]
+        lats, lons = grid(math.radians(20), math.radians(30))
+        x, y, z, valid = flat.shell_intercepts(ra[:, None, None, None], dec[:, None, None, None], lats[None, :, None, None], lons[None, None, :, None],
+                sidereal_times(start, end, step)[None, None, None, :], flat.DEFAULT_CELESTIAL_SHELL_RADIUS)
+        vectors = np.stack((x, y, z), axis=-1).reshape(3, -1, 3)
+        vectors /= np.sqrt((vectors**2).sum(axis=-1))[..., None]
+        mean = density.mean_direction()
+        chord = np.sqrt(((vectors - mean[:, None, :])**2).sum(axis=-1))
+        assert np.allclose(2.0*np.arcsin(np.sqrt((chord**2).mean(axis=1))/2.0), density.spread(), rtol=1e-9)
+
+        directory = tempfile.mkdtemp()
+        try:
+            density.save(os.path.join(directory, "density.npy"), os.path.join(directory, "spread.csv"))
+            assert np.array_equal(np.load(os.path.join(directory, "density.npy")), density.histogram)
+            with open(os.path.join(directory, "spread.csv")) as f:
+                assert len(f.read().splitlines()) == 4
+        finally:
+            shutil.rmtree(directory)
+
+    test()
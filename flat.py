@@ -1,13 +1,16 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from util.angle import *
-from util.vector3 import Vector3
+from util.angle import Angle, Degree, Latlon, HourAngle
+from util.vector3 import Vector3, Vector3Array, Matrix3
 from util.location import SphereLocation, StarLocation
 
 import math
 
+import numpy as np
+
 METERS_PER_RADIAN_LAT = 40008000.0 / 2 / math.pi 
+DEFAULT_CELESTIAL_SHELL_RADIUS = 400080000 # meters (default is ten times bigger than earth radius)
 
 
 class Location(SphereLocation):
@@ -17,6 +20,8 @@ class Location(SphereLocation):
     def __init__(self, lat, lon):
         SphereLocation.__init__(self, lat, lon)
         self.radius = (math.pi/2 - float(lat)) * METERS_PER_RADIAN_LAT
+        self._transform_gmst = None
+        self._transform = None
 
     def vector(self, gmst):
         """
@@ -39,6 +44,34 @@ class Location(SphereLocation):
         """
         return self.vector(gmst).multiply(-1).add(vector).length()
 
+    def transform(self, gmst):
+        """
+        Single rotation that takes a star's base ray direction to its local ray direction at this location.
+        Combines the three rotations of Star.local_ray_direction. The result only depends on this location and GMST,
+        so it is reused across all stars and cached until GMST changes.
+
+        :param gmst: Angle containing Greenwich Mean Sidereal Time
+        :return: Matrix3
+        """
+        if self._transform_gmst != gmst.rad():
+            self._transform = sphere_transform(self.lat.rad(), self.lon.rad() + gmst.rad())
+            self._transform_gmst = gmst.rad()
+
+        return self._transform
+
+
+def location_transform(location, gmst):
+    'Location.transform of any location, cached if it is a Location'
+    if isinstance(location, Location):
+        return location.transform(gmst)
+    return sphere_transform(location.lat.rad(), location.lon.rad() + gmst.rad())
+
+
+def sphere_transform(lat, lst):
+    'Local ray rotation for a latitude and local sidereal time in radians'
+    colat = math.pi/2.0 - lat
+    return local_transform(math.cos(lst), math.sin(lst), math.cos(colat), math.sin(colat))
+
 
 class Star(StarLocation):
     def __init__(self, ra, dec):
@@ -50,6 +83,8 @@ class Star(StarLocation):
         """
         self.ra = ra
         self.dec = dec
+        self._base_key = None
+        self._base = None
 
     def base_ray_direction(self):
         """
@@ -57,28 +92,30 @@ class Star(StarLocation):
 
         Vernal Equinox points along Y axis. 
         North pole points along Z axis.
+
+        Computed once per RA/Dec and cached. Returns a copy that is safe to modify.
         """
-        direction = Vector3(0,1,0) # starts pointing towards the Y axis and vernal equinox
-        direction.rotateX(self.dec.rad()) # declination rotation around X axis
-        direction.rotateZ(self.ra.rad()) # right ascension rotation around Z axis
+        return self._base_ray_direction().clone()
 
-        return direction
+    def _base_ray_direction(self):
+        key = (self.ra.rad(), self.dec.rad())
+        if self._base_key != key:
+            direction = Vector3(0,1,0) # starts pointing towards the Y axis and vernal equinox
+            direction.rotateX(self.dec.rad()) # declination rotation around X axis
+            direction.rotateZ(self.ra.rad()) # right ascension rotation around Z axis
+            self._base = direction
+            self._base_key = key
+
+        return self._base
 
     def local_ray_direction(self, location, gmst):
         """
         Rotates the base vector according to the locations latitude/longitude and sidereal time.
 
-        :param location: Location containing lat/lon coordinates
+        :param location: Location, or any SphereLocation, containing lat/lon coordinates
         :param gmst: Angle containing Greenwich Mean Sidereal Time
         """
-        direction = self.base_ray_direction() # get base vector
-        lst = self.local_sidereal_time(location, gmst).rad() # calculate sidereal time for given location
-
-        direction.rotateZ(-lst) # rotate to align the longitude with the Y axis to allow easy rotation
-        direction.rotateX(math.pi/2.0 - location.lat.rad()) # rotate around X axis, towards north pole based on latitude
-        direction.rotateZ(lst) # undo previous rotation to unalign with Y axis
-
-        return direction
+        return location_transform(location, gmst).transform(self._base_ray_direction())
 
     def local_sidereal_time(self, location, gmst):
         'Sidreal time for given location. Angle of location relative to vernal equinox.'
@@ -93,7 +130,7 @@ class Star(StarLocation):
         """
         direction = self.local_ray_direction(location, gmst) # guide vector
 
-        return Angle(math.asin(direction.z / direction.length()))
+        return Angle(altitude_from_direction(direction))
 
     def azimuth(self, location, gmst):
         """
@@ -104,32 +141,7 @@ class Star(StarLocation):
         """
         direction = self.local_ray_direction(location, gmst) # guide vector
 
-        absolute_direction = 0
-
-        # avoid divide-by-zero errors
-        if direction.x == 0:
-            if direction.y > 0:
-                absolute_direction = math.pi/2
-            else:
-                absolute_direction = -math.pi/2
-        else:
-            # calculate direction relative to global coordinate system
-            absolute_direction = math.atan(direction.y/direction.x) 
-
-        # arctan() range is limited to -90 to 90 degrees. To detect 90 to 270 degrees, test sign of x component.
-        if direction.x < 0:
-            absolute_direction += math.pi
-
-        # adjust angle relative to direction of North Pole. Towards North Pole should be zero degrees.
-        azimuth = gmst.rad() + location.lon.rad() - math.pi/2 - absolute_direction 
-
-        # normalize azimuth to range of 0 to 360 degrees
-        if azimuth < 0:
-            azimuth -= int(azimuth/math.pi/2.0 - 1)*math.pi*2.0
-        if azimuth >= math.pi*2: 
-            azimuth -= int(azimuth/math.pi/2.0)*math.pi*2.0
-
-        return Angle(azimuth)
+        return Angle(azimuth_from_direction(direction, gmst.rad() + location.lon.rad()))
 
     def shell_intercept(self, location, gmst, shell_radius):
 
@@ -185,6 +197,285 @@ class Star(StarLocation):
         return location.distance(shell_intercept, gmst)
 
 
+def local_transform(cos_lst, sin_lst, cos_colat, sin_colat):
+    """
+    Rotation from base ray direction to local ray direction, built from precomputed trig terms.
+
+    Equivalent to rotating Z by -lst, rotating X by the colatitude (pi/2 - latitude) and rotating Z by lst.
+
+    :return: Matrix3
+    """
+    c = cos_lst
+    s = sin_lst
+    return Matrix3((
+        (c*c + s*s*cos_colat, c*s - c*s*cos_colat, s*sin_colat),
+        (s*c - s*c*cos_colat, s*s + c*c*cos_colat, -c*sin_colat),
+        (-s*sin_colat, c*sin_colat, cos_colat),
+    ))
+
+def altitude_from_direction(direction):
+    'Apparent altitude in radians of a guide vector'
+    return math.asin(direction.z / direction.length())
+
+def azimuth_from_direction(direction, lst):
+    """
+    Apparent azimuth in radians of a guide vector seen from a location with the given local sidereal time.
+
+    :param direction: Vector3 local ray direction
+    :param lst: local sidereal time in radians
+    """
+    absolute_direction = 0
+
+    # avoid divide-by-zero errors
+    if direction.x == 0:
+        if direction.y > 0:
+            absolute_direction = math.pi/2
+        else:
+            absolute_direction = -math.pi/2
+    else:
+        # calculate direction relative to global coordinate system
+        absolute_direction = math.atan(direction.y/direction.x) 
+
+    # arctan() range is limited to -90 to 90 degrees. To detect 90 to 270 degrees, test sign of x component.
+    if direction.x < 0:
+        absolute_direction += math.pi
+
+    # adjust angle relative to direction of North Pole. Towards North Pole should be zero degrees.
+    azimuth = lst - math.pi/2 - absolute_direction 
+
+    # normalize azimuth to range of 0 to 360 degrees
+    if azimuth < 0:
+        azimuth -= int(azimuth/math.pi/2.0 - 1)*math.pi*2.0
+    if azimuth >= math.pi*2: 
+        azimuth -= int(azimuth/math.pi/2.0)*math.pi*2.0
+
+    return azimuth
+
+
+class Trace:
+    """
+    Struct-of-arrays result of tracing many stars from many locations at many times. See trace().
+
+    All attributes are arrays of the broadcast input shape. Intercept attributes are None when no shell radius was given.
+    """
+    def __init__(self, direction, azimuth, altitude, intercept=None, distance=None, valid=None):
+        self.direction = direction # (x, y, z) arrays of local ray directions
+        self.azimuth = azimuth
+        self.altitude = altitude
+        self.intercept = intercept # (x, y, z) arrays of celestial shell intercepts
+        self.distance = distance
+        self.valid = valid # False where the shell radius is invalid for that location
+
+
+def trace(ra, dec, lat, lon, gmst, shell_radius=None, dtype=np.float64):
+    """
+    Vectorized version of the Star methods. Computes ray directions, azimuth/altitude and, if a shell radius is given, 
+    shell intercepts and distances in a single pass.
+
+    Arguments are arrays (or scalars) in radians and are broadcast against each other, so N stars x M locations x T times
+    can be evaluated by giving each input its own axis.
+
+    Unlike Star.shell_intercept, an invalid shell radius does not raise. Affected elements are masked with valid=False and set to NaN.
+
+    :param ra: Right Ascension in radians
+    :param dec: Declination in radians
+    :param lat: latitude of location in radians
+    :param lon: longitude of location in radians
+    :param gmst: Greenwich Mean Sidereal Time in radians
+    :param shell_radius: optional radius of the celestial shell in meters
+    :param dtype: np.float64, or np.float32 for half the memory traffic at a lower accuracy (see benchmarks/precision.py)
+
+    :return: Trace
+    """
+    ra, dec, lat, lon, gmst = np.broadcast_arrays(*[np.asarray(a, dtype=dtype) for a in (ra, dec, lat, lon, gmst)])
+
+    lst = gmst + lon # sidereal time for each location
+    direction = _local_ray_directions(ra, dec, lat, lst)
+    x, y, z = direction
+
+    trace = Trace(direction, _azimuths(x, y, lst), _altitudes(x, y, z))
+
+    if shell_radius is not None:
+        o = _location_vectors(lat, lst)
+        trace.intercept, trace.valid = _shell_intercepts(direction, o, shell_radius)
+        trace.distance = np.sqrt(sum((i - j)**2 for i, j in zip(trace.intercept, o)))
+
+    return trace
+
+def ray_directions(ra, dec, lat, lon, gmst, dtype=np.float64):
+    """
+    Vectorized Star.local_ray_direction. See trace() for arguments.
+
+    :return: tuple of x, y, z arrays
+    """
+    return trace(ra, dec, lat, lon, gmst, dtype=dtype).direction
+
+def positions(ra, dec, lat, lon, gmst, dtype=np.float64):
+    """
+    Vectorized Star.azimuth and Star.altitude. See trace() for arguments.
+
+    :return: tuple of azimuth and altitude arrays in radians
+    """
+    result = trace(ra, dec, lat, lon, gmst, dtype=dtype)
+    return result.azimuth, result.altitude
+
+def shell_intercepts(ra, dec, lat, lon, gmst, shell_radius, dtype=np.float64):
+    """
+    Vectorized Star.shell_intercept. See trace() for arguments.
+
+    :return: tuple of x, y, z arrays and the valid mask
+    """
+    result = trace(ra, dec, lat, lon, gmst, shell_radius, dtype)
+    return result.intercept + (result.valid,)
+
+def distances(ra, dec, lat, lon, gmst, shell_radius, dtype=np.float64):
+    """
+    Vectorized Star.distance. See trace() for arguments.
+
+    :return: tuple of distance array and the valid mask
+    """
+    result = trace(ra, dec, lat, lon, gmst, shell_radius, dtype)
+    return result.distance, result.valid
+
+def base_ray_directions(ra, dec):
+    """
+    Vectorized Star.base_ray_direction for arrays of Right Ascension and Declination in radians.
+
+    :return: Vector3Array
+    """
+    ra, dec = np.broadcast_arrays(np.ravel(ra), np.ravel(dec))
+
+    directions = Vector3Array.from_components(0, np.ones(len(ra)), 0) # start pointing towards the Y axis and vernal equinox
+    directions.rotateX(dec) # declination rotation around X axis
+    directions.rotateZ(ra) # right ascension rotation around Z axis
+
+    return directions
+
+def local_ray_directions(base, lat, lon, gmst):
+    """
+    Vectorized Star.local_ray_direction. Rotates a copy of the base ray directions according to location and sidereal time.
+
+    Latitude, longitude and GMST are in radians and are either single values or arrays with one value per row.
+
+    :param base: Vector3Array of base ray directions, see base_ray_directions()
+    :return: Vector3Array
+    """
+    lst = np.asarray(gmst) + np.asarray(lon) # sidereal time for each location
+
+    directions = base.clone()
+    directions.rotateZ(-lst) # rotate to align the longitude with the Y axis to allow easy rotation
+    directions.rotateX(math.pi/2.0 - np.asarray(lat)) # rotate around X axis, towards north pole based on latitude
+    directions.rotateZ(lst) # undo previous rotation to unalign with Y axis
+
+    return directions
+
+def zenith(lat, lon, gmst):
+    """
+    Base ray direction of a star that appears straight up from the given locations.
+    Stars above the horizon have base ray directions less than 90 degrees from this vector.
+
+    Arguments are arrays in radians and are broadcast against each other.
+
+    :return: tuple of x, y, z arrays
+    """
+    return sky_direction(0.0, math.pi/2.0, lat, lon, gmst)
+
+def sky_direction(azimuth, altitude, lat, lon, gmst):
+    """
+    Base ray direction of a star that appears at the given azimuth/altitude. Inverse of positions().
+
+    Arguments are arrays in radians and are broadcast against each other.
+
+    :return: tuple of x, y, z arrays
+    """
+    azimuth, altitude, lat, lon, gmst = np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in (azimuth, altitude, lat, lon, gmst)])
+    lst = gmst + lon
+
+    # local ray direction, see Star.azimuth
+    absolute_direction = lst - math.pi/2 - azimuth
+    x = np.cos(altitude)*np.cos(absolute_direction)
+    y = np.cos(altitude)*np.sin(absolute_direction)
+    z = np.sin(altitude)
+
+    # undo the local rotations in reverse order
+    cos_lst = np.cos(lst)
+    sin_lst = np.sin(lst)
+    cos_lat = np.cos(math.pi/2.0 - lat)
+    sin_lat = np.sin(math.pi/2.0 - lat)
+
+    x, y = x*cos_lst + y*sin_lst, y*cos_lst - x*sin_lst
+    y, z = y*cos_lat + z*sin_lat, z*cos_lat - y*sin_lat
+    x, y = x*cos_lst - y*sin_lst, y*cos_lst + x*sin_lst
+
+    return x, y, z
+
+def _local_ray_directions(ra, dec, lat, lst):
+    'Same rotations as Star.base_ray_direction and Star.local_ray_direction, applied to whole arrays.'
+    # base ray direction
+    cos_dec = np.cos(dec)
+    x = -cos_dec * np.sin(ra)
+    y = cos_dec * np.cos(ra)
+    z = np.sin(dec)
+
+    return _rotate_local(x, y, z, np.cos(lst), np.sin(lst), np.cos(math.pi/2.0 - lat), np.sin(math.pi/2.0 - lat))
+
+def _rotate_local(x, y, z, cos_lst, sin_lst, cos_lat, sin_lat):
+    'Star.local_ray_direction rotations of base ray direction components, given the trig terms of sidereal time and colatitude.'
+    # rotate Z by -lst
+    x, y = x*cos_lst + y*sin_lst, y*cos_lst - x*sin_lst
+    # rotate X towards north pole
+    y, z = y*cos_lat - z*sin_lat, z*cos_lat + y*sin_lat
+    # rotate Z by lst
+    x, y = x*cos_lst - y*sin_lst, y*cos_lst + x*sin_lst
+
+    return x, y, z
+
+def _azimuths(x, y, lst):
+    'Same as Star.azimuth, given the components of the guide vector.'
+    with np.errstate(divide='ignore', invalid='ignore'):
+        absolute_direction = np.arctan(y / x)
+
+    # avoid divide-by-zero errors
+    half_pi = x.dtype.type(math.pi/2) # keeps float32 input in float32
+    absolute_direction = np.where(x == 0, np.where(y > 0, half_pi, -half_pi), absolute_direction)
+
+    # arctan() range is limited to -90 to 90 degrees. To detect 90 to 270 degrees, test sign of x component.
+    absolute_direction = np.where(x < 0, absolute_direction + math.pi, absolute_direction)
+
+    azimuth = lst - math.pi/2 - absolute_direction
+
+    # normalize azimuth to range of 0 to 360 degrees
+    azimuth = np.where(azimuth < 0, azimuth - np.trunc(azimuth/math.pi/2.0 - 1)*math.pi*2.0, azimuth)
+    azimuth = np.where(azimuth >= math.pi*2, azimuth - np.trunc(azimuth/math.pi/2.0)*math.pi*2.0, azimuth)
+
+    return azimuth
+
+def _altitudes(x, y, z):
+    'Same as Star.altitude, given the components of the guide vector. atan2 stays accurate near the zenith, unlike arcsin.'
+    return np.arctan2(z, np.sqrt(x*x + y*y))
+
+def _location_vectors(lat, lst):
+    'Same as Location.vector for arrays of latitudes and sidereal times.'
+    radius = (math.pi/2 - lat) * METERS_PER_RADIAN_LAT
+    return -radius * np.sin(lst), radius * np.cos(lst), np.zeros_like(radius)
+
+def _shell_intercepts(d, o, shell_radius):
+    'Same as Star.shell_intercept, but masks negative discriminants instead of raising.'
+    a = d[0]*d[0] + d[1]*d[1] + d[2]*d[2]
+    b = 2*(o[0]*d[0] + o[1]*d[1] + o[2]*d[2])
+    c = o[0]*o[0] + o[1]*o[1] + o[2]*o[2] - shell_radius*shell_radius
+
+    discriminant = b*b - 4*a*c
+    valid = discriminant >= 0
+    sqrt = np.sqrt(np.where(valid, discriminant, np.nan))
+
+    # make sure we have the positive solution only.
+    t = (-1*b + sqrt)/(2*a)
+    t = np.where(t < 0, (-1*b - sqrt)/(2*a), t)
+
+    return (o[0] + d[0]*t, o[1] + d[1]*t, o[2] + d[2]*t), valid
+
+
 if __name__ == "__main__":
 
     def test():
@@ -210,4 +501,27 @@ if __name__ == "__main__":
         gmst = HourAngle(-41,0,0) 
         print(star.azimuth(location, gmst).deg_min_sec())
 
+        # batch versions match the scalar methods
+        ras = np.array([6.0, 1.0, -2.5])
+        decs = np.array([math.pi/2.0, 0.3, -1.2])
+        directions = local_ray_directions(base_ray_directions(ras, decs), location.lat.rad(), location.lon.rad(), gmst.rad())
+        for ra, dec, direction in zip(ras, decs, directions):
+            expected = Star(Angle(ra), Angle(dec)).local_ray_direction(location, gmst)
+            assert abs(direction.x - expected.x) < 1e-12 and abs(direction.y - expected.y) < 1e-12 and abs(direction.z - expected.z) < 1e-12
+
+        azimuth, altitude = positions(ras, decs, location.lat.rad(), location.lon.rad(), gmst.rad())
+        for ra, dec, a, h in zip(ras, decs, azimuth, altitude):
+            assert abs(Star(Angle(ra), Angle(dec)).azimuth(location, gmst).rad() - a) < 1e-12
+            assert abs(Star(Angle(ra), Angle(dec)).altitude(location, gmst).rad() - h) < 1e-12
+
+        # any SphereLocation works, without the cached transform of Location
+        sphere = SphereLocation(location.lat, location.lon)
+        assert abs(Star(Angle(ras[1]), Angle(decs[1])).azimuth(sphere, gmst).rad() - azimuth[1]) < 1e-12
+        assert abs(Star(Angle(ras[1]), Angle(decs[1])).altitude(sphere, gmst).rad() - altitude[1]) < 1e-12
+
+        # float32 fast path. benchmarks/precision.py measures the error over the whole sky.
+        azimuth32, altitude32 = positions(ras, decs, location.lat.rad(), location.lon.rad(), gmst.rad(), dtype=np.float32)
+        assert azimuth32.dtype == np.float32 and altitude32.dtype == np.float32
+        assert np.max(np.abs(altitude32 - altitude)) < 1e-6
+
     test()
@@ -4,10 +4,39 @@
 import re
 import math
 
+import numpy as np
+
 from util.angle import Angle, Degree, Latlon, HourAngle
 from util.location import StarLocation, SphereLocation
 from util.vector3 import Vector3
 
+class Location(SphereLocation):
+    """
+    Location that keeps the trig terms of its latitude, so they are computed once rather than for every star.
+    Any SphereLocation can be used with Star. This class only saves work.
+    """
+    def __init__(self, lat, lon):
+        SphereLocation.__init__(self, lat, lon)
+        self._terms_key = None
+        self._terms = None
+
+    def latitude_terms(self):
+        'sin and cos of latitude'
+        if self._terms_key != self.lat.rad():
+            lat = self.lat.rad()
+            self._terms = (math.sin(lat), math.cos(lat))
+            self._terms_key = lat
+
+        return self._terms
+
+
+def latitude_terms(location):
+    'sin and cos of latitude of any location, cached if it is a Location'
+    if isinstance(location, Location):
+        return location.latitude_terms()
+    return math.sin(location.lat), math.cos(location.lat)
+
+
 class Star(StarLocation):
     def __init__(self, ra, dec):
         """
@@ -15,6 +44,17 @@ class Star(StarLocation):
         :param dec: HourAngle Declination
         """
         StarLocation.__init__(self, ra, dec)
+        self._terms_key = None
+        self._terms = None
+
+    def declination_terms(self):
+        'sin, cos and tan of declination. Computed once per declination and cached.'
+        if self._terms_key != self.dec.rad():
+            dec = self.dec.rad()
+            self._terms = (math.sin(dec), math.cos(dec), math.tan(dec))
+            self._terms_key = dec
+
+        return self._terms
 
     def azimuth(self, location, gmst):
         """
@@ -25,31 +65,10 @@ class Star(StarLocation):
 
         :return: azimuth Angle
         """
-        lha = self.local_hour_angle(location, gmst)
-
-        den = math.sin(location.lat) * math.cos(lha) - math.tan(self.dec)*math.cos(location.lat)
-        sin_lha = math.sin(lha)
-
-        # prevent divide-by-zero error
-        if den == 0:
-            if sin_lha == 0:
-                return Angle(0)
-            elif sin_lha > 0:
-                return Angle(math.pi*1.5)
-            else:
-                return Angle(math.pi*0.5)
-
-        atan = math.atan(sin_lha / den)
-
-        # atan range is from -90 to 90. Must manually detect other quandrants from sign of denomenator
-        if den > 0:
-            atan += math.pi
-
-        # enforce 0 - 360 range.
-        if atan < 0:
-            atan += math.pi*2.0
+        lha = self._local_hour_angle(location, gmst)
+        sin_lat, cos_lat = latitude_terms(location)
 
-        return Angle(atan)
+        return Angle(azimuth_from_terms(math.sin(lha), math.cos(lha), sin_lat, cos_lat, self.declination_terms()[2]))
 
     def altitude(self, location, gmst):
         """
@@ -60,8 +79,11 @@ class Star(StarLocation):
 
         :return: altitude Angle
         """
-        lha = self.local_hour_angle(location, gmst)
-        return Angle(math.asin(math.sin(location.lat)*math.sin(self.dec) + math.cos(location.lat)*math.cos(self.dec)*math.cos(lha)))
+        lha = self._local_hour_angle(location, gmst)
+        sin_lat, cos_lat = latitude_terms(location)
+        sin_dec, cos_dec, tan_dec = self.declination_terms()
+
+        return Angle(altitude_from_terms(math.cos(lha), sin_lat, cos_lat, sin_dec, cos_dec))
 
     def local_hour_angle(self, location, gmst):
         """
@@ -73,7 +95,11 @@ class Star(StarLocation):
         :return: local hour angle
         """
 
-        return Angle(gmst.rad() + location.lon.rad() - self.ra.rad())
+        return Angle(self._local_hour_angle(location, gmst))
+
+    def _local_hour_angle(self, location, gmst):
+        'Local hour angle in radians, without allocating an Angle'
+        return gmst.rad() + location.lon.rad() - self.ra.rad()
 
     def greenwich_hour_angle(self, location, gmst):
         """
@@ -95,3 +121,140 @@ class Star(StarLocation):
         print("Alt: "+self.altitude(loc, gmst).deg_min_sec())
 
 
+def azimuth_from_terms(sin_lha, cos_lha, sin_lat, cos_lat, tan_dec):
+    """
+    Azimuth in radians from precomputed trig terms of local hour angle, latitude and declination.
+    Lets callers that already know these terms (e.g. time sweeps) skip the trig calls in Star.azimuth.
+    """
+    den = sin_lat * cos_lha - tan_dec*cos_lat
+
+    # prevent divide-by-zero error
+    if den == 0:
+        if sin_lha == 0:
+            return 0.0
+        elif sin_lha > 0:
+            return math.pi*1.5
+        else:
+            return math.pi*0.5
+
+    atan = math.atan(sin_lha / den)
+
+    # atan range is from -90 to 90. Must manually detect other quandrants from sign of denomenator
+    if den > 0:
+        atan += math.pi
+
+    # enforce 0 - 360 range.
+    if atan < 0:
+        atan += math.pi*2.0
+
+    return atan
+
+def altitude_from_terms(cos_lha, sin_lat, cos_lat, sin_dec, cos_dec):
+    'Altitude in radians from precomputed trig terms of local hour angle, latitude and declination.'
+    return math.asin(sin_lat*sin_dec + cos_lat*cos_dec*cos_lha)
+
+
+def positions(ra, dec, lat, lon, gmst, dtype=np.float64):
+    """
+    Calculates azimuth and altitude for many stars, locations and times in a single vectorized pass.
+
+    Arguments are arrays (or scalars) in radians and are broadcast against each other, so a catalog
+    can be evaluated over a grid of observers and timestamps by giving each input its own axis:
+
+        positions(ra[:, None, None], dec[:, None, None], lat[None, :, None], lon[None, :, None], gmst[None, None, :])
+
+    Uses the same quadrant and divide-by-zero handling as Star.azimuth and Star.altitude.
+
+    :param ra: Right Ascension in radians
+    :param dec: Declination in radians
+    :param lat: latitude of location in radians
+    :param lon: longitude of location in radians
+    :param gmst: greenwich sidereal time in radians
+    :param dtype: np.float64, or np.float32 for half the memory traffic at a lower accuracy (see benchmarks/precision.py)
+
+    :return: tuple of azimuth and altitude arrays in radians
+    """
+    ra, dec, lat, lon, gmst = np.broadcast_arrays(*[np.asarray(a, dtype=dtype) for a in (ra, dec, lat, lon, gmst)])
+
+    # float32 rounds +-90 degrees to just beyond the pole, which would flip the sign of tan(dec) and the azimuth with it
+    limit = _half_pi(dtype)
+    dec = np.clip(dec, -limit, limit)
+    lat = np.clip(lat, -limit, limit)
+
+    lha = gmst + lon - ra
+
+    return positions_from_terms(np.sin(lha), np.cos(lha), np.sin(lat), np.cos(lat), np.sin(dec), np.cos(dec), np.tan(dec))
+
+def positions_from_terms(sin_lha, cos_lha, sin_lat, cos_lat, sin_dec, cos_dec, tan_dec):
+    """
+    Vectorized azimuth_from_terms and altitude_from_terms. Arrays are broadcast against each other.
+
+    :return: tuple of azimuth and altitude arrays in radians
+    """
+    den = sin_lat * cos_lha - tan_dec*cos_lat
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        atan = np.arctan(sin_lha / den)
+
+    # atan range is from -90 to 90. Must manually detect other quandrants from sign of denomenator
+    atan = np.where(den > 0, atan + math.pi, atan)
+
+    # enforce 0 - 360 range.
+    atan = np.where(atan < 0, atan + math.pi*2.0, atan)
+
+    # prevent divide-by-zero error
+    atan = np.where(den == 0, np.where(sin_lha == 0, 0.0, np.where(sin_lha > 0, math.pi*1.5, math.pi*0.5)).astype(atan.dtype), atan)
+
+    # the horizontal part of the star direction is cos(dec)*hypot(sin_lha, den). atan2 keeps altitude accurate near the zenith,
+    # where arcsin loses half of the digits (most of them in float32).
+    altitude = np.arctan2(sin_lat*sin_dec + cos_lat*cos_dec*cos_lha, np.abs(cos_dec)*np.hypot(sin_lha, den))
+
+    return atan, altitude
+
+def _half_pi(dtype):
+    'Largest value of dtype that is not beyond pi/2'
+    limit = np.asarray(math.pi/2, dtype=dtype)
+    return limit if float(limit) <= math.pi/2 else np.nextafter(limit, limit.dtype.type(0))
+
+def zenith(lat, lon, gmst):
+    """
+    Direction straight up from the given locations, as a unit vector in the star coordinate frame of flat.Star.base_ray_direction
+    (vernal equinox along Y, north pole along Z). Stars above the horizon are less than 90 degrees from this vector.
+
+    Arguments are arrays in radians and are broadcast against each other.
+
+    :return: tuple of x, y, z arrays
+    """
+    lat, lon, gmst = np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in (lat, lon, gmst)])
+    lst = gmst + lon
+
+    cos_lat = np.cos(lat)
+    return -np.sin(lst)*cos_lat, np.cos(lst)*cos_lat, np.sin(lat)
+
+def sky_direction(azimuth, altitude, lat, lon, gmst):
+    """
+    Point in the sky with the given azimuth/altitude as a unit vector in the star coordinate frame. Inverse of positions().
+
+    Arguments are arrays in radians and are broadcast against each other.
+
+    :return: tuple of x, y, z arrays
+    """
+    azimuth, altitude, lat, lon, gmst = np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in (azimuth, altitude, lat, lon, gmst)])
+    lst = gmst + lon
+
+    sin_lst = np.sin(lst)
+    cos_lst = np.cos(lst)
+    sin_lat = np.sin(lat)
+    cos_lat = np.cos(lat)
+
+    # components along north, east and zenith
+    north = np.cos(altitude)*np.cos(azimuth)
+    east = np.cos(altitude)*np.sin(azimuth)
+    up = np.sin(altitude)
+
+    x = north*sin_lst*sin_lat - east*cos_lst - up*sin_lst*cos_lat
+    y = -north*cos_lst*sin_lat - east*sin_lst + up*cos_lst*cos_lat
+    z = north*cos_lat + up*sin_lat
+
+    return x, y, z
+
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Celestial navigation: estimates observer latitude and longitude from measured azimuth/altitude of catalog stars.
+
+Many observation sets are solved at once. Each set is a row of observations (one star, measured az/alt and GMST each),
+and every step works on all unfinished rows in a single array pass:
+
+    1. a coarse latitude/longitude grid gives each set a starting point near the global minimum
+    2. Levenberg-Marquardt iterations refine it, with central difference Jacobians taken from the model itself
+
+Residuals are the altitude error and the azimuth error along the sky (times cos altitude), in radians,
+so the RMS residual of a fix tells how well the model explains the observations.
+"""
+
+import math
+from collections import namedtuple
+
+import numpy as np
+
+DEFAULT_GRID_STEP = math.radians(10.0)
+DEFAULT_ITERATIONS = 50
+DEFAULT_TOLERANCE = 1e-12 # radians of lat/lon
+DIFFERENCE_STEP = 1e-6 # radians, for the central difference Jacobian
+CHUNK_SIZE = 1 << 20 # observations per array pass
+
+
+Fix = namedtuple('Fix', 'lat lon residuals rms converged')
+Fix.__doc__ = """
+Solved locations of observation sets. lat, lon and rms are arrays with one value per set, in radians.
+residuals has shape (sets, observations, 2) with altitude and azimuth residuals (zero for missing observations).
+converged is False for sets that did not converge within the iteration limit, or stopped improving before their step
+was below the tolerance.
+"""
+
+
+def solve(model, ra, dec, azimuth, altitude, gmst, grid_step=DEFAULT_GRID_STEP, iterations=DEFAULT_ITERATIONS, tolerance=DEFAULT_TOLERANCE):
+    """
+    Finds the latitude and longitude that best explain each set of observations under the given model.
+
+    Arguments are broadcast to shape (sets, observations). Sets with fewer observations are padded with NaN azimuth or altitude.
+    At least two observations are needed for a unique fix.
+
+    :param model: globe or flat module
+    :param ra: Right Ascension of observed stars in radians
+    :param dec: Declination of observed stars in radians
+    :param azimuth: measured azimuth in radians
+    :param altitude: measured altitude in radians
+    :param gmst: Greenwich Mean Sidereal Time of each observation in radians
+
+    :return: Fix
+    """
+    ra, dec, azimuth, altitude, gmst = [np.array(a, dtype=np.float64) for a in np.broadcast_arrays(*[np.atleast_2d(a) for a in (ra, dec, azimuth, altitude, gmst)])]
+    valid = np.isfinite(azimuth) & np.isfinite(altitude)
+    observations = Observations(model, ra, dec, np.where(valid, azimuth, 0.0), np.where(valid, altitude, 0.0), gmst, valid)
+
+    lat, lon = _grid_start(observations, grid_step)
+    lat, lon, converged = _levenberg_marquardt(observations, lat, lon, iterations, tolerance)
+
+    residuals = observations.residuals(np.arange(len(lat)), lat, lon)
+    count = np.maximum(valid.sum(axis=1), 1)
+    rms = np.sqrt((residuals**2).sum(axis=(1, 2)) / count)
+
+    return Fix(lat, lon, residuals, rms, converged)
+
+
+class Observations:
+    'Observation sets and their residuals for trial locations'
+
+    def __init__(self, model, ra, dec, azimuth, altitude, gmst, valid):
+        self.model = model
+        self.ra = ra
+        self.dec = dec
+        self.azimuth = azimuth
+        self.altitude = altitude
+        self.cos_altitude = np.cos(altitude)
+        self.gmst = gmst
+        self.valid = valid
+
+    def residuals(self, rows, lat, lon):
+        """
+        :param rows: index array of observation sets
+        :param lat: trial latitudes, with the shape of rows plus optional trailing axes
+        :param lon: trial longitudes
+
+        :return: array of shape lat.shape + (observations, 2)
+        """
+        extra = (slice(None),) + (None,)*(np.ndim(lat) - 1)
+        ra, dec, gmst = [a[rows][extra] for a in (self.ra, self.dec, self.gmst)]
+        azimuth, altitude = self.model.positions(ra, dec, lat[..., None], lon[..., None], gmst)
+
+        valid = self.valid[rows][extra]
+        return np.stack((
+            np.where(valid, altitude - self.altitude[rows][extra], 0.0),
+            np.where(valid, _wrap(azimuth - self.azimuth[rows][extra])*self.cos_altitude[rows][extra], 0.0),
+        ), axis=-1)
+
+
+def _grid_start(observations, step):
+    'Best location of each set on a latitude/longitude grid'
+    lats = np.arange(-math.pi/2.0 + step/2.0, math.pi/2.0, step)
+    lons = np.arange(-math.pi, math.pi, step)
+    lat, lon = [a.ravel() for a in np.meshgrid(lats, lons, indexing='ij')]
+
+    sets, count = observations.ra.shape
+    best_lat = np.empty(sets)
+    best_lon = np.empty(sets)
+    size = max(1, CHUNK_SIZE // (len(lat)*count))
+    for offset in range(0, sets, size):
+        rows = np.arange(offset, min(sets, offset + size))
+        cost = (observations.residuals(rows, np.broadcast_to(lat, (len(rows), len(lat))), np.broadcast_to(lon, (len(rows), len(lon))))**2).sum(axis=(2, 3))
+        best = cost.argmin(axis=1)
+        best_lat[rows] = lat[best]
+        best_lon[rows] = lon[best]
+
+    return best_lat, best_lon
+
+
+def _levenberg_marquardt(observations, lat, lon, iterations, tolerance):
+    'Refines all sets together. Sets drop out of the array passes as they converge.'
+    sets = len(lat)
+    lat, lon = lat.copy(), lon.copy()
+    damping = np.full(sets, 1e-3)
+    converged = np.zeros(sets, dtype=bool)
+
+    active = np.arange(sets)
+    r = observations.residuals(active, lat, lon).reshape(sets, -1)
+    cost = (r**2).sum(axis=1)
+
+    h = DIFFERENCE_STEP
+    for iteration in range(iterations):
+        if len(active) == 0:
+            break
+
+        # central difference Jacobian for all active sets in one pass
+        la, lo = lat[active], lon[active]
+        trial_lat = np.stack((la + h, la - h, la, la), axis=1)
+        trial_lon = np.stack((lo, lo, lo + h, lo - h), axis=1)
+        shifted = observations.residuals(active, trial_lat, trial_lon).reshape(len(active), 4, -1)
+        j_lat = (shifted[:, 0] - shifted[:, 1]) / (2.0*h)
+        j_lon = (shifted[:, 2] - shifted[:, 3]) / (2.0*h)
+
+        # damped normal equations, 2x2 per set
+        residual = r[active]
+        a = (j_lat*j_lat).sum(axis=1)
+        b = (j_lat*j_lon).sum(axis=1)
+        c = (j_lon*j_lon).sum(axis=1)
+        g_lat = (j_lat*residual).sum(axis=1)
+        g_lon = (j_lon*residual).sum(axis=1)
+        d = damping[active]
+        a_ = a*(1.0 + d) + 1e-30
+        c_ = c*(1.0 + d) + 1e-30
+        det = a_*c_ - b*b
+        step_lat = -(c_*g_lat - b*g_lon) / det
+        step_lon = -(a_*g_lon - b*g_lat) / det
+
+        new_lat = np.clip(la + step_lat, -math.pi/2.0, math.pi/2.0)
+        new_lon = _wrap(lo + step_lon)
+        new_r = observations.residuals(active, new_lat, new_lon).reshape(len(active), -1)
+        new_cost = (new_r**2).sum(axis=1)
+
+        better = new_cost <= cost[active]
+        accepted = active[better]
+        lat[accepted], lon[accepted] = new_lat[better], new_lon[better]
+        r[accepted], cost[accepted] = new_r[better], new_cost[better]
+        damping[active] = np.where(better, damping[active]*0.1, damping[active]*10.0)
+
+        # sets that cannot improve any more drop out too, but are not converged
+        done = better & (np.hypot(step_lat, step_lon) < tolerance)
+        stalled = damping[active] > 1e12
+        converged[active[done]] = True
+        active = active[~(done | stalled)]
+
+    return lat, lon, converged
+
+
+def _wrap(angle):
+    'Angle in the range -pi to pi'
+    return np.mod(angle + math.pi, math.pi*2.0) - math.pi
+
+
+
+"""
+For testing only
+"""
+if __name__ == "__main__":
+
+    def test():
+        import flat
+        import globe
+
+        state = np.random.RandomState(11)
+        sets, count = 300, 12
+        lat = np.arcsin(state.uniform(-0.95, 0.95, sets))
+        lon = state.uniform(-math.pi, math.pi, sets)
+        ra = state.uniform(0, math.pi*2.0, (sets, count))
+        dec = np.arcsin(state.uniform(-1, 1, (sets, count)))
+        gmst = state.uniform(0, math.pi*2.0, (sets, 1)) + np.arange(count)*1e-3 # a few seconds between sightings
+
+        for model in (globe, flat):
+            azimuth, altitude = model.positions(ra, dec, lat[:, None], lon[:, None], gmst)
+            # only stars above the horizon can be sighted
+            hidden = altitude < math.radians(5.0)
+            azimuth[hidden] = np.nan
+
+            fix = solve(model, ra, dec, azimuth, altitude, gmst)
+            assert np.all(fix.converged)
+            assert np.max(np.abs(fix.lat - lat)) < 1e-8
+            assert np.max(np.abs(_wrap(fix.lon - lon))*np.cos(lat)) < 1e-8
+            assert np.max(fix.rms) < 1e-9
+            assert np.all(fix.residuals[hidden] == 0)
+
+            # noisy sightings: the residuals show the noise
+            noise = math.radians(0.01)
+            fix = solve(model, ra, dec, azimuth + state.normal(0, noise, azimuth.shape), altitude + state.normal(0, noise, altitude.shape), gmst)
+            assert np.median(np.abs(fix.lat - lat)) < noise*3
+            assert 0.3*noise < np.median(fix.rms) < 2*noise
+
+        # a model that is undefined away from the grid start rejects every step, so the sets stall and are not converged
+        class GridOnly:
+            @staticmethod
+            def positions(ra, dec, lat, lon, gmst):
+                azimuth, altitude = globe.positions(ra, dec, lat, lon, gmst)
+                steps = (lat + math.pi/2.0)/DEFAULT_GRID_STEP - 0.5 # whole numbers on the grid of _grid_start
+                off_grid = np.abs(steps - np.round(steps)) > 1e-9
+                return np.where(off_grid, np.nan, azimuth), altitude
+
+        azimuth, altitude = globe.positions(ra[:10], dec[:10], lat[:10, None], lon[:10, None], gmst[:10])
+        fix = solve(GridOnly, ra[:10], dec[:10], azimuth, altitude, gmst[:10])
+        assert not np.any(fix.converged)
+
+    test()
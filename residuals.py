@@ -0,0 +1,434 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+import os
+import csv
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+import flat
+import globe
+
+from util.gmst import gmst_array, datetime64
+from util.precession import columns_at
+
+HISTOGRAM_BINS = 200
+HISTOGRAM_RANGE = math.radians(1.0) # residuals outside +/- this range are counted in the outermost bins
+FIELD_CHUNK_SIZE = 1 << 20 # star/location pairs per array pass of residual_field
+
+
+class Statistics:
+    """
+    Streaming statistics for several groups of samples at once: count, mean, RMS, maximum absolute value and a histogram.
+
+    Samples are reduced as they are added, so memory use does not depend on the number of samples.
+    Statistics from separate chunks of work are combined with merge().
+    """
+
+    def __init__(self, groups, edges):
+        """
+        :param groups: number of groups
+        :param edges: histogram bin edges
+        """
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.count = np.zeros(groups, dtype=np.int64)
+        self.total = np.zeros(groups)
+        self.total_sq = np.zeros(groups)
+        self.max = np.zeros(groups)
+        self.histogram = np.zeros((groups, len(self.edges) - 1), dtype=np.int64)
+
+    def add(self, values, group=None):
+        """
+        Adds samples.
+
+        :param values: array with one row per group, or any array of samples for a single group
+        :param group: group number if values belong to a single group
+        """
+        values = np.asarray(values, dtype=np.float64)
+        bins = len(self.edges) - 1
+
+        if group is None:
+            values = values.reshape(len(self.count), -1)
+            rows = slice(None)
+        else:
+            values = values.reshape(1, -1)
+            rows = slice(group, group+1)
+
+        self.count[rows] += values.shape[1]
+        self.total[rows] += values.sum(axis=1)
+        self.total_sq[rows] += (values*values).sum(axis=1)
+        if values.shape[1]:
+            self.max[rows] = np.maximum(self.max[rows], np.abs(values).max(axis=1))
+
+        # histogram of every group in one pass: offset each group's bin numbers by its row
+        index = np.clip(np.searchsorted(self.edges, values, 'right') - 1, 0, bins - 1)
+        index += np.arange(values.shape[0])[:, None]*bins
+        self.histogram[rows] += np.bincount(index.ravel(), minlength=values.shape[0]*bins).reshape(-1, bins)
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.max = np.maximum(self.max, other.max)
+        self.histogram += other.histogram
+        return self
+
+    def mean(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.total / self.count
+
+    def rms(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.sqrt(self.total_sq / self.count)
+
+
+class ResidualSummary:
+    """
+    Flat minus globe azimuth/altitude residuals in radians, per star and per latitude band.
+    Azimuth residuals are wrapped to the range -180 to 180 degrees.
+    """
+
+    def __init__(self, names, band_edges, histogram_edges):
+        self.names = list(names)
+        self.band_edges = np.asarray(band_edges, dtype=np.float64)
+        self.star_azimuth = Statistics(len(self.names), histogram_edges)
+        self.star_altitude = Statistics(len(self.names), histogram_edges)
+        self.band_azimuth = Statistics(len(self.band_edges) - 1, histogram_edges)
+        self.band_altitude = Statistics(len(self.band_edges) - 1, histogram_edges)
+
+    def merge(self, other):
+        self.star_azimuth.merge(other.star_azimuth)
+        self.star_altitude.merge(other.star_altitude)
+        self.band_azimuth.merge(other.band_azimuth)
+        self.band_altitude.merge(other.band_altitude)
+        return self
+
+    def report(self):
+        'Table of statistics in degrees.'
+        lines = ["star\tcount\taz mean\taz rms\taz max\talt mean\talt rms\talt max"]
+        for i, name in enumerate(self.names):
+            lines.append(self._row(name, self.star_azimuth, self.star_altitude, i))
+
+        lines.append("")
+        lines.append("latitude\tcount\taz mean\taz rms\taz max\talt mean\talt rms\talt max")
+        for i in range(len(self.band_edges) - 1):
+            name = "%g to %g" % (math.degrees(self.band_edges[i]), math.degrees(self.band_edges[i+1]))
+            lines.append(self._row(name, self.band_azimuth, self.band_altitude, i))
+
+        return "\n".join(lines)
+
+    def _row(self, name, azimuth, altitude, i):
+        values = [azimuth.mean()[i], azimuth.rms()[i], azimuth.max[i], altitude.mean()[i], altitude.rms()[i], altitude.max[i]]
+        return "\t".join([name, str(azimuth.count[i])] + [str(math.degrees(v)) for v in values])
+
+
+def grid(lat_step, lon_step):
+    """
+    Cell centres of a uniform lat/lon grid.
+
+    :return: tuple of latitude and longitude arrays in radians
+    """
+    lats = np.arange(-math.pi/2.0 + lat_step/2.0, math.pi/2.0, lat_step)
+    lons = np.arange(-math.pi + lon_step/2.0, math.pi, lon_step)
+    return lats, lons
+
+
+def sidereal_times(start, end, step):
+    'GMST in radians at each time step from start to end (inclusive).'
+    steps = int((end - start).total_seconds() // step.total_seconds()) + 1
+    return gmst_array(datetime64(start) + np.arange(steps)*np.timedelta64(step, 'us'))
+
+
+def residual_sweep(stars, start, end, step, lat_step=math.radians(1.0), lon_step=math.radians(1.0), band_width=math.radians(10.0),
+        workers=None, chunk_rows=4, chunk_times=64, histogram_edges=None):
+    """
+    Compares flat and globe azimuth/altitude of every star over a lat/lon grid and a time range.
+
+    The grid is split into chunks of latitude rows and time steps. Chunks run on a pool of worker processes and each one
+    returns a small ResidualSummary, so no individual samples are kept.
+    Star positions are precessed to the first time of each chunk (see util.precession.columns_at).
+
+    :param stars: Catalog or dict of name: StarLocation
+    :param start: datetime of first time step
+    :param end: datetime of last time step (inclusive)
+    :param step: timedelta between time steps
+    :param lat_step: latitude resolution of the grid in radians
+    :param lon_step: longitude resolution of the grid in radians
+    :param band_width: height of latitude bands in radians
+    :param workers: number of worker processes. Defaults to the number of CPUs. 1 runs in this process.
+    :param chunk_rows: latitude rows per chunk
+    :param chunk_times: time steps per chunk
+    :param histogram_edges: bin edges of residual histograms in radians
+
+    :return: ResidualSummary
+    """
+    names = columns_at(stars, start)[0]
+    lats, lons = grid(lat_step, lon_step)
+
+    gmsts = sidereal_times(start, end, step)
+
+    band_edges = np.arange(-math.pi/2.0, math.pi/2.0 + band_width/2.0, band_width)
+    band_edges[-1] = math.pi/2.0
+    if histogram_edges is None:
+        histogram_edges = np.linspace(-HISTOGRAM_RANGE, HISTOGRAM_RANGE, HISTOGRAM_BINS + 1)
+
+    chunks = ((names,) + columns_at(stars, start + step*j)[1:] + (lats[i:i+chunk_rows], lons, gmsts[j:j+chunk_times], band_edges, histogram_edges)
+            for i in range(0, len(lats), chunk_rows) for j in range(0, len(gmsts), chunk_times))
+
+    summary = ResidualSummary(names, band_edges, histogram_edges)
+    for result in run_chunks(residual_chunk, chunks, workers):
+        summary.merge(result)
+
+    return summary
+
+
+def run_chunks(function, chunks, workers=None):
+    """
+    Runs function(*chunk) for every chunk on a pool of worker processes and yields the results in completion order.
+    Only a few chunks per worker are queued at a time, so chunks can be produced lazily by a generator.
+
+    :param function: module level function
+    :param chunks: iterable of argument tuples
+    :param workers: number of worker processes. Defaults to the number of CPUs. 1 runs in this process.
+    """
+    if workers == 1:
+        for chunk in chunks:
+            yield function(*chunk)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for chunk in chunks:
+            pending.add(executor.submit(function, *chunk))
+            if len(pending) >= workers*4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+        for future in wait(pending)[0]:
+            yield future.result()
+
+
+def residual_chunk(names, ra, dec, lats, lons, gmsts, band_edges, histogram_edges):
+    """
+    Residual statistics for every star over the given latitude rows, longitudes and GMST values (radians).
+    Unit of work for residual_sweep().
+
+    :return: ResidualSummary
+    """
+    summary = ResidualSummary(names, band_edges, histogram_edges)
+    bands = np.clip(np.searchsorted(band_edges, lats, 'right') - 1, 0, len(band_edges) - 2)
+
+    # stars x latitudes x longitudes
+    ra = np.asarray(ra)[:, None, None]
+    dec = np.asarray(dec)[:, None, None]
+    lat = np.asarray(lats)[None, :, None]
+    lon = np.asarray(lons)[None, None, :]
+
+    for sidereal in gmsts:
+        globe_azimuth, globe_altitude = globe.positions(ra, dec, lat, lon, sidereal)
+        flat_azimuth, flat_altitude = flat.positions(ra, dec, lat, lon, sidereal)
+
+        azimuth = np.mod(flat_azimuth - globe_azimuth + math.pi, math.pi*2.0) - math.pi
+        altitude = flat_altitude - globe_altitude
+
+        summary.star_azimuth.add(azimuth)
+        summary.star_altitude.add(altitude)
+
+        for band in np.unique(bands):
+            rows = bands == band
+            summary.band_azimuth.add(azimuth[:, rows], band)
+            summary.band_altitude.add(altitude[:, rows], band)
+
+    return summary
+
+
+Cell = namedtuple('Cell', 'lat_min lat_max lon_min lon_max depth residual_min residual_max')
+Cell.__doc__ = """
+Leaf cell of an adaptive residual map. Angles and residuals are in radians. Residuals are sampled at the corners and centre.
+"""
+
+
+def separation(azimuth1, altitude1, azimuth2, altitude2):
+    'Angular distance between two azimuth/altitude directions, accurate for small distances.'
+    haversine = np.sin((altitude2 - altitude1)/2.0)**2 + np.cos(altitude1)*np.cos(altitude2)*np.sin((azimuth2 - azimuth1)/2.0)**2
+    return 2.0*np.arcsin(np.sqrt(np.clip(haversine, 0.0, 1.0)))
+
+
+def residual_field(ra, dec, lats, lons, gmsts, chunk_size=FIELD_CHUNK_SIZE):
+    """
+    Largest angular distance between the flat and globe position of any star at any of the given times, at each location.
+
+    Locations are evaluated in chunks of about chunk_size star/location pairs, one time at a time, so memory use
+    does not grow with the number of locations or times.
+
+    :param ra: array of Right Ascension in radians
+    :param dec: array of Declination in radians
+    :param lats: array of location latitudes in radians
+    :param lons: array of location longitudes in radians, same shape as lats
+    :param gmsts: array of GMST in radians
+    :param chunk_size: star/location pairs per array pass
+
+    :return: array with one residual per location
+    """
+    ra = np.asarray(ra)[:, None]
+    dec = np.asarray(dec)[:, None]
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    residual = np.zeros(len(lats))
+    size = max(1, chunk_size // max(1, len(ra)))
+    for offset in range(0, len(lats), size):
+        lat = lats[None, offset:offset+size]
+        lon = lons[None, offset:offset+size]
+        chunk = residual[offset:offset+size]
+        for sidereal in gmsts:
+            globe_azimuth, globe_altitude = globe.positions(ra, dec, lat, lon, sidereal)
+            flat_azimuth, flat_altitude = flat.positions(ra, dec, lat, lon, sidereal)
+            np.maximum(chunk, separation(globe_azimuth, globe_altitude, flat_azimuth, flat_altitude).max(axis=0), out=chunk)
+
+    return residual
+
+
+def refine(stars, start, end, step, tolerance, lat_step=math.radians(30.0), lon_step=math.radians(30.0), max_depth=6):
+    """
+    Adaptive residual map. Starts from a coarse lat/lon grid and splits a cell into four while the residual
+    (see residual_field) varies by more than the tolerance across its corners and centre, up to max_depth splits.
+
+    Each level of the tree is evaluated in one batch, and samples shared by neighbouring cells are only evaluated once.
+    Longitude pi is the same sample as -pi, and each pole is a single sample.
+    Star positions are precessed to the middle of the time range.
+
+    :param stars: Catalog or dict of name: StarLocation
+    :param start: datetime of first time step
+    :param end: datetime of last time step (inclusive)
+    :param step: timedelta between time steps
+    :param tolerance: largest residual range in radians allowed in a leaf cell
+    :param lat_step: latitude size of the starting cells in radians
+    :param lon_step: longitude size of the starting cells in radians
+    :param max_depth: maximum number of splits of a starting cell
+
+    :return: tuple of (list of leaf Cells, number of locations evaluated)
+    """
+    names, ra, dec = columns_at(stars, start + (end - start)/2)
+    gmsts = sidereal_times(start, end, step)
+
+    lat_edges = np.append(np.arange(-math.pi/2.0, math.pi/2.0, lat_step), math.pi/2.0)
+    lon_edges = np.append(np.arange(-math.pi, math.pi, lon_step), math.pi)
+    cells = [(lat_edges[i], lat_edges[i+1], lon_edges[j], lon_edges[j+1], 0) for i in range(len(lat_edges) - 1) for j in range(len(lon_edges) - 1)]
+
+    values = {} # (lat, lon): residual
+    leaves = []
+
+    while cells:
+        # evaluate all new sample points of this level at once
+        points = [point for cell in cells for point in _cell_points(cell) if point not in values]
+        points = list(dict.fromkeys(points))
+        if points:
+            lats, lons = zip(*points)
+            values.update(zip(points, residual_field(ra, dec, lats, lons, gmsts)))
+
+        children = []
+        for cell in cells:
+            samples = [values[point] for point in _cell_points(cell)]
+            lat_min, lat_max, lon_min, lon_max, depth = cell
+
+            if depth < max_depth and max(samples) - min(samples) > tolerance:
+                lat_mid = (lat_min + lat_max)/2.0
+                lon_mid = (lon_min + lon_max)/2.0
+                children += [
+                    (lat_min, lat_mid, lon_min, lon_mid, depth+1), (lat_min, lat_mid, lon_mid, lon_max, depth+1),
+                    (lat_mid, lat_max, lon_min, lon_mid, depth+1), (lat_mid, lat_max, lon_mid, lon_max, depth+1)]
+            else:
+                leaves.append(Cell(lat_min, lat_max, lon_min, lon_max, depth, min(samples), max(samples)))
+
+        cells = children
+
+    return leaves, len(values)
+
+
+def _cell_points(cell):
+    'Corners and centre of a cell'
+    lat_min, lat_max, lon_min, lon_max, depth = cell
+    return tuple(_sample_point(lat, lon) for lat, lon in
+            ((lat_min, lon_min), (lat_min, lon_max), (lat_max, lon_min), (lat_max, lon_max), ((lat_min + lat_max)/2.0, (lon_min + lon_max)/2.0)))
+
+
+def _sample_point(lat, lon):
+    'Longitudes in the half open range -pi to pi, and one longitude at the poles, so each location has one sample'
+    if abs(lat) >= math.pi/2.0:
+        return (math.copysign(math.pi/2.0, lat), -math.pi)
+    if lon >= math.pi:
+        lon -= math.pi*2.0
+    return (lat, lon)
+
+
+def write_cells(cells, filename):
+    'Saves leaf cells as CSV in degrees'
+    with open(filename, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(["lat_min", "lat_max", "lon_min", "lon_max", "depth", "residual_min", "residual_max"])
+        for cell in cells:
+            writer.writerow([math.degrees(v) for v in cell[0:4]] + [cell.depth] + [math.degrees(v) for v in cell[5:7]])
+
+
+
+"""
+For testing only
+"""
+if __name__ == "__main__":
+
+    def test():
+        from datetime import datetime, timedelta
+        from util.angle import Degree
+        from util.location import StarLocation
+        from util.gmst import utc
+
+        stars = {"a": StarLocation(Degree(30), Degree(-60)), "b": StarLocation(Degree(250), Degree(10))}
+        start = datetime(2016, 5, 5, 0, 0, 0, 0, utc)
+        end = start + timedelta(hours=23)
+        step = timedelta(hours=1)
+
+        serial = residual_sweep(stars, start, end, step, math.radians(10), math.radians(10), workers=1, chunk_rows=3, chunk_times=5)
+        parallel = residual_sweep(stars, start, end, step, math.radians(10), math.radians(10), workers=2)
+
+        assert list(serial.star_azimuth.count) == [18*36*24]*2
+        assert serial.band_altitude.count.sum() == 2*18*36*24
+        assert np.array_equal(serial.star_altitude.histogram, parallel.star_altitude.histogram)
+        assert np.allclose(serial.star_altitude.rms(), parallel.star_altitude.rms())
+        assert np.allclose(serial.band_azimuth.max, parallel.band_azimuth.max)
+
+        # statistics match a direct calculation
+        values = np.random.RandomState(0).normal(size=(3, 1000))
+        statistics = Statistics(3, np.linspace(-1, 1, 11))
+        statistics.add(values[:, :400])
+        statistics.add(values[:, 400:])
+        assert np.allclose(statistics.mean(), values.mean(axis=1))
+        assert np.allclose(statistics.rms(), np.sqrt((values**2).mean(axis=1)))
+        assert np.allclose(statistics.max, np.abs(values).max(axis=1))
+        assert statistics.histogram[1, 0] == np.sum(values[1] < -0.8)
+
+        # adaptive map covers the whole sphere, splits every cell when the tolerance is negative and never splits when it is huge.
+        # Corners at longitude pi are the samples at -pi, and each pole is one sample.
+        names, ra, dec = columns_at(stars, start + (end - start)/2)
+        cells, evaluated = refine(stars, start, end, timedelta(hours=6), -1, math.radians(45), math.radians(45), max_depth=2)
+        assert len(cells) == 4*8*16 and evaluated == (4*4 - 1)*8*4 + 2 + 4*8*16
+        assert abs(sum((c.lat_max - c.lat_min)*(c.lon_max - c.lon_min) for c in cells) - 2*math.pi*math.pi) < 1e-9
+        cell = cells[100]
+        assert residual_field(ra, dec, [cell.lat_min], [cell.lon_min], sidereal_times(start, end, timedelta(hours=6)))[0] <= cell.residual_max
+
+        cells, evaluated = refine(stars, start, end, timedelta(hours=6), 1, math.radians(45), math.radians(45), max_depth=2)
+        assert len(cells) == 4*8 and evaluated == 3*8 + 2 + 4*8
+
+        # the same field in chunks of a few locations
+        lats, lons = np.linspace(-1.5, 1.5, 7), np.linspace(-3, 3, 7)
+        gmsts = sidereal_times(start, end, timedelta(hours=6))
+        assert np.array_equal(residual_field(ra, dec, lats, lons, gmsts, chunk_size=5), residual_field(ra, dec, lats, lons, gmsts))
+
+        print(serial.report())
+
+    test()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Rise, set and culmination (upper and lower transit) times of a whole catalog from one location, in both models.
+
+The globe model has a closed form: a star crosses the altitude h when its local hour angle is +/-H0 with
+
+    cos(H0) = (sin(h) - sin(lat) sin(dec)) / (cos(lat) cos(dec))
+
+and transits at hour angles 0 and 180 degrees. The flat model is solved numerically from its own altitude function:
+altitudes of all stars are sampled on a time grid in one array pass, every sign change becomes a bracket, and all
+brackets are refined together with the Illinois (modified regula falsi) method, one array pass per iteration.
+Culminations are roots of the time derivative of altitude, found the same way.
+
+Times are seconds since the start of the range. Sidereal time advances linearly with time, at the same rate as gmst().
+"""
+
+import math
+from collections import namedtuple
+
+import numpy as np
+
+import flat
+import globe
+
+from util.gmst import gmst, datetime64, RADIANS_PER_SECOND
+
+RISE, SET, UPPER_TRANSIT, LOWER_TRANSIT = range(4)
+KIND_NAMES = ('rise', 'set', 'upper transit', 'lower transit')
+
+RISES_AND_SETS, CIRCUMPOLAR, NEVER_RISES = range(3)
+STATUS_NAMES = ('rises and sets', 'circumpolar', 'never rises')
+
+SIDEREAL_DAY = math.pi*2.0/RADIANS_PER_SECOND # seconds
+DEFAULT_STEP = 600.0 # seconds between samples of the flat model. Crossings closer together than this can be missed.
+DEFAULT_TOLERANCE = 1e-3 # seconds
+DERIVATIVE_STEP = 1.0 # seconds, for the central difference of altitude
+FLAT_ALTITUDE = 1e-12 # radians. Stars whose altitude changes less than this over a day never culminate.
+CHUNK_SIZE = 1 << 20 # samples per array pass
+
+
+Events = namedtuple('Events', 'star kind time azimuth altitude')
+Events.__doc__ = """
+Events of a catalog, sorted by time. Each field is an array with one value per event:
+star index, kind (RISE, SET, UPPER_TRANSIT or LOWER_TRANSIT), seconds since start, azimuth and altitude in radians.
+"""
+
+
+def events(model, ra, dec, lat, lon, start, end, altitude=0.0):
+    """
+    Rise, set and transit times of a catalog from one location with the given model.
+
+    :param model: globe or flat module
+    :param ra: array of Right Ascensions in radians
+    :param dec: array of Declinations in radians
+    :param lat: latitude of location in radians
+    :param lon: longitude of location in radians
+    :param start: datetime of the start of the range, in UTC
+    :param end: datetime of the end of the range, in UTC
+    :param altitude: altitude of the horizon in radians
+
+    :return: tuple of status array (RISES_AND_SETS, CIRCUMPOLAR or NEVER_RISES per star) and Events
+    """
+    if model is globe:
+        return globe_events(ra, dec, lat, lon, start, end, altitude)
+    if model is flat:
+        return flat_events(ra, dec, lat, lon, start, end, altitude)
+    raise ValueError("Unknown model: "+str(model))
+
+
+def globe_events(ra, dec, lat, lon, start, end, altitude=0.0):
+    'Closed form hour angle solution. See events() for arguments.'
+    ra = np.ravel(np.asarray(ra, dtype=np.float64))
+    dec = np.ravel(np.asarray(dec, dtype=np.float64))
+    seconds = _seconds(start, end)
+
+    sin_lat, cos_lat = math.sin(lat), math.cos(lat)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos_h0 = (math.sin(altitude) - sin_lat*np.sin(dec)) / (cos_lat*np.cos(dec))
+
+    # at the poles (or for stars at the celestial poles) altitude does not change at all
+    constant = ~np.isfinite(cos_h0)
+    above = sin_lat*np.sin(dec) > math.sin(altitude)
+    status = np.where(constant, np.where(above, CIRCUMPOLAR, NEVER_RISES),
+            np.where(cos_h0 < -1, CIRCUMPOLAR, np.where(cos_h0 > 1, NEVER_RISES, RISES_AND_SETS)))
+
+    h0 = np.arccos(np.clip(np.where(constant, 1.0, cos_h0), -1.0, 1.0))
+    lha0 = gmst(start).rad() + lon - ra # local hour angle at the start
+
+    rows = np.arange(len(ra))
+    crossing = rows[status == RISES_AND_SETS]
+    found = [
+        _periodic(crossing, -h0[crossing] - lha0[crossing], seconds, RISE),
+        _periodic(crossing, h0[crossing] - lha0[crossing], seconds, SET),
+        _periodic(rows, -lha0, seconds, UPPER_TRANSIT),
+        _periodic(rows, math.pi - lha0, seconds, LOWER_TRANSIT),
+    ]
+
+    return status, _events(globe, ra, dec, lat, lon, start, found)
+
+
+def flat_events(ra, dec, lat, lon, start, end, altitude=0.0, step=DEFAULT_STEP, tolerance=DEFAULT_TOLERANCE):
+    """
+    Bracketed root finding on the flat model altitude. See events() for arguments.
+
+    :param step: seconds between samples. Two crossings of the same kind within one step are missed.
+    :param tolerance: accuracy of the event times in seconds
+    """
+    ra = np.ravel(np.asarray(ra, dtype=np.float64))
+    dec = np.ravel(np.asarray(dec, dtype=np.float64))
+    seconds = _seconds(start, end)
+    gmst0 = gmst(start).rad()
+
+    def height(rows, t):
+        return flat.positions(ra[rows], dec[rows], lat, lon, gmst0 + t*RADIANS_PER_SECOND)[1] - altitude
+
+    def slope(rows, t):
+        return (height(rows, t + DERIVATIVE_STEP) - height(rows, t - DERIVATIVE_STEP)) / (2.0*DERIVATIVE_STEP)
+
+    # classify from one sidereal day of samples
+    day = np.arange(0.0, SIDEREAL_DAY, step)
+    lowest = np.empty(len(ra))
+    highest = np.empty(len(ra))
+    for rows in _chunks(len(ra), len(day)):
+        h = height(rows[:, None], day[None, :])
+        lowest[rows] = h.min(axis=1)
+        highest[rows] = h.max(axis=1)
+    status = np.where(lowest > 0, CIRCUMPOLAR, np.where(highest <= 0, NEVER_RISES, RISES_AND_SETS))
+    culminates = highest - lowest > FLAT_ALTITUDE
+
+    samples = np.append(np.arange(0.0, seconds, step), seconds)
+    found = []
+    for rows in _chunks(len(ra), len(samples)):
+        t = samples[None, :]
+        h = height(rows[:, None], t)
+        d = slope(rows[:, None], t)
+        d[~culminates[rows]] = 0.0
+
+        for values, function, kinds in ((h, height, (RISE, SET)), (d, slope, (LOWER_TRANSIT, UPPER_TRANSIT))):
+            positive = values > 0
+            i, j = np.nonzero(positive[:, :-1] != positive[:, 1:])
+            star = rows[i]
+            time = _illinois(lambda t, index, star=star: function(star[index], t), samples[j], samples[j + 1], values[i, j], values[i, j + 1], tolerance)
+            kind = np.where(positive[i, j + 1], kinds[0], kinds[1]) # becoming positive: altitude rises, slope turns up at a lower transit
+            found.append((star, kind, time))
+
+    return status, _events(flat, ra, dec, lat, lon, start, found)
+
+
+def times(start, events):
+    'Event times as numpy datetime64 in UTC'
+    return datetime64(start) + np.round(events.time*1e6).astype('timedelta64[us]')
+
+
+def _seconds(start, end):
+    seconds = (end - start).total_seconds()
+    if seconds < 0:
+        raise ValueError("End of range is before start")
+    return seconds
+
+
+def _chunks(rows, columns, size=CHUNK_SIZE):
+    'Row index arrays that keep rows*columns below size'
+    count = max(1, size // max(1, columns))
+    return [np.arange(i, min(rows, i + count)) for i in range(0, rows, count)]
+
+
+def _periodic(rows, angle, seconds, kind):
+    'Times in [0, seconds] at which the hour angle has advanced by angle (mod 2 pi), for each row'
+    first = np.mod(angle, math.pi*2.0) / RADIANS_PER_SECOND
+    repeats = int(seconds // SIDEREAL_DAY) + 1
+    time = first[:, None] + SIDEREAL_DAY*np.arange(repeats + 1)[None, :]
+    i, j = np.nonzero(time <= seconds)
+    return rows[i], np.full(len(i), kind), time[i, j]
+
+
+def _illinois(function, a, b, fa, fb, tolerance, iterations=100):
+    """
+    Refines all brackets [a, b] with fa, fb of opposite sign at once. Only unconverged brackets are evaluated in each pass.
+
+    :param function: function(t, index) of the brackets selected by the index array, evaluated at times t
+
+    :return: array of roots
+    """
+    a, b, fa, fb = [np.array(v, dtype=np.float64) for v in (a, b, fa, fb)]
+    active = np.nonzero((np.abs(b - a) > tolerance) & (fb != 0))[0]
+
+    for iteration in range(iterations):
+        if len(active) == 0:
+            break
+
+        a_, b_, fa_, fb_ = a[active], b[active], fa[active], fb[active]
+        c = b_ - fb_*(b_ - a_)/(fb_ - fa_)
+        c = np.where(np.isfinite(c), c, (a_ + b_)/2.0)
+        fc = function(c, active)
+
+        # keep the root bracketed between the new point and the old point of opposite sign
+        opposite = (fc > 0) != (fb_ > 0)
+        a[active] = np.where(opposite, b_, a_)
+        fa[active] = np.where(opposite, fb_, fa_*0.5) # Illinois: halve the retained end point to avoid one sided convergence
+        b[active] = c
+        fb[active] = fc
+
+        active = active[(np.abs(b[active] - a[active]) > tolerance) & (fc != 0)]
+
+    return b
+
+
+def _events(model, ra, dec, lat, lon, start, found):
+    'Sorted Events with model azimuth and altitude at each event'
+    if found:
+        star = np.concatenate([f[0] for f in found]).astype(np.int64)
+        kind = np.concatenate([f[1] for f in found]).astype(np.int8)
+        time = np.concatenate([f[2] for f in found]).astype(np.float64)
+    else:
+        star, kind, time = np.zeros(0, np.int64), np.zeros(0, np.int8), np.zeros(0)
+
+    order = np.lexsort((star, time))
+    star, kind, time = star[order], kind[order], time[order]
+    azimuth, altitude = model.positions(ra[star], dec[star], lat, lon, gmst(start).rad() + time*RADIANS_PER_SECOND)
+
+    return Events(star, kind, time, azimuth, altitude)
+
+
+
+"""
+For testing only
+"""
+if __name__ == "__main__":
+
+    def test():
+        from datetime import datetime, timedelta
+        from util.gmst import utc
+
+        state = np.random.RandomState(5)
+        ra = state.uniform(0, math.pi*2.0, 300)
+        dec = np.arcsin(state.uniform(-1, 1, 300))
+        lat, lon = math.radians(-31.95), math.radians(115.86)
+        start = datetime(2016, 5, 5, tzinfo=utc)
+        end = start + timedelta(days=3)
+
+        globe_status, globe_found = globe_events(ra, dec, lat, lon, start, end)
+        flat_status, flat_found = flat_events(ra, dec, lat, lon, start, end)
+
+        assert set(globe_status) == set([RISES_AND_SETS, CIRCUMPOLAR, NEVER_RISES])
+        assert np.array_equal(globe_status, flat_status)
+
+        # events happen where they should
+        assert np.all(np.abs(globe_found.altitude[globe_found.kind <= SET]) < 1e-9)
+        assert np.all(np.abs(flat_found.altitude[flat_found.kind <= SET]) < 1e-7) # DEFAULT_TOLERANCE of time
+        upper = globe_found.kind == UPPER_TRANSIT
+        assert np.all(np.abs(np.sin(globe_found.azimuth[upper]*2.0)) < 1e-9)
+        assert np.all((0 <= globe_found.time) & (globe_found.time <= 3*86400))
+
+        # both models agree on every event
+        assert len(globe_found.time) == len(flat_found.time)
+        g = np.lexsort((globe_found.time, globe_found.kind, globe_found.star))
+        f = np.lexsort((flat_found.time, flat_found.kind, flat_found.star))
+        assert np.array_equal(globe_found.star[g], flat_found.star[f]) and np.array_equal(globe_found.kind[g], flat_found.kind[f])
+        assert np.max(np.abs(globe_found.time[g] - flat_found.time[f])) < DEFAULT_TOLERANCE
+
+        # every star rises and sets about once a day
+        rises = np.bincount(globe_found.star[globe_found.kind == RISE], minlength=300)
+        assert np.all(rises[globe_status == RISES_AND_SETS] >= 2) and np.all(rises[globe_status != RISES_AND_SETS] == 0)
+
+        assert str(times(start, globe_found)[0]).startswith("2016-05-05")
+
+    test()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Apparent angular separation of every pair of stars, as seen by one observer in each model.
+
+The globe separation is the angle between the directions given by globe azimuth/altitude. The flat separation is the angle
+between the guide rays of flat.Star. If a model keeps the separation of two stars the same for every observer, the difference
+stays at rounding level everywhere.
+
+The N x N matrices are produced in square blocks, so memory use only depends on the block size. Angles use
+atan2(|a x b|, a . b), which stays accurate for nearly coincident stars, with the dot products of a block in one matrix product.
+"""
+
+import math
+from collections import namedtuple
+
+import numpy as np
+
+import flat
+import globe
+
+DEFAULT_BLOCK = 256 # rows and columns per block. Keeps the arrays of one block within a typical L2 cache.
+
+
+Block = namedtuple('Block', 'rows columns globe flat difference')
+Block.__doc__ = """
+One block of the separation matrices. rows and columns are slices of the catalog.
+globe, flat and difference (flat - globe) are arrays in radians.
+"""
+
+Pairs = namedtuple('Pairs', 'first second globe flat difference')
+Pairs.__doc__ = """
+Star pairs, as arrays of catalog indices (first < second), with their separations in radians.
+"""
+
+
+def directions(model, ra, dec, lat, lon, gmst):
+    """
+    Unit vectors of the apparent direction of each star from one observer.
+
+    :param model: globe or flat module
+    :return: array of shape (stars, 3)
+    """
+    if model is globe:
+        azimuth, altitude = globe.positions(ra, dec, lat, lon, gmst)
+        cos_altitude = np.cos(altitude)
+        return np.stack((cos_altitude*np.sin(azimuth), cos_altitude*np.cos(azimuth), np.sin(altitude)), axis=-1)
+    if model is flat:
+        vectors = np.stack(flat.ray_directions(ra, dec, lat, lon, gmst), axis=-1)
+        return vectors / np.sqrt((vectors**2).sum(axis=-1))[..., None]
+    raise ValueError("Unknown model: "+str(model))
+
+
+def angles(a, b):
+    """
+    Angles between every row of a and every row of b.
+
+    :param a: array of unit vectors, shape (m, 3)
+    :param b: array of unit vectors, shape (n, 3)
+    :return: array of shape (m, n) in radians
+    """
+    dot = a.dot(b.T)
+    ax, ay, az = a[:, 0, None], a[:, 1, None], a[:, 2, None]
+    bx, by, bz = b[None, :, 0], b[None, :, 1], b[None, :, 2]
+    cross = np.sqrt((ay*bz - az*by)**2 + (az*bx - ax*bz)**2 + (ax*by - ay*bx)**2)
+    return np.arctan2(cross, dot)
+
+
+def blocks(ra, dec, lat, lon, gmst, block=DEFAULT_BLOCK, upper=False):
+    """
+    Generates the separation matrices in blocks.
+
+    :param ra: array of Right Ascensions in radians
+    :param dec: array of Declinations in radians
+    :param lat: latitude of the observer in radians
+    :param lon: longitude of the observer in radians
+    :param gmst: Greenwich Mean Sidereal Time in radians
+    :param block: rows and columns per block
+    :param upper: only generate blocks that contain pairs above the diagonal (separations are symmetric)
+
+    :return: generator of Block
+    """
+    globe_directions = directions(globe, ra, dec, lat, lon, gmst)
+    flat_directions = directions(flat, ra, dec, lat, lon, gmst)
+    count = len(globe_directions)
+
+    for row in range(0, count, block):
+        rows = slice(row, min(count, row + block))
+        for column in range(row if upper else 0, count, block):
+            columns = slice(column, min(count, column + block))
+            globe_angles = angles(globe_directions[rows], globe_directions[columns])
+            flat_angles = angles(flat_directions[rows], flat_directions[columns])
+            yield Block(rows, columns, globe_angles, flat_angles, flat_angles - globe_angles)
+
+
+def matrix(ra, dec, lat, lon, gmst, block=DEFAULT_BLOCK):
+    """
+    Full separation matrices. Needs memory for three N x N arrays, use blocks() or most_distorted() for large catalogs.
+
+    :return: tuple of globe, flat and difference (flat - globe) matrices in radians
+    """
+    count = len(np.ravel(ra))
+    result = [np.empty((count, count)) for i in range(3)]
+    for b in blocks(ra, dec, lat, lon, gmst, block):
+        for matrix, values in zip(result, (b.globe, b.flat, b.difference)):
+            matrix[b.rows, b.columns] = values
+    return tuple(result)
+
+
+def most_distorted(ra, dec, lat, lon, gmst, k=10, block=DEFAULT_BLOCK):
+    """
+    The k star pairs with the largest absolute difference between flat and globe separation, without building the matrices.
+    Only the best k candidates are kept between blocks.
+
+    :return: Pairs sorted by decreasing absolute difference
+    """
+    best = Pairs(*[np.zeros(0, dtype=t) for t in (np.int64, np.int64, np.float64, np.float64, np.float64)])
+
+    for b in blocks(ra, dec, lat, lon, gmst, block, upper=True):
+        # only pairs that beat the current k-th best can enter
+        distortion = np.abs(b.difference)
+        threshold = np.abs(best.difference).min() if len(best.difference) >= k else -1.0
+        i, j = np.nonzero(distortion > threshold)
+        first, second = i + b.rows.start, j + b.columns.start
+        keep = first < second
+        i, j = i[keep], j[keep]
+
+        candidates = Pairs(first[keep], second[keep], b.globe[i, j], b.flat[i, j], b.difference[i, j])
+        best = _top(Pairs(*[np.concatenate(a) for a in zip(best, candidates)]), k)
+
+    order = np.argsort(-np.abs(best.difference), kind='stable')
+    return Pairs(*[a[order] for a in best])
+
+
+def _top(pairs, k):
+    'The k pairs with the largest absolute difference, in no particular order'
+    if len(pairs.difference) <= k:
+        return pairs
+    keep = np.argpartition(-np.abs(pairs.difference), k - 1)[:k]
+    return Pairs(*[a[keep] for a in pairs])
+
+
+
+"""
+For testing only
+"""
+if __name__ == "__main__":
+
+    def test():
+        state = np.random.RandomState(13)
+        ra = state.uniform(0, math.pi*2.0, 700)
+        dec = np.arcsin(state.uniform(-1, 1, 700))
+        lat, lon, gmst = 0.4, -1.2, 2.5
+
+        globe_matrix, flat_matrix, difference = matrix(ra, dec, lat, lon, gmst, block=128)
+
+        # both models agree with the catalog separation
+        i, j = state.randint(0, 700, 500), state.randint(0, 700, 500)
+        catalog = 2.0*np.arcsin(np.sqrt(np.sin((dec[j] - dec[i])/2.0)**2 + np.cos(dec[i])*np.cos(dec[j])*np.sin((ra[j] - ra[i])/2.0)**2))
+        assert np.max(np.abs(globe_matrix[i, j] - catalog)) < 1e-12
+        assert np.max(np.abs(flat_matrix[i, j] - catalog)) < 1e-12
+        assert np.allclose(globe_matrix, globe_matrix.T, rtol=0, atol=1e-12) and np.all(np.diag(flat_matrix) == 0)
+
+        # top k without the full matrix matches the full matrix
+        pairs = most_distorted(ra, dec, lat, lon, gmst, k=25, block=96)
+        upper = np.abs(np.triu(difference, 1))
+        expected = np.sort(upper.ravel())[::-1][:25]
+        assert np.array_equal(np.abs(pairs.difference), expected)
+        assert np.all(pairs.first < pairs.second)
+        assert np.array_equal(difference[pairs.first, pairs.second], pairs.difference)
+
+    test()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+from collections import namedtuple
+from datetime import timedelta
+
+import flat
+import globe
+
+from util.angle import Angle
+from util.gmst import gmst, RADIANS_PER_SECOND
+from util.precession import columns_at
+
+RESYNC_STEPS = 1440 # recompute sidereal time from scratch after this many steps to stop rounding errors building up
+
+
+SweepRecord = namedtuple('SweepRecord', 'time star location globe_azimuth globe_altitude flat_azimuth flat_altitude')
+SweepRecord.__doc__ = """
+Position of one star from one location at one time. Star and location are names, angles are in radians.
+"""
+
+
+def sweep(stars, locations, start, end, step, resync=RESYNC_STEPS):
+    """
+    Generates the globe and flat azimuth/altitude of every star from every location, from start to end time (inclusive).
+
+    Records are produced one at a time, so memory use does not depend on the length of the sweep.
+
+    GMST advances linearly with time, so the sine and cosine of the local sidereal time are advanced with a rotation
+    recurrence instead of being recalculated at every step. Hour angle terms of each star follow from those by the
+    angle difference identities.
+
+    Star positions are precessed to the date, once per year of the sweep (see util.precession.columns_at).
+
+    :param stars: Catalog or dict of name: StarLocation
+    :param locations: dict of name: SphereLocation
+    :param start: datetime of first step
+    :param end: datetime of last step
+    :param step: timedelta between steps
+    :param resync: number of steps between exact recalculations of sidereal time
+
+    :return: generator of SweepRecord
+    """
+    # checked here rather than in the generator, so a bad step fails when the sweep is created
+    if step <= timedelta(0):
+        raise ValueError("Sweep step must be positive")
+
+    return _sweep(stars, locations, start, end, step, resync)
+
+
+def _sweep(stars, locations, start, end, step, resync):
+    positions = None
+
+    # per location terms
+    location_terms = []
+    for name, location in locations.items():
+        lat = location.lat.rad()
+        colat = math.pi/2.0 - lat
+        location_terms.append((name, location.lon.rad(), math.sin(lat), math.cos(lat), math.cos(colat), math.sin(colat)))
+
+    delta = step.total_seconds()*RADIANS_PER_SECOND
+    cos_delta = math.cos(delta)
+    sin_delta = math.sin(delta)
+
+    time = start
+    i = 0
+    while time <= end:
+        # the cached columns only change when the sweep reaches the next epoch
+        names, ra, dec = columns_at(stars, time)
+        if ra is not positions:
+            star_terms = _star_terms(names, ra, dec)
+            positions = ra
+
+        if i % resync == 0:
+            # exact sidereal time for each location
+            sidereal = gmst(time).rad()
+            lst = [sidereal + lon for name, lon, sin_lat, cos_lat, cos_colat, sin_colat in location_terms]
+            trig = [(math.cos(l), math.sin(l)) for l in lst]
+        else:
+            # rotation recurrence: advance every location by the same angle
+            lst = [l + delta for l in lst]
+            trig = [(c*cos_delta - s*sin_delta, s*cos_delta + c*sin_delta) for c, s in trig]
+
+        for (location, lon, sin_lat, cos_lat, cos_colat, sin_colat), l, (cos_lst, sin_lst) in zip(location_terms, lst, trig):
+            transform = flat.local_transform(cos_lst, sin_lst, cos_colat, sin_colat)
+
+            for star, cos_ra, sin_ra, sin_dec, cos_dec, tan_dec, base in star_terms:
+                # local hour angle = lst - ra
+                cos_lha = cos_lst*cos_ra + sin_lst*sin_ra
+                sin_lha = sin_lst*cos_ra - cos_lst*sin_ra
+
+                direction = transform.transform(base)
+
+                yield SweepRecord(time, star, location,
+                        globe.azimuth_from_terms(sin_lha, cos_lha, sin_lat, cos_lat, tan_dec),
+                        globe.altitude_from_terms(cos_lha, sin_lat, cos_lat, sin_dec, cos_dec),
+                        flat.azimuth_from_direction(direction, l),
+                        flat.altitude_from_direction(direction))
+
+        i += 1
+        time = start + step*i
+
+
+def _star_terms(names, ras, decs):
+    'Per star terms. Nothing here depends on time or location.'
+    star_terms = []
+    for name, ra, dec in zip(names, ras.tolist(), decs.tolist()):
+        base = flat.Star(Angle(ra), Angle(dec)).base_ray_direction()
+        star_terms.append((name, math.cos(ra), math.sin(ra), math.sin(dec), math.cos(dec), math.tan(dec), base))
+    return star_terms
+
+
+
+"""
+For testing only
+"""
+if __name__ == "__main__":
+
+    def test():
+        from util.angle import Degree
+        from util.location import StarLocation, SphereLocation
+        from util.gmst import utc
+        from datetime import datetime
+
+        stars = {"a": StarLocation(Degree(30), Degree(-60)), "b": StarLocation(Degree(250), Degree(10))}
+        locations = {"x": SphereLocation(Degree(-33), Degree(18)), "y": SphereLocation(Degree(51), Degree(-0.1))}
+        start = datetime(2016, 5, 5, 0, 0, 0, 0, utc)
+
+        # positions of the date
+        names, ra, dec = columns_at(stars, start)
+        precessed = dict((name, StarLocation(Angle(r), Angle(d))) for name, r, d in zip(names, ra, dec))
+
+        count = 0
+        for record in sweep(stars, locations, start, start + timedelta(days=2), timedelta(minutes=7), resync=100000):
+            star = precessed[record.star]
+            location = locations[record.location]
+            g = gmst(record.time)
+            flat_location = flat.Location(location.lat, location.lon)
+
+            assert abs(record.globe_azimuth - globe.Star(star.ra, star.dec).azimuth(location, g).rad()) < 1e-9
+            assert abs(record.globe_altitude - globe.Star(star.ra, star.dec).altitude(location, g).rad()) < 1e-9
+            assert abs(record.flat_azimuth - flat.Star(star.ra, star.dec).azimuth(flat_location, g).rad()) < 1e-9
+            assert abs(record.flat_altitude - flat.Star(star.ra, star.dec).altitude(flat_location, g).rad()) < 1e-9
+            count += 1
+
+        assert count == 4*(2*24*60//7 + 1)
+
+        # a sweep across years moves on to the next epoch
+        records = list(sweep(stars, locations, datetime(2016, 5, 5, 0, 0, 0, 0, utc), datetime(2019, 5, 5, 0, 0, 0, 0, utc), timedelta(days=365)))
+        last = [r for r in records if r.star == "a" and r.location == "x"][-1]
+        ra, dec = [v[0] for v in columns_at(stars, last.time)[1:]]
+        assert abs(last.globe_altitude - globe.Star(Angle(ra), Angle(dec)).altitude(locations["x"], gmst(last.time)).rad()) < 1e-9
+        assert abs(last.globe_altitude - globe.Star(stars["a"].ra, stars["a"].dec).altitude(locations["x"], gmst(last.time)).rad()) > 1e-5
+
+        # invalid steps fail before the first record
+        try:
+            sweep(stars, locations, start, start + timedelta(hours=1), timedelta(0))
+            assert False
+        except ValueError:
+            pass
+
+    test()
@@ -3,12 +3,17 @@
 
 import math
 
-class Angle:
+class Angle(object):
     """
     Stores an angle in radians. 
     Handles output in a variety of formats: radians, degrees, latitude, longitude, hour angle
+
+    Uses __slots__ so each instance is a single float slot without a __dict__. 
+    Subclasses must also define __slots__ to keep this.
     """
 
+    __slots__ = ('__rad',)
+
     def __init__(self, rad):
         self.__rad = float(rad)
 
@@ -52,24 +57,28 @@ class Angle:
         return direction+str(int(hours))+"h "+str(int(minutes))+"m "+str(seconds)+"s"
 
     def add(self, angle):
-        return Angle(self.rad() + angle.rad())
+        return Angle(self.__rad + angle.rad())
 
     def sub(self, angle):
-        return Angle(self.rad() - angle.rad())
+        return Angle(self.__rad - angle.rad())
 
     def __float__(self):
-        return self.rad()
+        return self.__rad
 
     def __str__(self):
-        return str(self.rad())
+        return str(self.__rad)
 
 class Degree(Angle):
     """ Allows input in degrees """
+    __slots__ = ()
+
     def __init__(self, deg):
         Angle.__init__(self, math.radians(float(deg)))
 
 class Latlon(Angle):
     """ Allows input as lat/lon """
+    __slots__ = ()
+
     def __init__(self, d, m, s, direction="N"):
         direction = -1 if direction == "S" or direction == "W" else 1
         direction *= -1 if d < 0 else 1
@@ -78,6 +87,8 @@ class Latlon(Angle):
 
 class HourAngle(Angle):
     """ Allows input as hour angle """
+    __slots__ = ()
+
     def __init__(self, h, m, s, direction=1):
         direction *= -1 if h < 0 else 1
 
@@ -6,13 +6,18 @@ from .angle import Angle
 import math
 from datetime import datetime, tzinfo, timedelta
 
+import numpy as np
+
+SIDEREAL_HOURS_PER_DAY = 24.06570982441908 # rate at which GMST advances
+RADIANS_PER_SECOND = SIDEREAL_HOURS_PER_DAY/12.0*math.pi/(3600.0*24) # GMST advance per second of UTC time
+
 def gmst(dt):
     # timedelta since 2000/1/1 12:00:00 UTC
     delta = dt - start_date
     days = delta.days + delta.seconds/(3600.0*24) + delta.microseconds/(3600.0*24*1000000)
 
     # approximation for GMST based on elapsed days
-    gmst = 18.697374558 + 24.06570982441908*days
+    gmst = 18.697374558 + SIDEREAL_HOURS_PER_DAY*days
 
     # normalize to range of 0 to 24 hours
     gmst -= int(gmst/24.0) * 24.0
@@ -20,6 +25,57 @@ def gmst(dt):
     return Angle(gmst/12.0*math.pi)
 
 
+def gmst_array(times, precise=False):
+    """
+    Vectorized gmst() for many times at once.
+
+    In the default mode the result matches gmst() exactly. Far from J2000 a float64 day count loses precision
+    (about 10 microseconds of time per century), so the precise mode splits the day count into whole days and
+    a fraction of a day. The whole days only contribute the small daily drift of sidereal time, which float64 handles exactly.
+
+    :param times: array of numpy datetime64 in UTC, or array of seconds since 1970-01-01 00:00:00 UTC
+    :param precise: split whole days from the fraction of a day
+
+    :return: array of GMST in radians, normalized the same way as gmst()
+    """
+    times = np.asarray(times)
+
+    if np.issubdtype(times.dtype, np.datetime64):
+        # whole days and remaining microseconds since J2000, both exact integers
+        microseconds = (times.astype('datetime64[us]') - J2000).astype(np.int64)
+        whole_days = np.floor_divide(microseconds, MICROSECONDS_PER_DAY)
+        remainder = microseconds - whole_days*MICROSECONDS_PER_DAY
+
+        # same arithmetic as gmst() on a timedelta
+        days = whole_days + np.floor_divide(remainder, 1000000)/(3600.0*24) + np.remainder(remainder, 1000000)/(3600.0*24*1000000)
+        fraction = remainder/float(MICROSECONDS_PER_DAY)
+    else:
+        seconds = times.astype(np.float64) - J2000_UNIX_SECONDS
+        days = seconds/(3600.0*24)
+        whole_days = np.floor(days)
+        fraction = (seconds - whole_days*3600.0*24)/(3600.0*24)
+
+    # approximation for GMST based on elapsed days
+    gmst = 18.697374558 + SIDEREAL_HOURS_PER_DAY*days
+
+    if precise:
+        # 24 hours per whole day have no effect after normalization, only the drift does
+        sign = np.sign(gmst)
+        gmst = np.mod(18.697374558 + np.fmod((SIDEREAL_HOURS_PER_DAY - 24.0)*whole_days, 24.0) + SIDEREAL_HOURS_PER_DAY*fraction, 24.0)
+        gmst = np.where((sign < 0) & (gmst > 0), gmst - 24.0, gmst)
+    else:
+        # normalize to range of 0 to 24 hours
+        gmst -= np.trunc(gmst/24.0) * 24.0
+
+    return gmst/12.0*math.pi
+
+def datetime64(dt):
+    'Converts a datetime to a numpy datetime64 in UTC. Naive datetimes are assumed to be in UTC.'
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(utc).replace(tzinfo=None)
+    return np.datetime64(dt, 'us')
+
+
 ZERO = timedelta(0)
 class UTC(tzinfo):
     def utcoffset(self, dt):
@@ -32,6 +88,10 @@ class UTC(tzinfo):
 utc = UTC()
 start_date = datetime(2000, 1, 1, 12, 0, 0, 0, utc)
 
+J2000 = np.datetime64('2000-01-01T12:00:00', 'us')
+J2000_UNIX_SECONDS = 946728000.0
+MICROSECONDS_PER_DAY = 24*3600*1000000
+
 
 
 if __name__ == "__main__":
@@ -39,4 +99,19 @@ if __name__ == "__main__":
     def test():
         print(gmst(datetime.now(utc)).hour())
 
+        # batch version matches the scalar version
+        times = [datetime(1900, 3, 1, 0, 0, 0, 0, utc), datetime(1999, 12, 31, 23, 59, 59, 999999, utc), start_date,
+                datetime(2016, 5, 5, 12, 30, 0, 0, utc), datetime(2150, 7, 1, 5, 6, 7, 8, utc)]
+        expected = np.array([gmst(dt).rad() for dt in times])
+        result = gmst_array(np.array([datetime64(dt) for dt in times]))
+        assert np.array_equal(result, expected)
+
+        epoch = datetime(1970, 1, 1, 0, 0, 0, 0, utc)
+        seconds = np.array([(dt - epoch).total_seconds() for dt in times])
+        assert np.abs(gmst_array(seconds) - expected).max() < 1e-9
+
+        precise = gmst_array(np.array([datetime64(dt) for dt in times]), precise=True)
+        assert np.abs(precise - expected).max() < 1e-9
+        assert np.abs(gmst_array(seconds, precise=True) - expected).max() < 1e-9
+
     test()
@@ -1,14 +1,28 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+J2000 = 2000.0 # Julian year of the standard epoch and equinox
+
 class SphereLocation:
     def __init__(self, lat, lon):
         self.lat = lat
         self.lon = lon
 
 class StarLocation(SphereLocation):
-    def __init__(self, ra, dec):
+    """
+    Mean position of a star in the J2000 equatorial frame, with optional proper motion.
+
+    pm_ra and pm_dec are in radians per Julian year, pm_ra measured along the sky (the change in RA times cos(dec)).
+    epoch is the Julian year at which the star is at ra/dec. See util.precession for positions at other dates.
+    """
+    pm_ra = 0.0
+    pm_dec = 0.0
+    epoch = J2000
+
+    def __init__(self, ra, dec, pm_ra=0.0, pm_dec=0.0, epoch=J2000):
         self.ra = ra
         self.dec = dec
+        self.pm_ra = pm_ra
+        self.pm_dec = pm_dec
+        self.epoch = epoch
         SphereLocation.__init__(self, ra, dec)
-
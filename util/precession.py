@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Positions of catalog stars at other dates.
+
+Catalog positions are J2000 mean positions at the epoch of each star. precess() moves each star along its proper motion
+from its epoch to the target date and then precesses it from the J2000 equator and equinox to the mean equator and equinox
+of the date (IAU 1976 precession, as in Meeus, Astronomical Algorithms, chapter 21). Precession alone moves stars by
+about 50 arc seconds a year, so J2000 positions are degrees off centuries away. Nutation and aberration (under
+20 arc seconds), parallax and radial velocity are ignored.
+
+columns_at() keeps transformed catalogs in an LRU cache keyed by catalog and quantised epoch, so a sweep over a year
+transforms the catalog once instead of at every time step.
+"""
+
+from .cache import LRUCache
+from .catalog import Catalog, columns, motion
+from .gmst import start_date
+from .location import J2000
+
+import math
+from datetime import datetime
+
+import numpy as np
+
+DAYS_PER_JULIAN_YEAR = 365.25
+RADIANS_PER_ARCSECOND = math.pi/(180.0*3600.0)
+DEFAULT_RESOLUTION = 1.0 # Julian years. Half a year of precession is at most 25 arc seconds.
+CACHE_SIZE = 16 # transformed catalogs
+
+cache = LRUCache(CACHE_SIZE)
+
+
+def julian_year(date):
+    'Julian year of a datetime (J2000.0 is 2000.0). Numbers are returned as they are.'
+    if isinstance(date, datetime):
+        delta = date - start_date
+        return J2000 + (delta.days + delta.seconds/(3600.0*24) + delta.microseconds/(3600.0*24*1000000))/DAYS_PER_JULIAN_YEAR
+    return float(date)
+
+
+def precession_angles(year):
+    'zeta, z and theta of the precession from J2000 to the mean equinox of the given Julian year, in radians'
+    t = (year - J2000)/100.0
+    zeta = (2306.2181 + (0.30188 + 0.017998*t)*t)*t*RADIANS_PER_ARCSECOND
+    z = (2306.2181 + (1.09468 + 0.018203*t)*t)*t*RADIANS_PER_ARCSECOND
+    theta = (2004.3109 - (0.42665 + 0.041833*t)*t)*t*RADIANS_PER_ARCSECOND
+    return zeta, z, theta
+
+
+def precess(ra, dec, year, pm_ra=0.0, pm_dec=0.0, epoch=J2000):
+    """
+    Vectorized mean position of stars at the given Julian year. Arrays are broadcast against each other.
+
+    Proper motion is applied along the sky, to the direction vector rather than to RA/Dec, so it stays well behaved near the poles.
+
+    :param ra: J2000 Right Ascension in radians
+    :param dec: J2000 Declination in radians
+    :param year: target Julian year
+    :param pm_ra: proper motion in RA times cos(dec), in radians per Julian year
+    :param pm_dec: proper motion in declination, in radians per Julian year
+    :param epoch: Julian year of the given positions
+
+    :return: tuple of Right Ascension (0 to 2 pi) and Declination arrays in radians
+    """
+    ra, dec, pm_ra, pm_dec, epoch = np.broadcast_arrays(*[np.asarray(a, dtype=np.float64) for a in (ra, dec, pm_ra, pm_dec, epoch)])
+
+    sin_ra, cos_ra = np.sin(ra), np.cos(ra)
+    sin_dec, cos_dec = np.sin(dec), np.cos(dec)
+
+    # direction plus motion along the east and north unit vectors of the sky
+    years = year - epoch
+    east = pm_ra*years
+    north = pm_dec*years
+    x = cos_dec*cos_ra - east*sin_ra - north*sin_dec*cos_ra
+    y = cos_dec*sin_ra + east*cos_ra - north*sin_dec*sin_ra
+    z = sin_dec + north*cos_dec
+
+    # rotations by zeta around Z, theta around Y and z around Z
+    zeta, z_angle, theta = precession_angles(year)
+    x, y = x*math.cos(zeta) - y*math.sin(zeta), x*math.sin(zeta) + y*math.cos(zeta)
+    x, z = x*math.cos(theta) - z*math.sin(theta), x*math.sin(theta) + z*math.cos(theta)
+    x, y = x*math.cos(z_angle) - y*math.sin(z_angle), x*math.sin(z_angle) + y*math.cos(z_angle)
+
+    return np.mod(np.arctan2(y, x), math.pi*2.0), np.arctan2(z, np.hypot(x, y))
+
+
+def columns_at(stars, date, resolution=DEFAULT_RESOLUTION):
+    """
+    util.catalog.columns() with the positions of the stars at the given date.
+
+    The date is rounded to a multiple of resolution and the result is cached, so every date of a sweep within the
+    same interval shares one transformed catalog. Compiled catalogs are identified by file, anything else by identity:
+    a dict that is changed after a call keeps its old cached result, use a new dict instead.
+    The returned arrays are shared and read only.
+
+    :param stars: Catalog or dict of name: StarLocation
+    :param date: datetime (UTC) or Julian year
+    :param resolution: in Julian years. None transforms to the exact date without caching.
+
+    :return: tuple of (list of names, Right Ascension array, Declination array), in radians
+    """
+    year = julian_year(date)
+    if resolution:
+        year = round(year/resolution)*resolution
+        key = (_catalog_key(stars), year)
+        cached = cache.get(key)
+        if cached is not None:
+            names, ra, dec, stars = cached
+            return list(names), ra, dec
+
+    names, ra, dec = columns(stars)
+    ra, dec = precess(ra, dec, year, *motion(stars))
+    ra.setflags(write=False)
+    dec.setflags(write=False)
+
+    if resolution:
+        # the catalog is kept with the result, so its id is not reused while it is cached
+        cache[key] = (names, ra, dec, stars)
+
+    return list(names), ra, dec
+
+
+def _catalog_key(stars):
+    if isinstance(stars, Catalog):
+        return (stars.filename, stars.mtime)
+    return id(stars)
+
+
+
+"""
+For testing only
+"""
+if __name__ == "__main__":
+
+    def test():
+        from .gmst import utc
+        from .angle import Degree, HourAngle, Latlon
+        from .location import StarLocation
+
+        # annual precession of a few stars against the usual rates, m + n sin(ra) tan(dec) and n cos(ra), at J2000
+        state = np.random.RandomState(3)
+        ras = state.uniform(0, math.pi*2.0, 50)
+        decs = np.arcsin(state.uniform(-0.8, 0.8, 50))
+        m, n = 46.1244*RADIANS_PER_ARCSECOND, 20.0431*RADIANS_PER_ARCSECOND
+        ra, dec = precess(ras, decs, J2000 + 1)
+        assert np.max(np.abs(np.mod(ra - ras + math.pi, math.pi*2.0) - math.pi - (m + n*np.sin(ras)*np.tan(decs)))*np.cos(decs)) < 0.01*RADIANS_PER_ARCSECOND
+        assert np.max(np.abs(dec - decs - n*np.cos(ras))) < 0.01*RADIANS_PER_ARCSECOND
+
+        # no change at J2000, and an array of stars matches one star at a time
+        assert np.allclose(precess(ras, decs, J2000), (ras, decs), rtol=0, atol=1e-15)
+        together = precess(ras, decs, 1650.5, 1e-6, -2e-6, 1991.25)
+        for i in (0, 17, 49):
+            single = precess(ras[i], decs[i], 1650.5, 1e-6, -2e-6, 1991.25)
+            assert abs(single[0] - together[0][i]) < 1e-15 and abs(single[1] - together[1][i]) < 1e-15
+
+        # proper motion alone moves a star by motion*years along the sky, even at the pole
+        moved = precess(0.0, math.pi/2.0, 2100.0, 0.0, 1e-5, 1900.0)
+        expected = precess(math.pi, math.pi/2.0 - 2e-3, 2100.0)
+        assert abs(moved[0] - expected[0]) < 1e-8 and abs(moved[1] - expected[1]) < 1e-8
+
+        # cached per catalog and quantised epoch
+        stars = {"a": StarLocation(HourAngle(1, 2, 3), Latlon(-4, 5, 6)), "b": StarLocation(Degree(250), Degree(10), 1e-6, 0.0, 1991.25)}
+        first = columns_at(stars, datetime(2016, 3, 1, 0, 0, 0, 0, utc))
+        second = columns_at(stars, datetime(2016, 4, 1, 0, 0, 0, 0, utc))
+        assert first[0] == ["a", "b"] and second[1] is first[1]
+        assert np.array_equal(first[1], precess([s.ra.rad() for s in stars.values()], [s.dec.rad() for s in stars.values()], 2016.0, [0, 1e-6], 0, [J2000, 1991.25])[0])
+        assert columns_at(stars, 2017.4)[1] is not first[1]
+        assert columns_at(stars, 1900.0)[2][0] == columns_at(stars, 1900.0, None)[2][0]
+        try:
+            first[1][0] = 0
+            assert False
+        except ValueError:
+            pass
+
+    test()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Stage timings and call counts.
+
+Library code marks stages with:
+
+    with stage("globe az/alt"):
+        ...
+
+stage() returns a shared do-nothing context manager while profiling is off, so marked code only pays for one function call.
+enable() turns on timing for all stages, and optionally a cProfile run for function level call counts.
+"""
+
+import time
+import cProfile
+import pstats
+
+
+class Stage:
+    'Context manager that adds its elapsed time to a profiler'
+
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class NullStage:
+    'Context manager that does nothing'
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+class Profiler:
+    """
+    Total time and number of calls per stage, plus an optional cProfile profile.
+    """
+
+    def __init__(self, cprofile=False):
+        self.timings = {} # name: [seconds, calls]
+        self.order = []
+        self.cprofile = cProfile.Profile() if cprofile else None
+
+    def stage(self, name):
+        return Stage(self, name)
+
+    def add(self, name, seconds, calls=1):
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = [0.0, 0]
+            self.order.append(name)
+        timing[0] += seconds
+        timing[1] += calls
+
+    def reset(self):
+        'Clears stage timings. The cProfile profile keeps accumulating.'
+        self.timings = {}
+        self.order = []
+
+    def report(self):
+        'Table of stages in the order they first ran'
+        total = sum(seconds for seconds, calls in self.timings.values())
+        lines = ["stage\tcalls\tseconds\tpercent"]
+        for name in self.order:
+            seconds, calls = self.timings[name]
+            lines.append(name+"\t"+str(calls)+"\t"+("%.6f" % seconds)+"\t"+("%.1f" % (100.0*seconds/total if total else 0.0)))
+        lines.append("total\t\t"+("%.6f" % total))
+        return "\n".join(lines)
+
+    def dump(self, filename):
+        'Saves the cProfile profile in pstats format'
+        if self.cprofile is None:
+            raise ValueError("cProfile was not enabled")
+        try:
+            stats = pstats.Stats(self.cprofile)
+        except TypeError:
+            # pstats refuses a profile that has not recorded anything
+            raise ValueError("Nothing has been profiled yet")
+        stats.dump_stats(filename)
+
+
+active = None
+
+
+def enable(cprofile=False):
+    'Starts recording stages. Returns the active Profiler.'
+    global active
+    active = Profiler(cprofile)
+    return active
+
+
+def disable():
+    'Stops recording stages. Returns the Profiler that was active, if any.'
+    global active
+    profiler, active = active, None
+    return profiler
+
+
+def stage(name):
+    'Context manager that times a stage while profiling is enabled'
+    if active is None:
+        return NULL_STAGE
+    return Stage(active, name)
+
+
+
+"""
+For testing only
+"""
+if __name__ == "__main__":
+
+    def test():
+        import os
+        import shutil
+        import tempfile
+
+        with stage("off"):
+            pass
+        assert active is None
+
+        directory = tempfile.mkdtemp()
+        try:
+            profiler = enable(cprofile=True)
+            try:
+                profiler.dump(os.path.join(directory, "empty.pstats"))
+                assert False
+            except ValueError:
+                pass
+
+            profiler = enable(cprofile=True)
+            profiler.cprofile.enable()
+            for i in range(3):
+                with stage("a"):
+                    sum(range(1000))
+            with stage("b"):
+                pass
+            profiler.cprofile.disable()
+            assert profiler.timings["a"][1] == 3 and profiler.order == ["a", "b"]
+            assert "total" in profiler.report()
+
+            filename = os.path.join(directory, "profile.pstats")
+            profiler.dump(filename)
+            assert pstats.Stats(filename).total_calls > 0
+        finally:
+            shutil.rmtree(directory)
+
+        assert disable() is profiler and active is None
+
+    test()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import csv
+import sys
+import json
+import math
+
+FORMATS = ('ndjson', 'json', 'csv')
+BUFFER_SIZE = 1 << 20
+
+
+class RecordWriter:
+    """
+    Writes records (dicts with the same fields) to a stream as they are produced. Subclasses implement the format.
+    """
+
+    def __init__(self, stream, fields):
+        self.stream = stream
+        self.fields = list(fields)
+        self.count = 0
+
+    def write(self, record):
+        self._write(record)
+        self.count += 1
+
+    def close(self):
+        self.stream.flush()
+
+
+class NdjsonWriter(RecordWriter):
+    'One JSON object per line. NaN and infinite values are written as null, since JSON has no such numbers.'
+
+    _encode = json.JSONEncoder(separators=(',', ':'), allow_nan=False).encode
+
+    def encode(self, record):
+        return self._encode(dict((field, None if isinstance(value, float) and not math.isfinite(value) else value) for field, value in record.items()))
+
+    def _write(self, record):
+        self.stream.write(self.encode(record))
+        self.stream.write("\n")
+
+
+class JsonWriter(NdjsonWriter):
+    'A single JSON array, written incrementally'
+
+    def _write(self, record):
+        self.stream.write(",\n" if self.count else "[\n")
+        self.stream.write(self.encode(record))
+
+    def close(self):
+        self.stream.write("\n]\n" if self.count else "[]\n")
+        RecordWriter.close(self)
+
+
+class CsvWriter(RecordWriter):
+    'Header row followed by one row per record'
+
+    def __init__(self, stream, fields):
+        RecordWriter.__init__(self, stream, fields)
+        self.writer = csv.writer(stream, lineterminator="\n")
+        self.writer.writerow(self.fields)
+
+    def _write(self, record):
+        self.writer.writerow([record[field] for field in self.fields])
+
+
+WRITERS = {'ndjson': NdjsonWriter, 'json': JsonWriter, 'csv': CsvWriter}
+
+
+def record_writer(format, stream, fields):
+    """
+    :param format: one of FORMATS
+    :param stream: text stream
+    :param fields: field names in output order
+    """
+    return WRITERS[format](stream, fields)
+
+
+def open_output(filename=None):
+    'Buffered text stream for the given filename, or for stdout if no filename (or -) is given.'
+    if filename is None or filename == '-':
+        return io.TextIOWrapper(io.BufferedWriter(io.FileIO(sys.stdout.fileno(), 'w', closefd=False), BUFFER_SIZE), encoding='utf-8', newline='')
+    return io.open(filename, 'w', buffering=BUFFER_SIZE, encoding='utf-8', newline='')
+
+
+
+"""
+For testing only
+"""
+if __name__ == "__main__":
+
+    def test():
+        records = [{"a": 1, "b": "x"}, {"a": 2.5, "b": "y,z"}]
+
+        for format, expected in (
+                ('ndjson', '{"a":1,"b":"x"}\n{"a":2.5,"b":"y,z"}\n'),
+                ('json', '[\n{"a":1,"b":"x"},\n{"a":2.5,"b":"y,z"}\n]\n'),
+                ('csv', 'a,b\n1,x\n2.5,"y,z"\n')):
+            stream = io.StringIO()
+            writer = record_writer(format, stream, ["a", "b"])
+            for record in records:
+                writer.write(record)
+            writer.close()
+            assert stream.getvalue() == expected
+
+        # missing values are null
+        stream = io.StringIO()
+        writer = record_writer('json', stream, ["a"])
+        writer.write({"a": float('nan')})
+        writer.close()
+        assert json.loads(stream.getvalue()) == [{"a": None}]
+
+        stream = io.StringIO()
+        record_writer('json', stream, ["a"]).close()
+        assert json.loads(stream.getvalue()) == []
+
+    test()
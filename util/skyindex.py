@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+
+import numpy as np
+
+
+class SkyIndex:
+    """
+    Spatial index over the RA/Dec of a catalog for cone and horizon queries.
+
+    Stars are split into declination zones, and each zone is sorted by right ascension. A cone query only visits the zones
+    the cone overlaps and only the right ascension range it spans in each zone, so the work done scales with the size of the
+    result rather than the size of the catalog.
+
+    Queries that depend on an observer take a model module (globe or flat). The model provides zenith(), sky_direction() and
+    positions(), so the same index serves globe positions and flat guide ray directions.
+
+    All angles are in radians. Queries return sorted row numbers into the ra/dec arrays the index was built from.
+    """
+
+    def __init__(self, ra, dec, zone_height=None):
+        """
+        :param ra: array of Right Ascension
+        :param dec: array of Declination
+        :param zone_height: height of declination zones. Defaults to a height that gives roughly sqrt(N) zones.
+        """
+        self.ra = np.mod(np.asarray(ra, dtype=np.float64), math.pi*2.0)
+        self.dec = np.asarray(dec, dtype=np.float64)
+
+        # unit vectors in the same frame as flat.Star.base_ray_direction
+        cos_dec = np.cos(self.dec)
+        self.vectors = np.stack((-cos_dec*np.sin(self.ra), cos_dec*np.cos(self.ra), np.sin(self.dec)), axis=-1)
+
+        if zone_height is None:
+            zone_height = math.pi / max(1, int(math.sqrt(len(self.ra))))
+        self.zone_height = zone_height
+        self.zone_count = int(math.ceil(math.pi / zone_height))
+
+        zones = self._zone(self.dec)
+        self.order = np.lexsort((self.ra, zones)) # row numbers sorted by zone, then by ra
+        self.sorted_ra = self.ra[self.order]
+        self.zone_start = np.searchsorted(zones[self.order], np.arange(self.zone_count + 1))
+
+    def _zone(self, dec):
+        return np.clip(((np.asarray(dec) + math.pi/2.0) / self.zone_height).astype(int), 0, self.zone_count - 1)
+
+    def __len__(self):
+        return len(self.ra)
+
+    def cone(self, center, radius):
+        """
+        Stars within the given angular distance of a direction.
+
+        :param center: (x, y, z) unit vector in the star coordinate frame
+        :param radius: angular radius
+
+        :return: array of row numbers
+        """
+        center = np.asarray(center, dtype=np.float64).reshape(3)
+        center_dec = math.asin(max(-1.0, min(1.0, center[2])))
+        center_ra = math.atan2(-center[0], center[1]) % (math.pi*2.0)
+
+        if radius >= math.pi:
+            candidates = [np.arange(len(self.ra))]
+        else:
+            # widest ra span of the cone. Covers everything if the cone contains a pole.
+            if abs(center_dec) + radius < math.pi/2.0:
+                half_width = math.asin(min(1.0, math.sin(radius) / math.cos(center_dec)))
+            else:
+                half_width = math.pi
+
+            candidates = []
+            for zone in range(self._zone(center_dec - radius), self._zone(center_dec + radius) + 1):
+                start = self.zone_start[zone]
+                end = self.zone_start[zone+1]
+
+                if half_width >= math.pi:
+                    candidates.append(self.order[start:end])
+                    continue
+
+                # ra range, split in two where it wraps around 0
+                low = center_ra - half_width
+                high = center_ra + half_width
+                if low < 0:
+                    ranges = ((low + math.pi*2.0, math.pi*2.0), (0.0, high))
+                elif high >= math.pi*2.0:
+                    ranges = ((low, math.pi*2.0), (0.0, high - math.pi*2.0))
+                else:
+                    ranges = ((low, high),)
+
+                ra = self.sorted_ra[start:end]
+                for low, high in ranges:
+                    candidates.append(self.order[start + np.searchsorted(ra, low, 'left'):start + np.searchsorted(ra, high, 'right')])
+
+        candidates = np.concatenate(candidates) if candidates else np.zeros(0, dtype=int)
+
+        # exact test on the candidates
+        inside = self.vectors[candidates].dot(center) >= math.cos(radius)
+        return np.sort(candidates[inside])
+
+    def above(self, model, lat, lon, gmst, altitude=0.0):
+        """
+        Stars above the given altitude for one observer.
+
+        :param model: globe or flat module
+        :param lat: latitude of location
+        :param lon: longitude of location
+        :param gmst: Greenwich Mean Sidereal Time
+        :param altitude: minimum altitude
+
+        :return: array of row numbers
+        """
+        return self.cone(model.zenith(lat, lon, gmst), math.pi/2.0 - altitude)
+
+    def around(self, model, lat, lon, gmst, azimuth, altitude, radius):
+        """
+        Stars within an angular radius of the given azimuth/altitude for one observer.
+
+        :return: array of row numbers
+        """
+        return self.cone(model.sky_direction(azimuth, altitude, lat, lon, gmst), radius)
+
+    def window(self, model, lat, lon, gmst, min_azimuth, max_azimuth, min_altitude, max_altitude):
+        """
+        Stars inside an azimuth/altitude box for one observer. If min_azimuth is greater than max_azimuth the box wraps through north.
+
+        :return: array of row numbers
+        """
+        rows = self.above(model, lat, lon, gmst, min_altitude)
+        azimuth, altitude = model.positions(self.ra[rows], self.dec[rows], lat, lon, gmst)
+
+        if min_azimuth <= max_azimuth:
+            inside = (azimuth >= min_azimuth) & (azimuth <= max_azimuth)
+        else:
+            inside = (azimuth >= min_azimuth) | (azimuth <= max_azimuth)
+
+        return rows[inside & (altitude <= max_altitude)]
+
+
+
+"""
+For testing only
+"""
+if __name__ == "__main__":
+
+    def test():
+        import globe
+        import flat
+
+        random = np.random.RandomState(1)
+        ra = random.uniform(0, math.pi*2.0, 20000)
+        dec = np.arcsin(random.uniform(-1, 1, 20000))
+        index = SkyIndex(ra, dec)
+
+        for model in (globe, flat):
+            for lat, lon, gmst in ((0.3, 1.0, 2.0), (-1.5, -2.0, 5.0), (math.pi/2.0, 0.0, 0.0)):
+                azimuth, altitude = model.positions(ra, dec, lat, lon, gmst)
+
+                expected = np.nonzero(altitude > 0.2)[0]
+                assert np.array_equal(index.above(model, lat, lon, gmst, 0.2), expected)
+
+                expected = np.nonzero((altitude >= 0.1) & (altitude <= 0.5) & ((azimuth >= 5.5) | (azimuth <= 0.5)))[0]
+                assert np.array_equal(index.window(model, lat, lon, gmst, 5.5, 0.5, 0.1, 0.5), expected)
+
+                assert len(index.around(model, lat, lon, gmst, 1.0, 0.7, 0.05)) < 100
+
+    test()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Chunked on-disk store for large comparison results.
+
+A store is a directory:
+
+    meta.json       star and location names (ids are indexes into these lists) and the chunk size
+    index.npy       one row per chunk: row count and min/max of star id, location id and time
+    000000.chunk    columns of a chunk, one after the other, each with the fixed dtype of FIELDS
+
+Rows are only ever appended. Every chunk and the index are written to a temporary file first and then renamed,
+so readers never see a half written chunk. Chunks are memory-mapped when read, and queries skip every chunk whose
+index ranges cannot match, so slicing a large store only touches the chunks it needs.
+"""
+
+import os
+import json
+
+import numpy as np
+
+FIELDS = (
+    ('star', '<u4'),
+    ('location', '<u4'),
+    ('time', '<M8[us]'), # UTC, NaT if only GMST is known
+    ('gmst', '<f8'),
+    ('globe_azimuth', '<f8'),
+    ('globe_altitude', '<f8'),
+    ('flat_azimuth', '<f8'),
+    ('flat_altitude', '<f8'),
+    ('intercept_x', '<f8'),
+    ('intercept_y', '<f8'),
+    ('intercept_z', '<f8'),
+    ('distance', '<f8'),
+)
+FIELD_NAMES = tuple(name for name, dtype in FIELDS)
+RECORD = np.dtype(list(FIELDS))
+
+INDEX = np.dtype([
+    ('rows', '<i8'),
+    ('star_min', '<u4'), ('star_max', '<u4'),
+    ('location_min', '<u4'), ('location_max', '<u4'),
+    ('time_min', '<M8[us]'), ('time_max', '<M8[us]'),
+])
+
+CHUNK_ROWS = 1 << 18
+VERSION = 1
+
+
+class ResultStore:
+    """
+    Append-only chunked column store of comparison results.
+
+    Angles are in radians, intercepts and distances in meters. Missing values are NaN (or NaT for time).
+    """
+
+    def __init__(self, directory, stars=None, locations=None, chunk_rows=CHUNK_ROWS):
+        """
+        Opens a store, creating it if the directory does not contain one.
+
+        :param directory: store directory
+        :param stars: star names. Required to create a store.
+        :param locations: location names. Required to create a store.
+        :param chunk_rows: rows per chunk of a new store
+        """
+        self.directory = directory
+        meta = os.path.join(directory, 'meta.json')
+
+        if os.path.exists(meta):
+            with open(meta) as f:
+                data = json.load(f)
+            if data.get('version') != VERSION:
+                raise ValueError("Unsupported result store version: "+str(data.get('version')))
+            self.stars = data['stars']
+            self.locations = data['locations']
+            self.chunk_rows = data['chunk_rows']
+            self.index = np.load(os.path.join(directory, 'index.npy'))
+        else:
+            if stars is None or locations is None:
+                raise ValueError("Star and location names are needed to create a result store")
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.stars = list(stars)
+            self.locations = list(locations)
+            self.chunk_rows = chunk_rows
+            self.index = np.zeros(0, dtype=INDEX)
+            _write(meta, json.dumps({'version': VERSION, 'stars': self.stars, 'locations': self.locations, 'chunk_rows': chunk_rows}).encode('utf-8'))
+            self._write_index()
+
+        self.pending = []
+        self.pending_rows = 0
+
+    def __len__(self):
+        return int(self.index['rows'].sum()) + self.pending_rows
+
+    def append(self, **columns):
+        """
+        Appends rows. Columns are arrays broadcast against each other. Fields that are not given are NaN (NaT for time).
+        Rows are written once a chunk is full, call flush() or close() to write the rest.
+        """
+        unknown = set(columns) - set(FIELD_NAMES)
+        if unknown:
+            raise ValueError("Unknown fields: "+", ".join(sorted(unknown)))
+
+        arrays = np.broadcast_arrays(*[np.asarray(v) for v in columns.values()])
+        count = arrays[0].size if arrays else 0
+        rows = np.empty(count, dtype=RECORD)
+        for name, dtype in FIELDS:
+            if name in columns:
+                rows[name] = arrays[list(columns).index(name)].ravel()
+            elif name == 'time':
+                rows[name] = np.datetime64('NaT')
+            elif name in ('star', 'location'):
+                raise ValueError("Missing field: "+name)
+            else:
+                rows[name] = np.nan
+
+        self.pending.append(rows)
+        self.pending_rows += count
+        while self.pending_rows >= self.chunk_rows:
+            self._write_chunk(self.chunk_rows)
+
+    def flush(self):
+        'Writes pending rows as a (possibly short) chunk'
+        if self.pending_rows:
+            self._write_chunk(self.pending_rows)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def chunk(self, i):
+        'Memory-mapped columns of chunk i as a dict of field name: array'
+        rows = int(self.index['rows'][i])
+        filename = self._chunk_filename(i)
+        columns = {}
+        offset = 0
+        for name, dtype in FIELDS:
+            columns[name] = np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=(rows,)) if rows else np.zeros(0, dtype)
+            offset += rows*np.dtype(dtype).itemsize
+        return columns
+
+    def candidates(self, stars=None, locations=None, start=None, end=None):
+        'Indexes of chunks whose index ranges can contain matching rows'
+        index = self.index
+        match = np.ones(len(index), dtype=bool)
+        for ids, low, high in ((stars, 'star_min', 'star_max'), (locations, 'location_min', 'location_max')):
+            if ids is not None:
+                ids = np.sort(np.asarray(ids, dtype=np.int64))
+                match &= np.searchsorted(ids, index[high], 'right') > np.searchsorted(ids, index[low], 'left')
+        # chunks without times (NaT) never match a time range
+        if start is not None:
+            match &= index['time_max'] >= np.datetime64(start, 'us')
+        if end is not None:
+            match &= index['time_min'] <= np.datetime64(end, 'us')
+        return np.nonzero(match)[0]
+
+    def query(self, stars=None, locations=None, start=None, end=None, fields=None):
+        """
+        Generates matching rows chunk by chunk, so memory use is bounded by the chunk size.
+
+        :param stars: star ids, or None for all
+        :param locations: location ids, or None for all
+        :param start: first UTC time (numpy datetime64 or naive UTC datetime), or None
+        :param end: last UTC time (inclusive), or None
+        :param fields: field names to return. Defaults to all fields.
+
+        :return: generator of dicts of field name: array
+        """
+        fields = fields or FIELD_NAMES
+        for i in self.candidates(stars, locations, start, end):
+            columns = self.chunk(i)
+            mask = np.ones(len(columns['star']), dtype=bool)
+            if stars is not None:
+                mask &= np.isin(columns['star'], stars)
+            if locations is not None:
+                mask &= np.isin(columns['location'], locations)
+            if start is not None:
+                mask &= columns['time'] >= np.datetime64(start, 'us')
+            if end is not None:
+                mask &= columns['time'] <= np.datetime64(end, 'us')
+            if mask.any():
+                yield dict((name, np.asarray(columns[name][mask])) for name in fields)
+
+    def select(self, stars=None, locations=None, start=None, end=None, fields=None):
+        'All matching rows at once. See query() for arguments.'
+        fields = fields or FIELD_NAMES
+        parts = list(self.query(stars, locations, start, end, fields))
+        return dict((name, np.concatenate([p[name] for p in parts]) if parts else np.zeros(0, RECORD[name])) for name in fields)
+
+    def star_ids(self, names):
+        return [self.stars.index(name) for name in names]
+
+    def location_ids(self, names):
+        return [self.locations.index(name) for name in names]
+
+    def _chunk_filename(self, i):
+        return os.path.join(self.directory, "%06d.chunk" % i)
+
+    def _write_chunk(self, count):
+        rows = np.concatenate(self.pending)
+        chunk, rest = rows[:count], rows[count:]
+        self.pending = [rest] if len(rest) else []
+        self.pending_rows = len(rest)
+
+        _write(self._chunk_filename(len(self.index)), b''.join(np.ascontiguousarray(chunk[name]).tobytes() for name in FIELD_NAMES))
+
+        entry = np.zeros(1, dtype=INDEX)
+        entry['rows'] = count
+        entry['star_min'], entry['star_max'] = chunk['star'].min(), chunk['star'].max()
+        entry['location_min'], entry['location_max'] = chunk['location'].min(), chunk['location'].max()
+        times = chunk['time'][~np.isnat(chunk['time'])]
+        entry['time_min'], entry['time_max'] = (times.min(), times.max()) if len(times) else (np.datetime64('NaT'), np.datetime64('NaT'))
+        self.index = np.concatenate((self.index, entry))
+        self._write_index()
+
+    def _write_index(self):
+        path = os.path.join(self.directory, 'index.npy')
+        temp = path+".tmp"
+        with open(temp, 'wb') as f:
+            np.save(f, self.index)
+        getattr(os, 'replace', os.rename)(temp, path)
+
+
+def _write(filename, data):
+    'Writes a file through a temporary file, so readers never see it half written'
+    temp = filename+".tmp"
+    with open(temp, 'wb') as f:
+        f.write(data)
+    getattr(os, 'replace', os.rename)(temp, filename)
+
+
+
+"""
+For testing only
+"""
+if __name__ == "__main__":
+
+    def test():
+        import shutil
+        import tempfile
+
+        directory = os.path.join(tempfile.mkdtemp(), "store")
+        try:
+            store = ResultStore(directory, ["a", "b", "c"], ["x", "y"], chunk_rows=100)
+            times = np.datetime64('2016-05-05T00:00:00', 'us') + np.arange(50)*np.timedelta64(60, 's')
+            for block in range(5):
+                t = times[block*10:(block + 1)*10][:, None, None]
+                store.append(star=np.arange(3)[None, None, :], location=np.arange(2)[None, :, None], time=t,
+                        globe_altitude=np.full((10, 2, 3), 0.5), flat_altitude=np.full((10, 2, 3), float(block)))
+            assert len(store) == 300 and len(store.index) == 3
+            store.close()
+            assert len(store.index) == 3 # 300 rows are exactly 3 chunks
+
+            store = ResultStore(directory)
+            assert store.stars == ["a", "b", "c"] and len(store) == 300
+            store.append(star=1, location=0, globe_azimuth=[0.1, 0.2])
+            store.close()
+            assert len(store.index) == 4 and len(ResultStore(directory)) == 302
+
+            rows = store.select(stars=store.star_ids(["b"]), locations=[1])
+            assert len(rows['star']) == 50 and np.all(rows['star'] == 1) and np.all(rows['location'] == 1)
+            assert np.all(np.isnan(rows['globe_azimuth']))
+
+            # time range queries only open chunks that can match
+            start, end = times[45], times[49]
+            assert list(store.candidates(start=start, end=end)) == [2]
+            rows = store.select(start=start, end=end, fields=['time', 'flat_altitude'])
+            assert len(rows['time']) == 5*6 and np.all(rows['flat_altitude'] == 4.0)
+
+            assert len(store.select(stars=[1], start=start)['star']) == 10
+            assert len(store.select(stars=[2], locations=[0], start=times[0], end=times[-1])['star']) == 50
+        finally:
+            shutil.rmtree(os.path.dirname(directory))
+
+    test()
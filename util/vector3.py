@@ -3,6 +3,8 @@
 
 import math
 
+import numpy as np
+
 class Vector3:
 
     def __init__(self, x, y, z):
@@ -66,6 +68,188 @@ class Vector3:
         return "<"+str(self.x)+","+str(self.y)+","+str(self.z)+">"
 
 
+class Matrix3:
+    """
+    3x3 matrix for composing several rotations into a single transform.
+
+    Rotation matrices match the direction of Vector3.rotateX/Y/Z.
+    """
+
+    def __init__(self, rows):
+        self.rows = tuple(tuple(float(i) for i in row) for row in rows)
+
+    @staticmethod
+    def identity():
+        return Matrix3(((1,0,0), (0,1,0), (0,0,1)))
+
+    @staticmethod
+    def rotationX(angle):
+        cos = math.cos(angle)
+        sin = math.sin(angle)
+        return Matrix3(((1,0,0), (0,cos,-sin), (0,sin,cos)))
+
+    @staticmethod
+    def rotationY(angle):
+        cos = math.cos(angle)
+        sin = math.sin(angle)
+        return Matrix3(((cos,0,sin), (0,1,0), (-sin,0,cos)))
+
+    @staticmethod
+    def rotationZ(angle):
+        cos = math.cos(angle)
+        sin = math.sin(angle)
+        return Matrix3(((cos,-sin,0), (sin,cos,0), (0,0,1)))
+
+    def multiply(self, other):
+        'Matrix product. The returned matrix applies other first, then self.'
+        columns = tuple(zip(*other.rows))
+        return Matrix3([[sum(a*b for a, b in zip(row, column)) for column in columns] for row in self.rows])
+
+    def transform(self, vector):
+        'Returns a new Vector3. The given vector is not modified.'
+        (a, b, c), (d, e, f), (g, h, i) = self.rows
+        x = vector.x
+        y = vector.y
+        z = vector.z
+        return Vector3(a*x + b*y + c*z, d*x + e*y + f*z, g*x + h*y + i*z)
+
+    def __str__(self):
+        return "["+", ".join("<"+",".join(map(str, row))+">" for row in self.rows)+"]"
+
+
+class Vector3Array:
+    """
+    Many Vector3 stored in one contiguous (N,3) float64 buffer. Operations work on all rows at once and, like Vector3, modify the array in place.
+
+    Angles and scales may be a single value shared by all rows or an array with one value per row.
+    Indexing with an integer gives a Vector3 view of that row. Indexing with a slice gives a Vector3Array view of those rows.
+    """
+
+    def __init__(self, data):
+        self.data = np.ascontiguousarray(data, dtype=np.float64).reshape(-1, 3)
+
+    @staticmethod
+    def zeros(count):
+        return Vector3Array(np.zeros((count, 3)))
+
+    @staticmethod
+    def from_components(x, y, z):
+        x, y, z = np.broadcast_arrays(x, y, z)
+        return Vector3Array(np.stack((np.ravel(x), np.ravel(y), np.ravel(z)), axis=-1))
+
+    @staticmethod
+    def from_vectors(vectors):
+        return Vector3Array([(v.x, v.y, v.z) for v in vectors])
+
+    @property
+    def x(self):
+        return self.data[:, 0]
+
+    @property
+    def y(self):
+        return self.data[:, 1]
+
+    @property
+    def z(self):
+        return self.data[:, 2]
+
+    def length(self):
+        return np.sqrt(np.einsum('ij,ij->i', self.data, self.data))
+
+    def norm(self):
+        self.data /= self.length()[:, None]
+        return self
+
+    def rotateX(self, angle):
+        return self._rotate(1, 2, angle)
+
+    def rotateY(self, angle):
+        return self._rotate(2, 0, angle)
+
+    def rotateZ(self, angle):
+        return self._rotate(0, 1, angle)
+
+    def _rotate(self, a, b, angle):
+        'Rotates the a/b plane in the same direction as Vector3.rotateX/Y/Z'
+        cos = np.cos(angle)
+        sin = np.sin(angle)
+        first = self.data[:, a].copy()
+        second = self.data[:, b]
+        self.data[:, a] = first*cos - second*sin
+        self.data[:, b] = second*cos + first*sin
+        return self
+
+    def transform(self, matrix):
+        'Applies a Matrix3 to every row in place'
+        self.data[...] = self.data.dot(np.array(matrix.rows).T)
+        return self
+
+    def add(self, other):
+        'Adds another Vector3Array with the same number of rows, or one Vector3 to every row'
+        if isinstance(other, Vector3Array):
+            self.data += other.data
+        else:
+            self.data += (other.x, other.y, other.z)
+        return self
+
+    def multiply(self, scale):
+        self.data *= np.reshape(scale, (-1, 1)) if np.ndim(scale) else scale
+        return self
+
+    def clone(self):
+        return Vector3Array(self.data.copy())
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            view = Vector3Array.__new__(Vector3Array)
+            view.data = self.data[index]
+            return view
+        return Vector3Row(self.data, index)
+
+    def __iter__(self):
+        for i in range(len(self.data)):
+            yield Vector3Row(self.data, i)
+
+    def __str__(self):
+        return "["+", ".join(str(row) for row in self)+"]"
+
+
+class Vector3Row(Vector3):
+    """
+    Vector3 view of one row of a Vector3Array. Changes write through to the array's buffer.
+    """
+
+    def __init__(self, data, index):
+        self.row = data[index]
+
+    @property
+    def x(self):
+        return float(self.row[0])
+
+    @x.setter
+    def x(self, value):
+        self.row[0] = value
+
+    @property
+    def y(self):
+        return float(self.row[1])
+
+    @y.setter
+    def y(self, value):
+        self.row[1] = value
+
+    @property
+    def z(self):
+        return float(self.row[2])
+
+    @z.setter
+    def z(self, value):
+        self.row[2] = value
+
+
 
 """
 For testing only
@@ -99,4 +283,32 @@ if __name__ == "__main__":
         assert v2.length() == 3.0
         assert v.length() == 6.0
 
+        v = Vector3(3,4,5)
+        m = Matrix3.rotationZ(0.7).multiply(Matrix3.rotationX(-1.1)).multiply(Matrix3.rotationY(2.5))
+        v2 = m.transform(v)
+        v.rotateY(2.5).rotateX(-1.1).rotateZ(0.7)
+        assert abs(v2.x - v.x) < 1e-12 and abs(v2.y - v.y) < 1e-12 and abs(v2.z - v.z) < 1e-12
+
+        # Vector3Array matches Vector3 row by row
+        vectors = [Vector3(3,4,0), Vector3(-1,2,5), Vector3(0,0,1)]
+        angles = [0.3, -2.0, 4.5]
+        array = Vector3Array.from_vectors(vectors)
+        array.rotateX(angles).rotateY(1.1).rotateZ(angles).multiply([1, 2, 3]).add(Vector3(1, 1, 1))
+        for vector, angle, scale, row in zip(vectors, angles, [1, 2, 3], array):
+            vector.rotateX(angle).rotateY(1.1).rotateZ(angle).multiply(scale).add(Vector3(1, 1, 1))
+            assert abs(row.x - vector.x) < 1e-12 and abs(row.y - vector.y) < 1e-12 and abs(row.z - vector.z) < 1e-12
+            assert abs(row.length() - vector.length()) < 1e-12
+
+        # rows are views
+        array[1].norm()
+        assert abs(array.length()[1] - 1.0) < 1e-12
+        array[1:].multiply(2)
+        assert abs(array.length()[1] - 2.0) < 1e-12
+        clone = array.clone().norm()
+        assert abs(clone.length() - 1.0).max() < 1e-12 and abs(array.length()[1] - 2.0) < 1e-12
+
+        array = Vector3Array.from_components([1, 0], [0, 1], 0)
+        array.transform(Matrix3.rotationZ(math.pi/2))
+        assert abs(array.y[0] - 1.0) < 1e-12 and abs(array.x[1] + 1.0) < 1e-12
+
     test()
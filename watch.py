@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import math
+import time
+
+import numpy as np
+
+import flat
+import globe
+
+from util.gmst import RADIANS_PER_SECOND
+
+DEFAULT_RATE = 10.0 # frames per second
+
+
+class Tracker:
+    """
+    Globe and flat azimuth/altitude of every (location, star) pair at any GMST, for live displays.
+
+    Everything that does not depend on time is computed once. Sidereal time only enters through the sine and cosine
+    of GMST, which are combined with the precomputed terms by the angle sum identities, so a frame costs a few
+    multiply-adds per pair plus the inverse trig functions for the final angles.
+    """
+
+    def __init__(self, ra, dec, lat, lon):
+        """
+        :param ra: array of star Right Ascensions in radians
+        :param dec: array of star Declinations in radians
+        :param lat: array of location latitudes in radians
+        :param lon: array of location longitudes in radians
+        """
+        ra = np.asarray(ra, dtype=np.float64)[None, :]
+        dec = np.asarray(dec, dtype=np.float64)[None, :]
+        lat = np.asarray(lat, dtype=np.float64)[:, None]
+        lon = np.asarray(lon, dtype=np.float64)[:, None]
+
+        # globe: local hour angle = gmst + (lon - ra)
+        offset = lon - ra
+        self.cos_offset = np.cos(offset)
+        self.sin_offset = np.sin(offset)
+        self.sin_lat = np.sin(lat)
+        self.cos_lat = np.cos(lat)
+        self.sin_dec = np.sin(dec)
+        self.cos_dec = np.cos(dec)
+        self.tan_dec = np.tan(dec)
+
+        # flat: base ray directions of the stars and sidereal time/colatitude terms of the locations
+        cos_dec = np.cos(dec)
+        self.base = (-cos_dec*np.sin(ra), cos_dec*np.cos(ra), np.sin(dec))
+        self.lon = lon
+        self.cos_lon = np.cos(lon)
+        self.sin_lon = np.sin(lon)
+        self.cos_colat = np.cos(math.pi/2.0 - lat)
+        self.sin_colat = np.sin(math.pi/2.0 - lat)
+
+    @property
+    def shape(self):
+        'Number of locations and stars'
+        return self.cos_offset.shape
+
+    def positions(self, gmst):
+        """
+        :param gmst: Greenwich Mean Sidereal Time in radians
+
+        :return: tuple of globe azimuth, globe altitude, flat azimuth and flat altitude arrays in radians, with one row per location
+        """
+        cos_gmst = math.cos(gmst)
+        sin_gmst = math.sin(gmst)
+
+        cos_lha = cos_gmst*self.cos_offset - sin_gmst*self.sin_offset
+        sin_lha = sin_gmst*self.cos_offset + cos_gmst*self.sin_offset
+        globe_azimuth, globe_altitude = globe.positions_from_terms(sin_lha, cos_lha, self.sin_lat, self.cos_lat, self.sin_dec, self.cos_dec, self.tan_dec)
+
+        cos_lst = cos_gmst*self.cos_lon - sin_gmst*self.sin_lon
+        sin_lst = sin_gmst*self.cos_lon + cos_gmst*self.sin_lon
+        x, y, z = flat._rotate_local(self.base[0], self.base[1], self.base[2], cos_lst, sin_lst, self.cos_colat, self.sin_colat)
+        flat_azimuth = flat._azimuths(x, y, gmst + self.lon)
+        flat_altitude = flat._altitudes(x, y, z)
+
+        return globe_azimuth, globe_altitude, flat_azimuth, flat_altitude
+
+
+def frames(start_gmst, rate=DEFAULT_RATE, duration=None, clock=time.monotonic, sleep=time.sleep):
+    """
+    Generates the GMST of each frame at a fixed frame rate, advancing with wall clock time from start_gmst.
+    Sleeps between frames, so a slow consumer skips frames rather than falling behind.
+
+    :param start_gmst: GMST in radians at the first frame
+    :param rate: frames per second
+    :param duration: seconds until the last frame, or None to run until the consumer stops
+
+    :return: generator of (seconds since first frame, GMST in radians)
+    """
+    if rate <= 0:
+        raise ValueError("Frame rate must be positive")
+
+    interval = 1.0/rate
+    start = clock()
+    frame = 0
+    while True:
+        elapsed = clock() - start
+        if duration is not None and elapsed > duration:
+            return
+
+        yield elapsed, start_gmst + elapsed*RADIANS_PER_SECOND
+
+        # sleep until the next frame that is still in the future
+        frame = max(frame + 1, int((clock() - start)/interval) + 1)
+        delay = start + frame*interval - clock()
+        if delay > 0:
+            sleep(delay)
+
+
+
+"""
+For testing only
+"""
+if __name__ == "__main__":
+
+    def test():
+        state = np.random.RandomState(3)
+        ra = state.uniform(0, math.pi*2.0, 40)
+        dec = np.arcsin(state.uniform(-1, 1, 40))
+        lat = np.arcsin(state.uniform(-1, 1, 7))
+        lon = state.uniform(-math.pi, math.pi, 7)
+
+        tracker = Tracker(ra, dec, lat, lon)
+        assert tracker.shape == (7, 40)
+
+        for gmst in (0.0, 1.5, 4.0, 100.0):
+            globe_azimuth, globe_altitude, flat_azimuth, flat_altitude = tracker.positions(gmst)
+
+            azimuth, altitude = globe.positions(ra[None, :], dec[None, :], lat[:, None], lon[:, None], gmst)
+            assert np.all(np.abs(np.angle(np.exp(1j*(globe_azimuth - azimuth)))) < 1e-9)
+            assert np.all(np.abs(globe_altitude - altitude) < 1e-9)
+
+            azimuth, altitude = flat.positions(ra[None, :], dec[None, :], lat[:, None], lon[:, None], gmst)
+            assert np.all(np.abs(np.angle(np.exp(1j*(flat_azimuth - azimuth)))) < 1e-9)
+            assert np.all(np.abs(flat_altitude - altitude) < 1e-9)
+
+        # frames follow a fake clock
+        now = [0.0]
+        def sleep(seconds):
+            now[0] += seconds
+        result = list(frames(1.0, rate=4, duration=1.0, clock=lambda: now[0], sleep=sleep))
+        assert [elapsed for elapsed, gmst in result] == [0.0, 0.25, 0.5, 0.75, 1.0]
+        assert abs(result[-1][1] - 1.0 - RADIANS_PER_SECOND) < 1e-15
+
+    test()